@@ -0,0 +1,100 @@
+"""
+Production server sizing for the app project.
+
+Works out how many gunicorn workers and threads to run from the cores and
+memory actually available to the container. Kept free of Django imports so
+it can be loaded by the gunicorn master before the app is.
+"""
+
+import math
+import os
+
+
+CGROUP_CPU_MAX = '/sys/fs/cgroup/cpu.max'
+CGROUP_CPU_QUOTA = '/sys/fs/cgroup/cpu/cpu.cfs_quota_us'
+CGROUP_CPU_PERIOD = '/sys/fs/cgroup/cpu/cpu.cfs_period_us'
+CGROUP_MEMORY_MAX = '/sys/fs/cgroup/memory.max'
+CGROUP_MEMORY_LIMIT = '/sys/fs/cgroup/memory/memory.limit_in_bytes'
+MEMINFO = '/proc/meminfo'
+
+DEFAULT_WORKER_MEMORY_MB = 128
+MIN_THREADS = 2
+MAX_THREADS = 8
+
+
+def _read(path):
+    """Return the stripped contents of a file or None if unreadable"""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cpu_count():
+    """Return the number of cores this process may use"""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    quota = None
+    cpu_max = _read(CGROUP_CPU_MAX)
+    if cpu_max:
+        limit, _, period = cpu_max.partition(' ')
+        if limit != 'max' and period:
+            quota = int(limit) / int(period)
+    else:
+        limit = _read(CGROUP_CPU_QUOTA)
+        period = _read(CGROUP_CPU_PERIOD)
+        if limit and period and int(limit) > 0:
+            quota = int(limit) / int(period)
+
+    if quota:
+        cores = min(cores, max(1, math.ceil(quota)))
+    return cores
+
+
+def memory_limit():
+    """Return the bytes of memory available to this process"""
+    for path in (CGROUP_MEMORY_MAX, CGROUP_MEMORY_LIMIT):
+        limit = _read(path)
+        if limit and limit != 'max':
+            # cgroup v1 reports "unlimited" as a huge page-aligned number
+            if int(limit) < 1 << 60:
+                return int(limit)
+
+    meminfo = _read(MEMINFO) or ''
+    for line in meminfo.splitlines():
+        if line.startswith('MemTotal:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def worker_count(cores, memory=None,
+                 worker_memory=DEFAULT_WORKER_MEMORY_MB * 1024 * 1024):
+    """Return the number of worker processes for the given resources"""
+    workers = 2 * cores + 1
+    if memory:
+        workers = min(workers, memory // worker_memory)
+    return max(1, workers)
+
+
+def thread_count(cores, workers):
+    """Return the threads per worker needed to keep every core busy"""
+    threads = math.ceil((2 * cores + 1) / workers)
+    return max(MIN_THREADS, min(MAX_THREADS, threads))
+
+
+def sizing(environ=os.environ):
+    """Return the (workers, threads) pair, honoring env overrides"""
+    cores = cpu_count()
+    worker_memory = int(environ.get(
+        'GUNICORN_WORKER_MEMORY_MB', DEFAULT_WORKER_MEMORY_MB
+    )) * 1024 * 1024
+
+    workers = int(environ.get('GUNICORN_WORKERS', 0)) or \
+        worker_count(cores, memory_limit(), worker_memory)
+    threads = int(environ.get('GUNICORN_THREADS', 0)) or \
+        thread_count(cores, workers)
+    return workers, threads
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -20,12 +22,17 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # See https://docs.djangoproject.com/en/2.1/howto/deployment/checklist/
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = 'x4f*4029fwbb^-y)+5hpjzs#t7h=2qyt2qq8bm1mcnedgckn^('
+SECRET_KEY = os.environ.get(
+    'SECRET_KEY',
+    'x4f*4029fwbb^-y)+5hpjzs#t7h=2qyt2qq8bm1mcnedgckn^(',
+)
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = bool(int(os.environ.get('DEBUG', 0)))
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [
+    host for host in os.environ.get('ALLOWED_HOSTS', '').split(',') if host
+]
 
 
 # Application definition
@@ -45,14 +52,52 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.PerformanceMiddleware',
+    'core.middleware.SamplingProfilerMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.SessionStackMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+# Session based middleware, run by SessionStackMiddleware on every path
+# except the token authenticated API routes under TOKEN_API_PREFIXES
+SESSION_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
+TOKEN_API_PREFIXES = ['/api/']
+
+# API only profile: drop the admin, sessions, CSRF, messages and static
+# files, which the token authenticated API does not use, for faster
+# worker startup and fewer middleware per request
+API_ONLY = bool(int(os.environ.get('API_ONLY', 0)))
+
+if API_ONLY:
+    INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in (
+        'django.contrib.admin',
+        'django.contrib.sessions',
+        'django.contrib.messages',
+        'django.contrib.staticfiles',
+    )]
+    MIDDLEWARE = [middleware for middleware in MIDDLEWARE
+                  if middleware not in (
+                      'core.middleware.SessionStackMiddleware',
+                      'django.middleware.clickjacking'
+                      '.XFrameOptionsMiddleware',
+                  )]
+    SESSION_MIDDLEWARE = []
+    REST_FRAMEWORK = {
+        'DEFAULT_AUTHENTICATION_CLASSES': (
+            'rest_framework.authentication.TokenAuthentication',
+        ),
+        'DEFAULT_RENDERER_CLASSES': (
+            'rest_framework.renderers.JSONRenderer',
+        ),
+    }
 
 ROOT_URLCONF = 'app.urls'
 
@@ -85,8 +130,64 @@ DATABASES = {
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 0)),
+    }
+}
+
+# Read replicas, e.g. DB_REPLICA_HOSTS=replica1,replica2. Safe reads are
+# routed to a random replica; writes, and every request from a client for
+# REPLICA_PIN_SECONDS after it writes, stay on the primary.
+
+DATABASE_REPLICAS = []
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = dict(
+        DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append(alias)
+
+# User shards, e.g. DB_SHARD_HOSTS=shard1,shard2. Each user's recipes, tags
+# and ingredients live on the shard picked by consistent hashing of the
+# user id; users, tokens and sessions stay on default, which is also a
+# shard. Run `manage.py reshard` after changing the shard list.
+
+DATABASE_SHARDS = ['default']
+for index, host in enumerate(
+        filter(None, os.environ.get('DB_SHARD_HOSTS', '').split(','))):
+    alias = f'shard_{index + 1}'
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host)
+    DATABASE_SHARDS.append(alias)
+
+DATABASE_ROUTERS = [
+    'core.routers.ShardRouter',
+    'core.routers.PrimaryReplicaRouter',
+]
+
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.1/topics/cache/
+# Shared by every worker, e.g.
+# CACHE_BACKEND=django.core.cache.backends.memcached.MemcachedCache and
+# CACHE_LOCATION=memcached:11211. The local memory default is private to
+# one process, so only suits a single worker: replica pins, and the
+# version stamps telling workers their name dictionaries (core.names) and
+# ingredient indexes (core.matching) changed, must reach every worker.
+
+LOCAL_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', LOCAL_CACHE_BACKEND),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
     }
 }
+if DATABASE_REPLICAS and CACHES['default']['BACKEND'] == LOCAL_CACHE_BACKEND:
+    raise ImproperlyConfigured(
+        'DB_REPLICA_HOSTS requires a shared CACHE_BACKEND to pin clients '
+        'to the primary across workers.'
+    )
 
 
 # Password validation
@@ -131,4 +232,51 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Recipe image variants are served with their file transfer handed to the
+# front server: X-Accel-Redirect to MEDIA_ACCEL_PREFIX (an nginx internal
+# location aliased to MEDIA_ROOT) if set, else X-Sendfile if MEDIA_SENDFILE,
+# else streamed by the WSGI server's file wrapper.
+
+MEDIA_ACCEL_PREFIX = os.environ.get('MEDIA_ACCEL_PREFIX', '')
+MEDIA_SENDFILE = bool(int(os.environ.get('MEDIA_SENDFILE', 0)))
+
 AUTH_USER_MODEL = 'core.User'
+
+# Query budgets declared with core.budgets.query_budget raise when exceeded
+# if strict (always under the test runner) and are logged otherwise.
+
+QUERY_BUDGET_STRICT = bool(int(os.environ.get('QUERY_BUDGET_STRICT', 0)))
+
+TEST_RUNNER = 'core.test_runner.QueryBudgetTestRunner'
+
+
+# Responses to POSTs sent with an Idempotency-Key header are replayed to
+# retries with the same key for this long; prune_idempotency_keys deletes
+# older ones.
+
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+# A key whose first request never finished, say because its worker died,
+# answers retries with 409 only for this long, a little over the gunicorn
+# timeout, and is then taken over by the next retry.
+IDEMPOTENCY_KEY_LEASE = int(os.environ.get('IDEMPOTENCY_KEY_LEASE', 60))
+
+# Prometheus metrics at /metrics/, answered only to scrapers sending
+# `Authorization: Bearer <METRICS_TOKEN>` and hidden while it is unset.
+# Each gunicorn worker writes its histograms under METRICS_DIR, and the
+# worker answering a scrape sums them; leave it empty for a single process.
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# Sampling profiler for slow requests
+# Requests that take longer than PROFILER_THRESHOLD_MS are written to
+# PROFILER_DIR as collapsed stacks; merge them with `manage.py flamegraph`.
+# Only the newest PROFILER_MAX_FILES captures are kept, older ones being
+# deleted as new ones are written, so the profiler can be left on.
+
+PROFILER_ENABLED = bool(int(os.environ.get('PROFILER_ENABLED', 0)))
+PROFILER_DIR = os.environ.get('PROFILER_DIR', '/vol/web/profiles')
+PROFILER_THRESHOLD_MS = int(os.environ.get('PROFILER_THRESHOLD_MS', 500))
+PROFILER_SAMPLE_EVERY = int(os.environ.get('PROFILER_SAMPLE_EVERY', 10))
+PROFILER_INTERVAL_MS = int(os.environ.get('PROFILER_INTERVAL_MS', 5))
+PROFILER_MAX_FILES = int(os.environ.get('PROFILER_MAX_FILES', 1000))
@@ -0,0 +1,55 @@
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from app import server
+
+
+class ServerSizingTests(SimpleTestCase):
+
+    def test_worker_count_from_cores(self):
+        """Test workers follow 2 * cores + 1 when memory is plentiful"""
+        workers = server.worker_count(4, memory=64 * 1024 ** 3)
+
+        self.assertEqual(workers, 9)
+
+    def test_worker_count_limited_by_memory(self):
+        """Test workers are capped by the memory budget"""
+        workers = server.worker_count(
+            8,
+            memory=512 * 1024 ** 2,
+            worker_memory=128 * 1024 ** 2
+        )
+
+        self.assertEqual(workers, 4)
+
+    def test_worker_count_at_least_one(self):
+        """Test a tiny memory limit still yields a worker"""
+        workers = server.worker_count(2, memory=1024)
+
+        self.assertEqual(workers, 1)
+
+    def test_thread_count_compensates_for_fewer_workers(self):
+        """Test threads grow when memory limits the workers"""
+        self.assertEqual(server.thread_count(8, 4), 5)
+        self.assertEqual(server.thread_count(1, 3), server.MIN_THREADS)
+        self.assertEqual(server.thread_count(32, 1), server.MAX_THREADS)
+
+    @patch('app.server.memory_limit', return_value=None)
+    @patch('app.server.cpu_count', return_value=2)
+    def test_sizing_env_overrides(self, cc, ml):
+        """Test explicit env values win over the computed sizing"""
+        workers, threads = server.sizing({
+            'GUNICORN_WORKERS': '3',
+            'GUNICORN_THREADS': '6',
+        })
+
+        self.assertEqual((workers, threads), (3, 6))
+
+    @patch('app.server.memory_limit', return_value=None)
+    @patch('app.server.cpu_count', return_value=2)
+    def test_sizing_defaults(self, cc, ml):
+        """Test sizing is derived from cores without overrides"""
+        workers, threads = server.sizing({})
+
+        self.assertEqual((workers, threads), (5, 2))
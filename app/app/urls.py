@@ -13,13 +13,23 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from django.conf import settings
 
+from core.images import VARIANT_ROOT
+from core.views import image_variant_view, metrics_view
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('metrics/', metrics_view, name='metrics'),
+    path(f'{settings.MEDIA_URL.lstrip("/")}{VARIANT_ROOT}/'
+         '<slug:image_digest>/<int:width>.<slug:fmt>',
+         image_variant_view, name='image-variant'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+
+if not settings.API_ONLY:
+    from django.contrib import admin
+
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
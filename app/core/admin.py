@@ -1,9 +1,50 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 from core import models
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator using the planner's row estimate for large unfiltered
+    tables on PostgreSQL instead of a full COUNT(*)
+    """
+    exact_below = 10000
+
+    def _estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql' or queryset.query.where:
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples FROM pg_class WHERE relname = %s',
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        return int(row[0]) if row else None
+
+    @cached_property
+    def count(self):
+        estimate = self._estimate()
+        if estimate is None or estimate < self.exact_below:
+            return super().count
+        return estimate
+
+
+class UserOwnedAdmin(admin.ModelAdmin):
+    """Admin for rows owned by a user, usable at large row counts"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    # Exact email matches use the unique index, then the user indexes
+    search_fields = ('=user__email',)
+    ordering = ('-id',)
+
+
 class UserAdmin(BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
@@ -24,7 +65,25 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class TagAdmin(UserOwnedAdmin):
+    list_display = ('name', 'user', 'recipe_count')
+
+
+class IngredientAdmin(UserOwnedAdmin):
+    list_display = ('name', 'user', 'recipe_count')
+
+
+class RecipeAdmin(UserOwnedAdmin):
+    list_display = ('title', 'user', 'time_minutes', 'price')
+    raw_id_fields = ('user', 'tags', 'ingredients')
+
+    def price(self, obj):
+        return obj.price
+    price.admin_order_field = 'price_cents'
+
+
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, TagAdmin)
+admin.site.register(models.Ingredient, IngredientAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.WebhookSubscription)
@@ -0,0 +1,376 @@
+"""Reproducible API benchmarks driven through the Django test client"""
+import io
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.http import HttpResponse
+from django.test.client import Client, RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from faker import Faker
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from core.middleware import SessionStackMiddleware
+from core.models import Tag, Ingredient, Recipe, cents_to_decimal
+
+
+SCALES = {
+    'small': {'recipes': 50, 'tags': 10, 'ingredients': 40, 'per_recipe': 5},
+    'medium': {'recipes': 500, 'tags': 30, 'ingredients': 200,
+               'per_recipe': 10},
+    'large': {'recipes': 5000, 'tags': 100, 'ingredients': 1000,
+              'per_recipe': 15},
+}
+
+BENCHMARK_PASSWORD = 'benchmark-password'
+
+
+def build_dataset(scale='small', seed=0):
+    """Create a user with a seeded collection of recipes and return it"""
+    sizes = SCALES[scale]
+    fake = Faker()
+    fake.seed_instance(seed)
+    rand = random.Random(seed)
+
+    user = get_user_model().objects.create_user(
+        email=f'benchmark-{seed}@example.com',
+        password=BENCHMARK_PASSWORD,
+        name=fake.name()
+    )
+    Tag.objects.bulk_create(
+        Tag(user=user, name=fake.word()) for _ in range(sizes['tags'])
+    )
+    Ingredient.objects.bulk_create(
+        Ingredient(user=user, name=fake.word())
+        for _ in range(sizes['ingredients'])
+    )
+    Recipe.objects.bulk_create(
+        Recipe(
+            user=user,
+            title=fake.sentence(nb_words=4),
+            time_minutes=rand.randint(5, 240),
+            price=round(rand.uniform(1, 100), 2),
+            link=fake.url(),
+        )
+        for _ in range(sizes['recipes'])
+    )
+    tags = list(Tag.objects.filter(user=user).order_by('id'))
+    ingredients = list(Ingredient.objects.filter(user=user).order_by('id'))
+    recipes = list(Recipe.objects.filter(user=user).order_by('id'))
+
+    tag_links = []
+    ingredient_links = []
+    for recipe in recipes:
+        for tag in rand.sample(tags, min(len(tags), 3)):
+            tag_links.append(
+                Recipe.tags.through(recipe_id=recipe.id, tag_id=tag.id)
+            )
+        count = rand.randint(1, sizes['per_recipe'])
+        for ingredient in rand.sample(ingredients, count):
+            ingredient_links.append(Recipe.ingredients.through(
+                recipe_id=recipe.id, ingredient_id=ingredient.id
+            ))
+    Recipe.tags.through.objects.bulk_create(tag_links)
+    Recipe.ingredients.through.objects.bulk_create(ingredient_links)
+
+    return {
+        'user': user,
+        'token': Token.objects.create(user=user).key,
+        'tags': [tag.id for tag in tags],
+        'ingredients': [ingredient.id for ingredient in ingredients],
+        'recipes': [recipe.id for recipe in recipes],
+        'random': rand,
+    }
+
+
+def _image():
+    """Return a small in-memory JPEG for the upload scenario"""
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(buf, format='JPEG')
+    buf.seek(0)
+    buf.name = 'benchmark.jpg'
+    return buf
+
+
+def _recipe_id(data):
+    return data['random'].choice(data['recipes'])
+
+
+def _recipe_payload(data):
+    rand = data['random']
+    return {
+        'title': 'Benchmark recipe',
+        'time_minutes': rand.randint(5, 240),
+        'price': '9.99',
+        'tags': rand.sample(data['tags'], 2),
+        'ingredients': rand.sample(data['ingredients'], 3),
+    }
+
+
+# name -> (method, url(data), payload(data) or None, content type)
+SCENARIOS = {
+    'recipe-list': (
+        'get', lambda d: reverse('recipe:recipe-list'), None, None),
+    'recipe-retrieve': (
+        'get', lambda d: reverse('recipe:recipe-detail',
+                                 args=[_recipe_id(d)]), None, None),
+    'recipe-batch': (
+        'get', lambda d: reverse('recipe:recipe-batch'),
+        lambda d: {'ids': ','.join(
+            map(str, d['random'].sample(d['recipes'], 10))
+        )}, None),
+    'recipe-filter': (
+        'get', lambda d: reverse('recipe:recipe-list'),
+        lambda d: {'tags': ','.join(map(str, d['tags'][:2]))}, None),
+    'recipe-range': (
+        'get', lambda d: reverse('recipe:recipe-list'),
+        lambda d: {'time_minutes_max': 30, 'price_max': '10.00',
+                   'ordering': 'price'}, None),
+    'recipe-create': (
+        'post', lambda d: reverse('recipe:recipe-list'),
+        _recipe_payload, 'application/json'),
+    'recipe-upload-image': (
+        'post', lambda d: reverse('recipe:recipe-upload-image',
+                                  args=[_recipe_id(d)]),
+        lambda d: {'image': _image()}, None),
+    'tag-list': (
+        'get', lambda d: reverse('recipe:tag-list'), None, None),
+    'ingredient-list': (
+        'get', lambda d: reverse('recipe:ingredient-list'), None, None),
+    'user-token': (
+        'post', lambda d: reverse('user:token'),
+        lambda d: {'email': d['user'].email,
+                   'password': BENCHMARK_PASSWORD}, None),
+    'user-me': (
+        'get', lambda d: reverse('user:me'), None, None),
+}
+
+
+def percentile(values, pct):
+    """Return the pct percentile of values by nearest rank"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _request(client, scenario, data):
+    method, url, payload, content_type = scenario
+    path = url(data)
+    kwargs = {'HTTP_AUTHORIZATION': f'Token {data["token"]}'}
+    if content_type:
+        kwargs['content_type'] = content_type
+    if payload is not None:
+        kwargs['data'] = payload(data)
+
+    response = getattr(client, method)(path, **kwargs)
+    if response.status_code >= 400:
+        raise RuntimeError(
+            f'{method.upper()} {path} returned {response.status_code}'
+        )
+    return response
+
+
+def run_scenario(name, data, iterations=50, warmup=5):
+    """Time a scenario and return its latency, query and allocation stats"""
+    scenario = SCENARIOS[name]
+    client = Client()
+
+    for _ in range(warmup):
+        _request(client, scenario, data)
+
+    timings = []
+    queries = []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            _request(client, scenario, data)
+            timings.append((time.perf_counter() - start) * 1000)
+        queries.append(len(ctx.captured_queries))
+
+    # Allocations are measured in a separate pass so tracing does not
+    # inflate the timings above.
+    allocations = []
+    for _ in range(min(iterations, 10)):
+        tracemalloc.start()
+        try:
+            _request(client, scenario, data)
+            allocations.append(tracemalloc.get_traced_memory()[1] / 1024)
+        finally:
+            tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'queries': max(queries),
+        'peak_alloc_kb': round(percentile(allocations, 50), 1),
+    }
+
+
+def compare(results, baseline, threshold=0.1):
+    """Return a description of every regression of results over baseline"""
+    regressions = []
+    for name, current in sorted(results['scenarios'].items()):
+        previous = baseline.get('scenarios', {}).get(name)
+        if previous is None:
+            continue
+        limit = previous['p95_ms'] * (1 + threshold)
+        if current['p95_ms'] > limit:
+            regressions.append(
+                f'{name}: p95 {current["p95_ms"]:.2f}ms > '
+                f'{previous["p95_ms"]:.2f}ms (+{threshold:.0%})'
+            )
+        if current['queries'] > previous['queries']:
+            regressions.append(
+                f'{name}: {current["queries"]} queries > '
+                f'{previous["queries"]}'
+            )
+    return regressions
+
+
+# Run in a fresh interpreter so every import is paid for again
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import django
+from django.core.wsgi import get_wsgi_application
+application = get_wsgi_application()
+from django.urls import get_resolver
+get_resolver().url_patterns
+startup = time.perf_counter() - start
+
+from django.test.client import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+client = Client()
+client.get('/api/recipe/tags/')
+start = time.perf_counter()
+for _ in range({requests}):
+    client.get('/api/recipe/tags/')
+per_request = (time.perf_counter() - start) / {requests}
+
+print(json.dumps({{
+    'startup_ms': startup * 1000,
+    'request_us': per_request * 1e6,
+    'modules': len(sys.modules),
+    'pillow_loaded': 'PIL' in sys.modules,
+}}))
+"""
+
+
+def measure_startup(api_only, requests=200):
+    """Return the startup time and per request overhead of a worker
+
+    A new interpreter loads the WSGI application and URLconf, then sends
+    unauthenticated requests that are rejected before any query, so only
+    the middleware, routing and authentication are timed.
+    """
+    env = dict(os.environ, API_ONLY=str(int(api_only)))
+    output = subprocess.run(
+        [sys.executable, '-c', STARTUP_PROBE.format(requests=requests)],
+        env=env, cwd=settings.BASE_DIR, check=True,
+        stdout=subprocess.PIPE,
+    ).stdout
+    return json.loads(output.decode().splitlines()[-1])
+
+
+def startup_profile(api_only, runs=5, requests=200):
+    """Return the medians of several startup measurements"""
+    samples = [measure_startup(api_only, requests) for _ in range(runs)]
+    return {
+        'startup_ms': statistics.median(s['startup_ms'] for s in samples),
+        'request_us': statistics.median(s['request_us'] for s in samples),
+        'modules': samples[-1]['modules'],
+        'pillow_loaded': any(s['pillow_loaded'] for s in samples),
+    }
+
+
+def middleware_overhead(iterations=2000, path='/api/recipe/recipe/'):
+    """Return the microseconds a request to path spends in the session
+    middleware, run in full and through the token API fast path
+    """
+    middleware = SessionStackMiddleware(lambda request: HttpResponse())
+    factory = RequestFactory()
+
+    def per_request(handler):
+        requests = [factory.get(path, HTTP_AUTHORIZATION='Token benchmark')
+                    for _ in range(iterations)]
+        start = time.perf_counter()
+        for request in requests:
+            handler(request)
+        return (time.perf_counter() - start) / iterations * 1e6
+
+    return {
+        'session_us': per_request(middleware.session_stack),
+        'fast_path_us': per_request(middleware),
+    }
+
+
+def _best_of(repeat, func, *args):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings) * 1000
+
+
+def price_formats(count=100000, repeat=5, seed=0):
+    """Return the milliseconds spent serializing count prices held as
+    Decimal and as cents, and summing them in SQL over a numeric column,
+    as the old price was stored, and over an integer cents column
+    """
+    from rest_framework import serializers
+    from recipe.serializers import CentsField
+
+    rand = random.Random(seed)
+    cents = [rand.randint(100, 99999) for _ in range(count)]
+    decimals = [cents_to_decimal(value) for value in cents]
+    decimal_field = serializers.DecimalField(max_digits=12,
+                                             decimal_places=2)
+    cents_field = CentsField()
+
+    def serialize(field, values):
+        return [field.to_representation(value) for value in values]
+
+    def total(cursor, column):
+        cursor.execute(f'SELECT SUM({column}) FROM benchmark_prices')
+        return cursor.fetchone()
+
+    stats = {
+        'serialize_decimal_ms': _best_of(repeat, serialize, decimal_field,
+                                         decimals),
+        'serialize_cents_ms': _best_of(repeat, serialize, cents_field,
+                                       cents),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE benchmark_prices '
+                       '(price NUMERIC(12, 2) NOT NULL, '
+                       'price_cents INTEGER NOT NULL)')
+        try:
+            cursor.executemany(
+                'INSERT INTO benchmark_prices VALUES (%s, %s)',
+                list(zip(decimals, cents))
+            )
+            stats['sum_decimal_ms'] = _best_of(repeat, total, cursor,
+                                               'price')
+            stats['sum_cents_ms'] = _best_of(repeat, total, cursor,
+                                             'price_cents')
+        finally:
+            cursor.execute('DROP TABLE benchmark_prices')
+    return stats
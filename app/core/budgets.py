@@ -0,0 +1,60 @@
+"""Declarative per-action query budgets for API views"""
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,?)+\)', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+# Transaction control is issued differently per backend and never N+1
+TRANSACTION_STATEMENTS = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT',
+                          'RELEASE SAVEPOINT')
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when an action runs more queries than allowed"""
+
+
+def query_budget(**budgets):
+    """Class decorator declaring the maximum queries per view action"""
+    def decorator(cls):
+        cls.query_budgets = {**getattr(cls, 'query_budgets', {}), **budgets}
+        return cls
+    return decorator
+
+
+def fingerprint(sql):
+    """Return sql with literals and IN lists normalized to placeholders"""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def check(view_class, action, statements):
+    """Raise or log when statements exceed the view's budget for action"""
+    budget = getattr(view_class, 'query_budgets', {}).get(action)
+    if budget is None or len(statements) <= budget:
+        return
+
+    statements = [sql for sql in statements
+                  if not sql.upper().startswith(TRANSACTION_STATEMENTS)]
+    if len(statements) <= budget:
+        return
+
+    fingerprints = Counter(fingerprint(sql) for sql in statements)
+    message = '{}.{} ran {} queries, budget is {}:\n{}'.format(
+        view_class.__name__, action, len(statements), budget,
+        '\n'.join(f'  {count}x {sql}'
+                  for sql, count in fingerprints.most_common())
+    )
+    if settings.QUERY_BUDGET_STRICT:
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
@@ -0,0 +1,141 @@
+"""Replay of stored responses to POSTs retried with an Idempotency-Key"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.models import IdempotencyKey
+from core.routers import use_primary
+
+
+HEADER = 'HTTP_IDEMPOTENCY_KEY'
+MAX_KEY_LENGTH = 255
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def _error(detail, code):
+    return Response({'detail': detail}, status=code)
+
+
+def _value(value):
+    if isinstance(value, UploadedFile):
+        return f'{value.name}:{value.size}'
+    return value
+
+
+def fingerprint(request):
+    """Return a hash of the method, path and data of a request, reading
+    uploaded files by name and size only
+    """
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = {key: [_value(value) for value in values]
+                for key, values in data.lists()}
+    payload = json.dumps([request.method, request.path, data],
+                         sort_keys=True, cls=JSONEncoder)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _claim(user, key, digest):
+    """Insert the row of a key, or take over an expired or abandoned one,
+    returning (None, claim time) if claimed and (row, None) with the row
+    stored by an earlier request otherwise
+    """
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    abandoned = now - timedelta(seconds=settings.IDEMPOTENCY_KEY_LEASE)
+    stale = Q(created_at__lte=expired) | \
+        Q(status_code__isnull=True, created_at__lte=abandoned)
+    keys = IdempotencyKey.objects.filter(user=user, key=key)
+    while True:
+        try:
+            with transaction.atomic():
+                claimed = IdempotencyKey.objects.create(user=user, key=key,
+                                                        fingerprint=digest)
+            return None, claimed.created_at
+        except IntegrityError:
+            stored = keys.first()
+        if stored is None:
+            continue
+        if stored.created_at > expired and (
+                stored.status_code is not None
+                or stored.created_at > abandoned):
+            return stored, None
+        # Take over the key unless another request just did
+        if keys.filter(stale).update(fingerprint=digest, status_code=None,
+                                     body='', created_at=now):
+            return None, now
+
+
+def idempotent(handler):
+    """Decorate a POST view method to store its successful response under
+    the request's Idempotency-Key and replay it to retries without calling
+    the method again
+    """
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.META.get(HEADER)
+        if not key:
+            return handler(view, request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return _error(f'Idempotency-Key is longer than '
+                          f'{MAX_KEY_LENGTH} characters.',
+                          status.HTTP_400_BAD_REQUEST)
+
+        digest = fingerprint(request)
+        with use_primary():
+            stored, claimed_at = _claim(request.user, key, digest)
+        if stored is not None:
+            if stored.fingerprint != digest:
+                return _error('Idempotency-Key was used for a different '
+                              'request.',
+                              status.HTTP_422_UNPROCESSABLE_ENTITY)
+            if stored.status_code is None:
+                return _error('A request with this Idempotency-Key is in '
+                              'progress.', status.HTTP_409_CONFLICT)
+            response = Response(json.loads(stored.body),
+                                status=stored.status_code)
+            response[REPLAYED_HEADER] = 'true'
+            return response
+
+        # Only while this request still holds the key, which a retry may
+        # take over once the lease has run out
+        claimed = IdempotencyKey.objects.filter(
+            user=request.user, key=key, created_at=claimed_at,
+            status_code__isnull=True,
+        )
+        try:
+            response = handler(view, request, *args, **kwargs)
+        except Exception:
+            claimed.delete()
+            raise
+        if status.is_success(response.status_code):
+            claimed.update(
+                status_code=response.status_code,
+                body=json.dumps(response.data, cls=JSONEncoder),
+            )
+        else:
+            # Failed requests may be fixed and retried with the same key
+            claimed.delete()
+        return response
+    return wrapper
+
+
+def prune(ttl=None):
+    """Delete the keys older than ttl seconds, returning how many"""
+    if ttl is None:
+        ttl = settings.IDEMPOTENCY_KEY_TTL
+    expired = timezone.now() - timedelta(seconds=ttl)
+    deleted, _ = IdempotencyKey.objects.filter(created_at__lte=expired) \
+        .delete()
+    return deleted
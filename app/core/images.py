@@ -0,0 +1,140 @@
+"""Resized variants of recipe images under content hash names"""
+import hashlib
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse, \
+                        HttpResponseNotModified
+
+
+VARIANT_ROOT = 'uploads/recipe/variants'
+WIDTHS = (160, 320, 640, 1280)
+THUMBNAIL_WIDTH = 320
+# Format name to Pillow format and content type, best compression first
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+QUALITY = 85
+# Names change with the content, so caches may keep them for good
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def formats():
+    """Return the variant formats this Pillow build can write"""
+    # Pillow is imported on first use to keep it out of API worker startup
+    from PIL import features
+    return [fmt for fmt in FORMATS
+            if fmt != 'webp' or features.check('webp')]
+
+
+def digest(file):
+    """Return the content hash of a file, leaving it rewound"""
+    sha = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        sha.update(chunk)
+    file.seek(0)
+    return sha.hexdigest()[:16]
+
+
+def variant_name(image_digest, width, fmt):
+    """Return the storage name of a variant"""
+    return f'{VARIANT_ROOT}/{image_digest}/{width}.{fmt}'
+
+
+def variant_names(image_digest):
+    """Return the storage names of every variant of an image"""
+    return [variant_name(image_digest, width, fmt)
+            for width in WIDTHS for fmt in FORMATS]
+
+
+def variant_url(image_digest, width, fmt='jpeg'):
+    """Return the URL of a variant, None for recipes without an image"""
+    if not image_digest:
+        return None
+    return default_storage.url(variant_name(image_digest, width, fmt))
+
+
+def pick(width=None, fmt=None, accept=''):
+    """Return the (width, format) of the variant to serve for a requested
+    width and format, the format defaulting to WebP if accepted
+    """
+    if width is None:
+        width = THUMBNAIL_WIDTH
+    width = next((size for size in WIDTHS if size >= width), WIDTHS[-1])
+    available = formats()
+    if fmt not in available:
+        fmt = 'webp' if 'image/webp' in accept and 'webp' in available \
+            else 'jpeg'
+    return width, fmt
+
+
+def _resize(image, width):
+    """Return image scaled down to width, never scaled up"""
+    from PIL import Image
+    if image.width <= width:
+        return image
+    height = max(1, round(image.height * width / image.width))
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def generate(file):
+    """Write every variant of an uploaded image, returning its digest
+
+    Variants already written for the same content are kept, so uploading
+    an image twice costs one hash.
+    """
+    image_digest = digest(file)
+    names = [(width, fmt, variant_name(image_digest, width, fmt))
+             for width in WIDTHS for fmt in formats()]
+    missing = [row for row in names if not default_storage.exists(row[2])]
+    if not missing:
+        return image_digest
+
+    from PIL import Image
+    with Image.open(file) as original:
+        original = original.convert('RGB')
+    # Largest first so each variant is resized from a smaller image
+    for width in sorted({width for width, _, _ in missing}, reverse=True):
+        original = _resize(original, width)
+        for fmt in (fmt for size, fmt, _ in missing if size == width):
+            buf = io.BytesIO()
+            original.save(buf, format=FORMATS[fmt][0], quality=QUALITY)
+            default_storage.save(variant_name(image_digest, width, fmt),
+                                 ContentFile(buf.getvalue()))
+    file.seek(0)
+    return image_digest
+
+
+def serve(request, image_digest, width, fmt):
+    """Return a response sending a variant with immutable cache headers,
+    leaving the transfer to the front server when configured
+    """
+    if width not in WIDTHS or fmt not in FORMATS:
+        raise Http404
+    name = variant_name(image_digest, width, fmt)
+    etag = f'"{image_digest}-{width}-{fmt}"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        response = HttpResponseNotModified()
+    else:
+        path = default_storage.path(name)
+        if not os.path.isfile(path):
+            raise Http404
+        content_type = FORMATS[fmt][1]
+        if settings.MEDIA_ACCEL_PREFIX:
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = \
+                f'{settings.MEDIA_ACCEL_PREFIX.rstrip("/")}/{name}'
+        elif settings.MEDIA_SENDFILE:
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            response = FileResponse(open(path, 'rb'),
+                                    content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
@@ -0,0 +1,88 @@
+import json
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, \
+                              teardown_test_environment
+
+from core import benchmarks, routers
+
+
+class Command(BaseCommand):
+    """Django command to benchmark every API endpoint on a seeded dataset"""
+    help = 'Benchmark the API against a seeded test database and compare ' \
+           'the results with a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', default='small',
+                            choices=sorted(benchmarks.SCALES))
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            choices=sorted(benchmarks.SCENARIOS),
+                            help='Only run this scenario (repeatable)')
+        parser.add_argument('--output', help='Write results to this JSON file')
+        parser.add_argument('--baseline',
+                            help='Compare against this JSON results file')
+        parser.add_argument('--threshold', type=float, default=0.1,
+                            help='Allowed p95 slowdown over the baseline')
+        parser.add_argument('--label', default='',
+                            help='Label stored with the results')
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(benchmarks.SCENARIOS)
+        results = {
+            'meta': {
+                'label': options['label'],
+                'scale': options['scale'],
+                'seed': options['seed'],
+                'iterations': options['iterations'],
+            },
+            'scenarios': {},
+        }
+
+        media_root = tempfile.mkdtemp()
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True
+        )
+        try:
+            with override_settings(MEDIA_ROOT=media_root), \
+                    routers.use_primary():
+                data = benchmarks.build_dataset(
+                    options['scale'], options['seed']
+                )
+                for name in names:
+                    stats = benchmarks.run_scenario(
+                        name, data, iterations=options['iterations']
+                    )
+                    results['scenarios'][name] = stats
+                    self.stdout.write(
+                        f'{name:<22} p50 {stats["p50_ms"]:>8.2f}ms  '
+                        f'p95 {stats["p95_ms"]:>8.2f}ms  '
+                        f'p99 {stats["p99_ms"]:>8.2f}ms  '
+                        f'{stats["queries"]:>3} queries  '
+                        f'{stats["peak_alloc_kb"]:>8.1f}KB'
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = benchmarks.compare(
+                results, baseline, options['threshold']
+            )
+            if regressions:
+                raise CommandError(
+                    'Performance regressions:\n' + '\n'.join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS('No regressions found'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    """Django command to compare Decimal and integer cent prices"""
+    help = 'Time serializing a large list of prices held as Decimal and ' \
+           'as integer cents, and summing them in SQL over a numeric and ' \
+           'an integer column'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000,
+                            help='Prices in the list and table')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Runs per measurement, the best is kept')
+
+    def handle(self, *args, **options):
+        stats = benchmarks.price_formats(options['count'], options['repeat'])
+        for label, old, new in (
+            ('serialize', stats['serialize_decimal_ms'],
+             stats['serialize_cents_ms']),
+            ('sql sum', stats['sum_decimal_ms'], stats['sum_cents_ms']),
+        ):
+            self.stdout.write(
+                f'{label:<10} Decimal {old:>9.2f}ms  cents {new:>9.2f}ms  '
+                f'{old / new:>6.1f}x faster'
+            )
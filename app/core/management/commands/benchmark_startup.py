@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from core import benchmarks
+
+
+class Command(BaseCommand):
+    """Django command to compare worker startup of the settings profiles"""
+    help = 'Measure worker import time and per request middleware ' \
+           'overhead with and without API_ONLY and the session fast path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Fresh interpreters started per profile')
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Requests timed in each interpreter')
+
+    def handle(self, *args, **options):
+        for label, api_only in (('full', False), ('api-only', True)):
+            stats = benchmarks.startup_profile(
+                api_only, options['runs'], options['requests']
+            )
+            pillow = 'yes' if stats['pillow_loaded'] else 'no'
+            self.stdout.write(
+                f'{label:<9} startup {stats["startup_ms"]:>8.1f}ms  '
+                f'{stats["request_us"]:>8.1f}us/request  '
+                f'{stats["modules"]:>4} modules  Pillow loaded: {pillow}'
+            )
+
+        overhead = benchmarks.middleware_overhead()
+        self.stdout.write(
+            f'session middleware on API routes: '
+            f'{overhead["session_us"]:.1f}us/request before, '
+            f'{overhead["fast_path_us"]:.1f}us/request with the fast path'
+        )
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import webhooks
+
+
+class Command(BaseCommand):
+    """Django command to deliver outbox events to webhook subscribers"""
+    help = 'Deliver pending recipe change events to webhook subscriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Events sent per request')
+        parser.add_argument('--max-batches', type=int, default=10,
+                            help='Requests per subscription and shard in '
+                                 'one pass')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds to wait for a subscriber')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Seconds between passes, 0 for one pass')
+
+    def handle(self, *args, **options):
+        while True:
+            for shard in settings.DATABASE_SHARDS:
+                delivered = webhooks.dispatch(
+                    shard,
+                    batch_size=options['batch_size'],
+                    max_batches=options['max_batches'],
+                    timeout=options['timeout'],
+                )
+                pruned = webhooks.prune(shard)
+                self.stdout.write(f'{shard}: delivered {delivered} events, '
+                                  f'pruned {pruned}')
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,56 @@
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    """Django command to merge profiler captures into flame graphs"""
+    help = 'Merge sampled request stacks into one flame graph per view ' \
+           'and action'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--input', default=None,
+                            help='Directory of captures (PROFILER_DIR)')
+        parser.add_argument('--output', default=None,
+                            help='Directory for merged flame graphs')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete the captures once merged')
+
+    def handle(self, *args, **options):
+        source = options['input'] or settings.PROFILER_DIR
+        output = options['output'] or os.path.join(source, 'flamegraphs')
+        if not os.path.isdir(source):
+            raise CommandError(f'No captures found in {source}')
+
+        groups = defaultdict(list)
+        for name in sorted(os.listdir(source)):
+            if name.endswith('.collapsed'):
+                view, action, _ = name.split('.', 2)
+                groups[(view, action)].append(os.path.join(source, name))
+
+        os.makedirs(output, exist_ok=True)
+        for (view, action), paths in sorted(groups.items()):
+            stacks = Counter()
+            for path in paths:
+                stacks.update(profiling.read_collapsed(path))
+
+            base = os.path.join(output, f'{view}.{action}')
+            profiling.write_collapsed(base + '.collapsed', stacks)
+            with open(base + '.svg', 'w') as f:
+                f.write(profiling.render_svg(stacks, f'{view}.{action}'))
+
+            if options['clear']:
+                for path in paths:
+                    os.remove(path)
+            self.stdout.write(
+                f'{view}.{action}: {len(paths)} captures, '
+                f'{sum(stacks.values())} samples'
+            )
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(groups)} flame graphs to {output}'
+        ))
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core import images
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Django command to write the resized variants of recipe images"""
+    help = 'Generate the resized variants of recipe images uploaded ' \
+           'before variants existed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Also rehash images that have a digest')
+
+    def handle(self, *args, **options):
+        total = 0
+        for alias in settings.DATABASE_SHARDS:
+            recipes = Recipe.objects.using(alias).exclude(image='') \
+                .exclude(image__isnull=True).order_by('pk')
+            if not options['all']:
+                recipes = recipes.filter(image_digest='')
+            for recipe in recipes.only('pk', 'image').iterator():
+                try:
+                    with recipe.image.open('rb') as file:
+                        digest = images.generate(file)
+                except (OSError, ValueError) as error:
+                    self.stderr.write(f'{alias} recipe {recipe.pk}: {error}')
+                    continue
+                Recipe.objects.using(alias).filter(pk=recipe.pk).update(
+                    image_digest=digest, updated_at=timezone.now()
+                )
+                total += 1
+        self.stdout.write(self.style.SUCCESS(f'Generated variants of '
+                                             f'{total} images'))
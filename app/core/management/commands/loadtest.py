@@ -0,0 +1,114 @@
+import argparse
+import json
+import threading
+import time
+from urllib import error, parse, request
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+ENDPOINTS = (
+    '/api/recipe/recipe/',
+    '/api/recipe/tags/',
+    '/api/recipe/ingredient/',
+)
+
+
+def concurrency_levels(value):
+    """Parse a comma separated list of connection counts"""
+    try:
+        levels = [int(level) for level in value.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Invalid concurrency {value!r}')
+    if not levels or min(levels) < 1:
+        raise argparse.ArgumentTypeError(f'Invalid concurrency {value!r}')
+    return levels
+
+
+class Command(BaseCommand):
+    """Django command to measure requests/sec of a running server"""
+    help = 'Hammer the recipe endpoints of a running server and report ' \
+           'requests/sec per endpoint'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000')
+        parser.add_argument('--token', help='Auth token to send')
+        parser.add_argument('--email', help='Email to obtain a token with')
+        parser.add_argument('--password', help='Password for --email')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to run each endpoint for')
+        parser.add_argument('--concurrency', type=concurrency_levels,
+                            default=[8],
+                            help='Connections to open, or a comma separated '
+                                 'sweep such as 1,8,32')
+        parser.add_argument('--profile', default='',
+                            help='Label for the server profile under test')
+
+    def _token(self, url, email, password):
+        """Obtain an auth token from the token endpoint"""
+        data = parse.urlencode({'email': email, 'password': password})
+        try:
+            with request.urlopen(url + '/api/user/token/',
+                                 data.encode()) as res:
+                return json.loads(res.read().decode())['token']
+        except error.URLError as exc:
+            raise CommandError(f'Unable to obtain a token: {exc}')
+
+    def _run(self, url, token, duration, concurrency):
+        """Request url from concurrent threads for duration seconds"""
+        counts = {'ok': 0, 'errors': 0, 'latency': 0.0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+        headers = {'Authorization': f'Token {token}'}
+
+        def worker():
+            ok = errors = 0
+            latency = 0.0
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                try:
+                    with request.urlopen(request.Request(url, headers=headers)
+                                         ) as res:
+                        res.read()
+                    ok += 1
+                except (error.URLError, OSError):
+                    errors += 1
+                latency += time.perf_counter() - start
+            with lock:
+                counts['ok'] += ok
+                counts['errors'] += errors
+                counts['latency'] += latency
+
+        threads = [threading.Thread(target=worker)
+                   for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        counts['elapsed'] = time.perf_counter() - start
+        return counts
+
+    def handle(self, *args, **options):
+        url = options['url'].rstrip('/')
+        token = options['token']
+        if not token:
+            if not options['email'] or not options['password']:
+                raise CommandError('Pass --token or --email and --password')
+            token = self._token(url, options['email'], options['password'])
+
+        label = options['profile'] or url
+        for concurrency in options['concurrency']:
+            self.stdout.write(f'Load testing {label} with '
+                              f'{concurrency} connections...')
+            for endpoint in ENDPOINTS:
+                counts = self._run(url + endpoint, token,
+                                   options['duration'], concurrency)
+                total = counts['ok'] + counts['errors']
+                rps = counts['ok'] / counts['elapsed']
+                mean = counts['latency'] / total * 1000 if total else 0.0
+                self.stdout.write(
+                    f'{endpoint:<28} {rps:>9.1f} req/s  '
+                    f'{mean:>8.2f} ms mean  {counts["errors"]} errors'
+                )
+        self.stdout.write(self.style.SUCCESS('Load test complete!'))
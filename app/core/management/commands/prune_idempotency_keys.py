@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import idempotency
+
+
+class Command(BaseCommand):
+    """Django command to delete expired idempotency keys"""
+    help = 'Delete the stored responses of idempotency keys older than ' \
+           'IDEMPOTENCY_KEY_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ttl', type=int,
+                            default=settings.IDEMPOTENCY_KEY_TTL,
+                            help='Age in seconds of the keys to delete')
+
+    def handle(self, *args, **options):
+        deleted = idempotency.prune(options['ttl'])
+        self.stdout.write(self.style.SUCCESS(f'Pruned {deleted} keys'))
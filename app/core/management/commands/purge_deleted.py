@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import purge
+
+
+class Command(BaseCommand):
+    """Django command to remove soft deleted users and recipes"""
+    help = 'Delete soft deleted users and recipes in small batches, then ' \
+           'their image files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to sleep between batches')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pause = options['pause']
+        users = purge.purge_users(batch_size, pause)
+        recipes = sum(purge.purge_recipes(shard, batch_size, pause)
+                      for shard in settings.DATABASE_SHARDS)
+        self.stdout.write(self.style.SUCCESS(
+            f'Purged {users} users and {recipes} recipes'
+        ))
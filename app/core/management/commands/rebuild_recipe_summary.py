@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import summary
+
+
+class Command(BaseCommand):
+    """Django command to recompute the recipe summaries from scratch"""
+    help = 'Recompute every per-user recipe summary and the recipe counts ' \
+           'of tags and ingredients in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only rebuild this user id')
+
+    def handle(self, *args, **options):
+        total = 0
+        for alias in settings.DATABASE_SHARDS:
+            written = summary.rebuild(alias, options['users'])
+            self.stdout.write(f'{alias}: {written} summaries')
+            total += written
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {total} summaries'))
@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core import similarity
+
+
+class Command(BaseCommand):
+    """Django command to recompute the similar recipes of each recipe"""
+    help = 'Recompute the precomputed top-k similar recipes of every ' \
+           'recipe from their shared tags and ingredients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only refresh this user id')
+        parser.add_argument('--top', type=int, default=similarity.TOP_K,
+                            help='Neighbors kept per recipe')
+
+    def handle(self, *args, **options):
+        total = 0
+        for alias in settings.DATABASE_SHARDS:
+            users, rows = similarity.refresh(alias, options['users'],
+                                             options['top'])
+            self.stdout.write(f'{alias}: {rows} neighbors of {users} users')
+            total += rows
+        self.stdout.write(self.style.SUCCESS(f'Refreshed {total} neighbors'))
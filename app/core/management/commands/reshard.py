@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding
+from core.models import Tag, Ingredient, Recipe
+
+
+class Command(BaseCommand):
+    """Django command to move users' rows onto the shard that owns them"""
+    help = 'Move every user whose recipe data is not on the shard picked ' \
+           'by the hash ring onto that shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, action='append',
+                            dest='users', help='Only move this user id')
+        parser.add_argument('--source', action='append', default=[],
+                            dest='sources',
+                            help='Also drain this database (e.g. a shard '
+                                 'being removed)')
+        parser.add_argument('--dry-run', action='store_true')
+
+    def _user_ids(self, alias):
+        """Return the ids of every user with recipe data on alias"""
+        user_ids = set()
+        for model in (Tag, Ingredient, Recipe):
+            user_ids.update(
+                model.objects.using(alias)
+                .values_list('user_id', flat=True).distinct()
+            )
+        return user_ids
+
+    def handle(self, *args, **options):
+        sources = list(settings.DATABASE_SHARDS)
+        for alias in options['sources']:
+            if alias not in settings.DATABASES:
+                raise CommandError(f'Unknown database {alias}')
+            if alias not in sources:
+                sources.append(alias)
+
+        moved = 0
+        for source in sources:
+            user_ids = self._user_ids(source)
+            if options['users']:
+                user_ids &= set(options['users'])
+
+            for user_id in sorted(user_ids):
+                target = sharding.shard_for_user(user_id)
+                if target == source:
+                    continue
+                self.stdout.write(f'User {user_id}: {source} -> {target}')
+                if options['dry_run']:
+                    continue
+
+                user = get_user_model().objects.using('default') \
+                    .get(pk=user_id)
+                recipes = sharding.move_user(user, source, target)
+                self.stdout.write(f'  moved {recipes} recipes')
+                moved += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} users'))
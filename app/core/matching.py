@@ -0,0 +1,214 @@
+"""Per-user inverted index of ingredients to recipes held as bitsets"""
+import threading
+import uuid
+from collections import Counter, OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core.models import Recipe
+
+
+MAX_USERS = 256
+
+# Bit positions set in each byte value, to walk bitsets a byte at a time
+_BYTE_BITS = tuple(
+    tuple(bit for bit in range(8) if value >> bit & 1)
+    for value in range(256)
+)
+
+_lock = threading.Lock()
+_indexes = OrderedDict()
+
+
+def iter_bits(bits):
+    """Yield the positions of the set bits of an int, lowest first"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, 'little')
+    for offset, byte in enumerate(data):
+        if byte:
+            base = offset * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+class IngredientIndex:
+    """Ingredient to recipe bitsets of one user
+
+    Each recipe gets a slot; postings[ingredient] has the bits of the
+    slots of recipes using it and live the bits of recipes not deleted.
+    Updates are idempotent so they can be replayed safely.
+    """
+
+    def __init__(self, version=None):
+        self.version = version
+        self.recipe_ids = []
+        self.slots = {}
+        self.sizes = []
+        self.postings = {}
+        self.live = 0
+
+    def _slot(self, recipe_id):
+        slot = self.slots.get(recipe_id)
+        if slot is None:
+            slot = self.slots[recipe_id] = len(self.recipe_ids)
+            self.recipe_ids.append(recipe_id)
+            self.sizes.append(0)
+            self.live |= 1 << slot
+        return slot
+
+    def add(self, recipe_id, ingredient_ids):
+        """Record that a recipe uses ingredient_ids"""
+        slot = self._slot(recipe_id)
+        bit = 1 << slot
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id, 0)
+            if not posting & bit:
+                self.postings[ingredient_id] = posting | bit
+                self.sizes[slot] += 1
+
+    def discard(self, recipe_id, ingredient_ids):
+        """Record that a recipe no longer uses ingredient_ids"""
+        slot = self.slots.get(recipe_id)
+        if slot is None:
+            return
+        bit = 1 << slot
+        for ingredient_id in ingredient_ids:
+            posting = self.postings.get(ingredient_id, 0)
+            if posting & bit:
+                self.postings[ingredient_id] = posting & ~bit
+                self.sizes[slot] -= 1
+
+    def remove(self, recipe_id):
+        """Drop a deleted recipe from every answer"""
+        slot = self.slots.get(recipe_id)
+        if slot is not None:
+            self.live &= ~(1 << slot)
+
+    def drop_ingredient(self, ingredient_id):
+        """Forget a deleted ingredient"""
+        for slot in iter_bits(self.postings.pop(ingredient_id, 0)):
+            self.sizes[slot] -= 1
+
+    def match(self, ingredient_ids, limit=20, max_missing=None):
+        """Return (recipe_id, matched, missing, jaccard) of the recipes
+        sharing an ingredient with ingredient_ids, fewest missing first
+        """
+        wanted = set(ingredient_ids)
+        matched = Counter()
+        for ingredient_id in wanted:
+            posting = self.postings.get(ingredient_id, 0) & self.live
+            if posting:
+                matched.update(iter_bits(posting))
+
+        results = []
+        for slot, count in matched.items():
+            size = self.sizes[slot]
+            missing = size - count
+            if max_missing is not None and missing > max_missing:
+                continue
+            jaccard = count / (size + len(wanted) - count)
+            results.append((self.recipe_ids[slot], count, missing, jaccard))
+        results.sort(key=lambda row: (row[2], -row[3], row[0]))
+        return results[:limit]
+
+
+def _version_key(user_id):
+    return f'ingredient-index:{user_id}'
+
+
+def _version(user_id):
+    """Return the version stamp of a user's index, shared with other
+    processes through the cache configured in settings
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def build(user_id, using=None, version=None):
+    """Build a user's index from the recipe ingredients table"""
+    index = IngredientIndex(version)
+    links = Recipe.ingredients.through.objects.using(using).filter(
+        recipe__user_id=user_id,
+        recipe__deleted_at__isnull=True,
+    ).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+    recipe_ids = []
+    current = None
+    for recipe_id, ingredient_id in links.iterator():
+        if recipe_id != current:
+            if current is not None:
+                index.add(current, recipe_ids)
+            current, recipe_ids = recipe_id, []
+        recipe_ids.append(ingredient_id)
+    if current is not None:
+        index.add(current, recipe_ids)
+    return index
+
+
+def get(user_id, using=None):
+    """Return a user's index, rebuilding it if another process changed it"""
+    key = (using or 'default', user_id)
+    version = _version(user_id)
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None and index.version == version:
+            _indexes.move_to_end(key)
+            return index
+
+    index = build(user_id, using, version)
+    with _lock:
+        _indexes[key] = index
+        _indexes.move_to_end(key)
+        while len(_indexes) > MAX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear():
+    """Forget every index held by this process"""
+    with _lock:
+        _indexes.clear()
+
+
+def _update(user_id, using, apply):
+    """Once committed, apply a change to this process's index and move
+    the shared version on so other processes rebuild theirs
+    """
+    def commit():
+        key = (using or 'default', user_id)
+        version = uuid.uuid4().hex
+        with _lock:
+            index = _indexes.get(key)
+            current = cache.get(_version_key(user_id))
+            cache.set(_version_key(user_id), version, None)
+            if index is not None:
+                if index.version == current:
+                    apply(index)
+                    index.version = version
+                else:
+                    del _indexes[key]
+    transaction.on_commit(commit, using=using)
+
+
+def ingredients_added(user_id, using, recipe_id, ingredient_ids):
+    ingredient_ids = list(ingredient_ids)
+    _update(user_id, using,
+            lambda index: index.add(recipe_id, ingredient_ids))
+
+
+def ingredients_removed(user_id, using, recipe_id, ingredient_ids):
+    ingredient_ids = list(ingredient_ids)
+    _update(user_id, using,
+            lambda index: index.discard(recipe_id, ingredient_ids))
+
+
+def recipe_removed(user_id, using, recipe_id):
+    _update(user_id, using, lambda index: index.remove(recipe_id))
+
+
+def ingredient_deleted(user_id, using, ingredient_id):
+    _update(user_id, using,
+            lambda index: index.drop_ingredient(ingredient_id))
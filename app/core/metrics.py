@@ -0,0 +1,277 @@
+"""Per-request performance metrics exported in Prometheus text format"""
+import glob
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1.0,
+                   2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+# Seconds between writes of a worker's metrics file
+DUMP_SECONDS = 1.0
+# File of the metrics of exited workers, kept so counts never go back
+ARCHIVE = 'archive.json'
+
+_local = threading.local()
+_last_dump = 0.0
+_dump_lock = threading.Lock()
+
+
+class Histogram:
+    """Cumulative histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, documentation, buckets,
+                 labels=('view', 'action')):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.labels = labels
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        """Record a single observation for the given label values"""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = \
+                    [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def clear(self):
+        """Drop every recorded observation"""
+        with self._lock:
+            self._series.clear()
+
+    def snapshot(self):
+        """Return a copy of the series as [[labels, counts, sum, count]]"""
+        with self._lock:
+            return [[list(key), list(counts), total, count]
+                    for key, (counts, total, count) in self._series.items()]
+
+    def collect(self, *snapshots):
+        """Return the histogram in Prometheus text exposition format,
+        adding in the series of snapshots taken in other processes
+        """
+        lines = [
+            f'# HELP {self.name} {self.documentation}',
+            f'# TYPE {self.name} histogram',
+        ]
+        merged = {}
+        for key, counts, total, count in _merge(self.snapshot(),
+                                                *snapshots):
+            merged[key] = (counts, total, count)
+
+        for key, (counts, total, count) in sorted(merged.items()):
+            labels = ','.join(f'{name}="{value}"'
+                              for name, value in zip(self.labels, key))
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} '
+                             f'{cumulative}')
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{labels}}} {total}')
+            lines.append(f'{self.name}_count{{{labels}}} {count}')
+        return '\n'.join(lines)
+
+
+def _merge(*snapshots):
+    """Return the series of several snapshots of a histogram summed"""
+    merged = {}
+    for snapshot in snapshots:
+        for labels, counts, total, count in snapshot:
+            key = tuple(labels)
+            if key not in merged:
+                merged[key] = [[0] * len(counts), 0.0, 0]
+            series = merged[key]
+            series[0] = [a + b for a, b in zip(series[0], counts)]
+            series[1] += total
+            series[2] += count
+    return [(key, counts, total, count)
+            for key, (counts, total, count) in merged.items()]
+
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds',
+    'Wall time spent handling a request',
+    LATENCY_BUCKETS,
+)
+DB_SECONDS = Histogram(
+    'db_query_duration_seconds',
+    'Time spent executing SQL per request',
+    LATENCY_BUCKETS,
+)
+SERIALIZER_SECONDS = Histogram(
+    'serializer_duration_seconds',
+    'Time spent serializing response data per request',
+    LATENCY_BUCKETS,
+)
+DB_QUERIES = Histogram(
+    'db_queries_per_request',
+    'Number of SQL queries executed per request',
+    COUNT_BUCKETS,
+)
+DB_DUPLICATE_QUERIES = Histogram(
+    'db_duplicate_queries_per_request',
+    'Number of SQL queries repeated within a single request',
+    COUNT_BUCKETS,
+)
+
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, SERIALIZER_SECONDS,
+              DB_QUERIES, DB_DUPLICATE_QUERIES)
+
+
+class RequestStats:
+    """Timings and SQL statements collected while handling one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.view = 'unmatched'
+        self.view_class = None
+        self.action = ''
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.statements = []
+
+    @property
+    def query_count(self):
+        return len(self.statements)
+
+    @property
+    def duplicate_count(self):
+        return len(self.statements) - len(set(self.statements))
+
+    def __call__(self, execute, sql, params, many, context):
+        """Execute wrapper timing every query run on a connection"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.statements.append(sql)
+
+
+def start_request():
+    """Begin collecting stats for the request on this thread"""
+    stats = _local.stats = RequestStats()
+    return stats
+
+
+def finish_request():
+    """Stop collecting stats on this thread, record and return them"""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is None:
+        return None
+
+    elapsed = time.perf_counter() - stats.start
+    labels = (stats.view, stats.action)
+    REQUEST_SECONDS.observe(elapsed, *labels)
+    DB_SECONDS.observe(stats.db_time, *labels)
+    SERIALIZER_SECONDS.observe(stats.serializer_time, *labels)
+    DB_QUERIES.observe(stats.query_count, *labels)
+    DB_DUPLICATE_QUERIES.observe(stats.duplicate_count, *labels)
+    stats.elapsed = elapsed
+    return stats
+
+
+def current_request():
+    """Return the stats of the request being handled on this thread"""
+    return getattr(_local, 'stats', None)
+
+
+def _write(path, snapshots):
+    """Write snapshots to path, replacing it in one step for readers"""
+    temp = f'{path}.{os.getpid()}.tmp'
+    with open(temp, 'w') as f:
+        json.dump(snapshots, f)
+    os.replace(temp, path)
+
+
+def _read(path):
+    """Return the snapshots in a metrics file, {} if it is gone"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def dump(directory, interval=0):
+    """Write this process's histograms to its file under directory, unless
+    written less than interval seconds ago
+    """
+    global _last_dump
+    now = time.monotonic()
+    if now - _last_dump < interval or not _dump_lock.acquire(False):
+        return
+    try:
+        _last_dump = now
+        _write(os.path.join(directory, f'{os.getpid()}.json'),
+               {h.name: h.snapshot() for h in HISTOGRAMS})
+    finally:
+        _dump_lock.release()
+
+
+def archive(directory, pid):
+    """Fold the file of an exited worker into the archive, run by the
+    gunicorn master only
+    """
+    path = os.path.join(directory, f'{pid}.json')
+    dead = _read(path)
+    if not dead:
+        return
+    kept = _read(os.path.join(directory, ARCHIVE))
+    _write(os.path.join(directory, ARCHIVE), {
+        h.name: [[list(key), counts, total, count]
+                 for key, counts, total, count in
+                 _merge(kept.get(h.name, []), dead.get(h.name, []))]
+        for h in HISTOGRAMS
+    })
+    os.remove(path)
+
+
+def reset(directory):
+    """Delete the metrics files left under directory by an earlier run"""
+    os.makedirs(directory, exist_ok=True)
+    for path in glob.glob(os.path.join(directory, '*.json')):
+        os.remove(path)
+
+
+def collect(directory=''):
+    """Return every histogram in Prometheus text exposition format,
+    summed over the worker files under directory if given
+    """
+    files = []
+    if directory:
+        own = os.path.join(directory, f'{os.getpid()}.json')
+        files = [_read(path) for path in
+                 sorted(glob.glob(os.path.join(directory, '*.json')))
+                 if path != own]
+    return '\n'.join(h.collect(*(f.get(h.name, []) for f in files))
+                     for h in HISTOGRAMS) + '\n'
+
+
+class SerializerTimingMixin:
+    """Serializer mixin charging representation time to the request"""
+
+    def to_representation(self, instance):
+        stats = getattr(_local, 'stats', None)
+        if stats is None or stats.serializer_depth:
+            return super().to_representation(instance)
+
+        stats.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_time += time.perf_counter() - start
+            stats.serializer_depth -= 1
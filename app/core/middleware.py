@@ -0,0 +1,181 @@
+import hashlib
+import itertools
+import os
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.utils.module_loading import import_string
+
+from core import budgets, metrics, profiling, routers
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def view_labels(view_func, request):
+    """Return the (view, action) labels for a resolved view function"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return view_func.__name__, request.method.lower()
+
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return cls.__name__, action
+
+
+class PerformanceMiddleware:
+    """Record wall, DB and serializer time and query counts per request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics.start_request()
+        try:
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(
+                        conn.execute_wrapper(metrics.current_request())
+                    )
+                response = self.get_response(request)
+        finally:
+            stats = metrics.finish_request()
+            if settings.METRICS_DIR:
+                metrics.dump(settings.METRICS_DIR, metrics.DUMP_SECONDS)
+
+        response['Server-Timing'] = ', '.join((
+            f'app;dur={stats.elapsed * 1000:.2f}',
+            f'db;dur={stats.db_time * 1000:.2f};'
+            f'desc="{stats.query_count} queries, '
+            f'{stats.duplicate_count} duplicates"',
+            f'serializer;dur={stats.serializer_time * 1000:.2f}',
+        ))
+        if stats.view_class is not None:
+            budgets.check(stats.view_class, stats.action, stats.statements)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Label the request's stats with the view and action handling it"""
+        stats = metrics.current_request()
+        if stats is not None:
+            stats.view, stats.action = view_labels(view_func, request)
+            stats.view_class = getattr(view_func, 'cls', None)
+
+
+class SamplingProfilerMiddleware:
+    """Write sampled stacks of slow requests as collapsed stack files"""
+
+    def __init__(self, get_response):
+        if not settings.PROFILER_ENABLED:
+            raise MiddlewareNotUsed()
+
+        self.get_response = get_response
+        self.directory = settings.PROFILER_DIR
+        self.threshold = settings.PROFILER_THRESHOLD_MS / 1000
+        self.sample_every = max(1, settings.PROFILER_SAMPLE_EVERY)
+        self.interval = settings.PROFILER_INTERVAL_MS / 1000
+        self.max_files = settings.PROFILER_MAX_FILES
+        self.counter = itertools.count()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        if next(self.counter) % self.sample_every:
+            return self.get_response(request)
+
+        # Started per process on first use, after any fork
+        sampler = profiling.get_sampler(self.interval)
+        thread_id = threading.get_ident()
+        stacks = sampler.watch(thread_id)
+        request._profile_labels = ('unmatched', '')
+        start = time.perf_counter()
+        try:
+            return self.get_response(request)
+        finally:
+            sampler.unwatch(thread_id)
+            elapsed = time.perf_counter() - start
+            if stacks and elapsed >= self.threshold:
+                view, action = request._profile_labels
+                profiling.write_collapsed(
+                    profiling.capture_path(self.directory, view, action),
+                    stacks
+                )
+                profiling.rotate(self.directory, self.max_files)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        """Remember which view and action the sampled request hit"""
+        if hasattr(request, '_profile_labels'):
+            request._profile_labels = view_labels(view_func, request)
+
+
+class ReplicaRoutingMiddleware:
+    """Pin writes, and a client's requests shortly after one, to primary"""
+
+    def __init__(self, get_response):
+        if not settings.DATABASE_REPLICAS:
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+
+    def __call__(self, request):
+        key = self.pin_key(request)
+        writing = request.method not in SAFE_METHODS
+        if not writing and not (key and cache.get(key)):
+            return self.get_response(request)
+
+        with routers.use_primary():
+            response = self.get_response(request)
+        if writing and key and response.status_code < 400:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
+        return response
+
+    def pin_key(self, request):
+        """Return the cache key identifying the client of a request"""
+        credential = request.META.get('HTTP_AUTHORIZATION') or \
+            request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        if not credential:
+            return None
+        digest = hashlib.sha1(credential.encode()).hexdigest()
+        return f'replica-pin:{digest}'
+
+
+class SessionStackMiddleware:
+    """Run settings.SESSION_MIDDLEWARE except on token authenticated API
+    paths, which never read the session, CSRF cookie or messages
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefixes = tuple(settings.TOKEN_API_PREFIXES)
+        self.view_hooks = []
+        handler = get_response
+        for path in reversed(settings.SESSION_MIDDLEWARE):
+            try:
+                middleware = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(middleware, 'process_view'):
+                self.view_hooks.insert(0, middleware.process_view)
+            handler = middleware
+        self.session_stack = handler
+
+    def skips(self, request):
+        """Return True if request bypasses the session middleware"""
+        return request.path_info.startswith(self.prefixes)
+
+    def __call__(self, request):
+        if self.skips(request):
+            return self.get_response(request)
+        return self.session_stack(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.skips(request):
+            return None
+        for hook in self.view_hooks:
+            response = hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 19:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_recipe_neighbors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_digest',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
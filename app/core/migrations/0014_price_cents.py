@@ -0,0 +1,94 @@
+from django.db import migrations, models
+from django.db.models import F, Func, Value
+from django.db.models.functions import Cast
+
+
+def _round_cents(field, output_field):
+    return Cast(Func(F(field) * 100, function='ROUND'), output_field)
+
+
+def prices_to_cents(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeSummary = apps.get_model('core', 'RecipeSummary')
+    Recipe.objects.using(db).update(
+        price_cents=_round_cents('price', models.IntegerField())
+    )
+    RecipeSummary.objects.using(db).update(
+        total_price_cents=_round_cents('total_price',
+                                       models.BigIntegerField())
+    )
+
+
+def _round_prices(field, max_digits):
+    # Divide as floats so SQLite does not truncate to whole units
+    return Cast(F(field) / Value(100.0, models.FloatField()),
+                models.DecimalField(max_digits=max_digits, decimal_places=2))
+
+
+def cents_to_prices(apps, schema_editor):
+    db = schema_editor.connection.alias
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeSummary = apps.get_model('core', 'RecipeSummary')
+    Recipe.objects.using(db).update(
+        price=_round_prices('price_cents', 12)
+    )
+    RecipeSummary.objects.using(db).update(
+        total_price=_round_prices('total_price_cents', 16)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='price_cents',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='recipesummary',
+            name='total_price_cents',
+            field=models.BigIntegerField(default=0),
+        ),
+        # Nullable while both columns exist, so reversing can re-add price
+        # empty and fill it before it goes back to NOT NULL
+        migrations.AlterField(
+            model_name='recipe',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=5,
+                                      null=True),
+        ),
+        migrations.AlterField(
+            model_name='recipesummary',
+            name='total_price',
+            field=models.DecimalField(decimal_places=2, default=0,
+                                      max_digits=14, null=True),
+        ),
+        migrations.RunPython(prices_to_cents, cents_to_prices),
+        migrations.RemoveIndex(
+            model_name='recipe',
+            name='core_recipe_user_id_72b3b3_idx',
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='price',
+        ),
+        migrations.RemoveField(
+            model_name='recipesummary',
+            name='total_price',
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='price_cents',
+            field=models.IntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['user', 'price_cents'], name='core_recipe_user_id_3cf445_idx'),
+        ),
+    ]
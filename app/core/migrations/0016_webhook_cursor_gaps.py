@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 20:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_recipe_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookcursor',
+            name='gaps',
+            field=models.TextField(default='{}'),
+        ),
+    ]
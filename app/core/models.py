@@ -1,10 +1,27 @@
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, \
                                        PermissionsMixin
 from django.conf import settings
 
 import uuid
 import os
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def decimal_to_cents(value):
+    """Return an amount of money as whole cents, rounding half up"""
+    if value is None:
+        return None
+    return int(Decimal(str(value)).scaleb(2)
+               .to_integral_value(ROUND_HALF_UP))
+
+
+def cents_to_decimal(cents):
+    """Return whole cents as a Decimal with two places"""
+    if cents is None:
+        return None
+    return Decimal(cents).scaleb(-2)
 
 
 def recipe_image_file_path(instance, filename):
@@ -38,17 +55,34 @@ class UserManager(BaseUserManager):
         return user
 
 
+class UserOwnedManager(models.Manager):
+    """Manager for rows owned by a user, stored on that user's shard"""
+
+    def create(self, **kwargs):
+        """Create an object, letting the router place it by its owner"""
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
 class User(AbstractBaseUser, PermissionsMixin):
     """Custom user model that supports email instaead of username"""
     email = models.EmailField(max_length=255, unique=True)
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
+    def soft_delete(self):
+        """Deactivate the user, leaving the purge command to remove it"""
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['is_active', 'deleted_at'])
+
 
 class Tag(models.Model):
     """Tags to be used in a recipe"""
@@ -57,6 +91,16 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return self.name
@@ -69,6 +113,16 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
 
     def __str__(self):
         return self.name
@@ -82,11 +136,212 @@ class Recipe(models.Model):
     )
     title = models.CharField(max_length=255)
     time_minutes = models.IntegerField()
-    price = models.DecimalField(max_digits=5, decimal_places=2)
+    price_cents = models.IntegerField()
     link = models.CharField(max_length=255, blank=True)
     ingredients = models.ManyToManyField('Ingredient')
     tags = models.ManyToManyField('Tag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    image_digest = models.CharField(max_length=16, blank=True,
+                                    editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Incremented by every API update, which is refused if it changed
+    version = models.PositiveIntegerField(default=1)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'time_minutes']),
+            models.Index(fields=['user', 'price_cents']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded time, price and deletion to diff on save"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_totals = (
+            instance.__dict__.get('time_minutes'),
+            instance.__dict__.get('price_cents'),
+        )
+        instance._loaded_deleted_at = instance.__dict__.get('deleted_at')
+        return instance
+
+    @property
+    def price(self):
+        """Price as a Decimal, stored in whole cents"""
+        return cents_to_decimal(self.price_cents)
+
+    @price.setter
+    def price(self, value):
+        self.price_cents = decimal_to_cents(value)
+
+    def soft_delete(self):
+        """Hide the recipe, leaving the purge command to remove it
+
+        The version moves on in the same UPDATE so updates of the recipe
+        already in flight fail their version check.
+        """
+        self.deleted_at = timezone.now()
+        self.version = models.F('version') + 1
+        self.save(update_fields=['deleted_at', 'updated_at', 'version'])
+        self.refresh_from_db(fields=['version'])
 
     def __str__(self):
         return self.title
+
+
+class RecipeSummary(models.Model):
+    """Running totals of a user's recipes, kept up to date by signals"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_summary',
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    total_time_minutes = models.BigIntegerField(default=0)
+    total_price_cents = models.BigIntegerField(default=0)
+
+    objects = UserOwnedManager()
+
+    @property
+    def average_time_minutes(self):
+        if not self.recipe_count:
+            return None
+        return self.total_time_minutes / self.recipe_count
+
+    @property
+    def average_price_cents(self):
+        if not self.recipe_count:
+            return None
+        return round(self.total_price_cents / self.recipe_count)
+
+    def __str__(self):
+        return f'{self.user} ({self.recipe_count} recipes)'
+
+
+class Tombstone(models.Model):
+    """Record of a deleted tag, ingredient or recipe for delta sync"""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KIND_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    # No constraint so the rows deleted along with a user can still
+    # record their tombstones inside the same transaction.
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    kind = models.CharField(max_length=16, choices=KIND_CHOICES)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    objects = UserOwnedManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class RecipeNeighbor(models.Model):
+    """Precomputed similar recipe of a recipe, refreshed in batch"""
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='neighbors',
+    )
+    neighbor = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+    class Meta:
+        unique_together = ('recipe', 'rank')
+
+    def __str__(self):
+        return f'{self.recipe_id} #{self.rank}: {self.neighbor_id}'
+
+
+class OutboxEvent(models.Model):
+    """Change to recipe data, written in the transaction making it"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    topic = models.CharField(max_length=64)
+    object_id = models.IntegerField()
+    payload = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = UserOwnedManager()
+
+    def __str__(self):
+        return f'{self.topic} {self.object_id}'
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a POST made with an Idempotency-Key header"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Null while the first request with the key is still running
+    status_code = models.PositiveSmallIntegerField(null=True)
+    body = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+    def __str__(self):
+        return f'{self.user_id}: {self.key}'
+
+
+class WebhookSubscription(models.Model):
+    """Endpoint receiving batches of outbox events"""
+    url = models.URLField(max_length=255)
+    secret = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True)
+
+    def __str__(self):
+        return self.url
+
+
+class WebhookCursor(models.Model):
+    """Delivery progress of a subscription through the outbox of a shard"""
+    subscription = models.ForeignKey(
+        'WebhookSubscription',
+        on_delete=models.CASCADE,
+        related_name='cursors',
+    )
+    shard = models.CharField(max_length=64)
+    last_event_id = models.BigIntegerField(default=0)
+    # JSON object of ids below last_event_id not seen yet, to the time
+    # they were skipped
+    gaps = models.TextField(default='{}')
+    failures = models.PositiveIntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('subscription', 'shard')
+
+    def __str__(self):
+        return f'{self.subscription} @ {self.shard}'
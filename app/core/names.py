@@ -0,0 +1,120 @@
+"""Per-user id to name dictionaries of tags and ingredients"""
+import threading
+import uuid
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from core.models import Tag, Ingredient, Recipe
+
+
+MAX_USERS = 1024
+
+# Recipe relation name to the model it names
+RELATIONS = OrderedDict((('tags', Tag), ('ingredients', Ingredient)))
+
+_lock = threading.Lock()
+_dictionaries = OrderedDict()
+
+
+def _version_key(user_id):
+    return f'names-version:{user_id}'
+
+
+def _version(user_id):
+    """Return the version stamp of a user's dictionary, shared with other
+    processes through the cache configured in settings
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump(user_id, using='default'):
+    """Invalidate a user's dictionary in every process
+
+    The stamp changes now and again once the transaction commits, so no
+    process keeps names it read before the commit under the new stamp.
+    """
+    def stamp():
+        cache.set(_version_key(user_id), uuid.uuid4().hex, None)
+    stamp()
+    transaction.on_commit(stamp, using=using)
+
+
+def _union(querysets):
+    return querysets[0].union(*querysets[1:], all=True)
+
+
+def _load(user_id, using):
+    names = {relation: {} for relation in RELATIONS}
+    rows = _union([
+        model.objects.using(using).filter(user_id=user_id)
+        .annotate(relation=Value(relation, CharField()))
+        .values_list('id', 'name', 'relation')
+        for relation, model in RELATIONS.items()
+    ])
+    for pk, name, relation in rows:
+        names[relation][pk] = name
+    return names
+
+
+def get(user_id, using=None, refresh=False):
+    """Return {relation: {id: name}} for the tags and ingredients of a user,
+    from process memory unless the shared version stamp moved on
+    """
+    version = _version(user_id)
+    key = (using or 'default', user_id)
+    with _lock:
+        entry = _dictionaries.get(key)
+        if entry is not None and entry[0] == version and not refresh:
+            _dictionaries.move_to_end(key)
+            return entry[1]
+
+    names = _load(user_id, using)
+    with _lock:
+        _dictionaries[key] = (version, names)
+        _dictionaries.move_to_end(key)
+        while len(_dictionaries) > MAX_USERS:
+            _dictionaries.popitem(last=False)
+    return names
+
+
+def clear():
+    """Forget every dictionary held by this process"""
+    with _lock:
+        _dictionaries.clear()
+
+
+def attach_relation_ids(recipes):
+    """Set _relation_ids of each recipe to {relation: [ids]}, reading the
+    through tables of every relation in a single query per database
+    """
+    by_db = {}
+    for recipe in recipes:
+        recipe._relation_ids = {relation: [] for relation in RELATIONS}
+        by_db.setdefault(recipe._state.db, {})[recipe.pk] = recipe
+
+    for using, by_pk in by_db.items():
+        querysets = []
+        for relation in RELATIONS:
+            field = Recipe._meta.get_field(relation)
+            querysets.append(
+                field.remote_field.through.objects.using(using)
+                .filter(recipe_id__in=list(by_pk))
+                .annotate(relation=Value(relation, CharField()))
+                .values_list('recipe_id',
+                             f'{field.m2m_reverse_field_name()}_id',
+                             'relation')
+            )
+        for recipe_id, pk, relation in _union(querysets):
+            by_pk[recipe_id]._relation_ids[relation].append(pk)
+
+    for recipe in recipes:
+        for ids in recipe._relation_ids.values():
+            ids.sort()
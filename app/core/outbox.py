@@ -0,0 +1,23 @@
+"""Transactional outbox of changes to recipe data"""
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from core import sharding
+from core.models import OutboxEvent
+
+
+def atomic(user):
+    """Return a transaction on the database holding user's recipe data"""
+    return transaction.atomic(using=sharding.shard_for_user(user.pk))
+
+
+def record(instance, action, payload):
+    """Write an event for instance on the database it was saved to"""
+    return OutboxEvent.objects.using(instance._state.db).create(
+        user_id=instance.user_id,
+        topic=f'{instance._meta.model_name}.{action}',
+        object_id=instance.pk,
+        payload=json.dumps(payload, cls=DjangoJSONEncoder),
+    )
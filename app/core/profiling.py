@@ -0,0 +1,176 @@
+"""In-process sampling profiler writing collapsed stacks for slow requests"""
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from html import escape
+
+
+class Sampler(threading.Thread):
+    """Daemon thread sampling the stacks of the threads it is watching"""
+
+    def __init__(self, interval):
+        super().__init__(name='request-sampler', daemon=True)
+        self.interval = interval
+        self._watched = {}
+        self._lock = threading.Lock()
+
+    def watch(self, thread_id):
+        """Start sampling a thread and return the counter of its stacks"""
+        stacks = Counter()
+        with self._lock:
+            self._watched[thread_id] = stacks
+        return stacks
+
+    def unwatch(self, thread_id):
+        """Stop sampling a thread"""
+        with self._lock:
+            self._watched.pop(thread_id, None)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                watched = list(self._watched.items())
+            if not watched:
+                continue
+
+            frames = sys._current_frames()
+            for thread_id, stacks in watched:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[collapse(frame)] += 1
+
+
+_sampler = None
+_sampler_pid = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler(interval):
+    """Return the sampler of this process, starting it on first use
+
+    Threads do not survive a fork, so a worker forked from a preloaded
+    gunicorn master, or one whose sampler died, starts its own.
+    """
+    global _sampler, _sampler_pid
+    pid = os.getpid()
+    if _sampler_pid != pid or not _sampler.is_alive():
+        with _sampler_lock:
+            if _sampler_pid != pid or not _sampler.is_alive():
+                sampler = Sampler(interval)
+                sampler.start()
+                _sampler, _sampler_pid = sampler, pid
+    return _sampler
+
+
+def frame_name(code):
+    """Return a collapsed stack entry for a code object"""
+    filename = os.path.basename(code.co_filename)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'
+
+
+def collapse(frame):
+    """Return a frame's stack in root-first collapsed format"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def capture_path(directory, view, action):
+    """Return a unique file path for a capture of view/action"""
+    stamp = time.strftime('%Y%m%d%H%M%S')
+    return os.path.join(
+        directory,
+        f'{view}.{action}.{stamp}-{os.getpid()}-{threading.get_ident()}'
+        '.collapsed'
+    )
+
+
+def write_collapsed(path, stacks):
+    """Write a counter of stacks to path in collapsed stack format"""
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+
+
+def rotate(directory, max_files):
+    """Delete the oldest captures in directory beyond max_files, so a
+    profiler left on cannot fill the disk
+    """
+    captures = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith('.collapsed') and entry.is_file():
+            try:
+                captures.append((entry.stat().st_mtime, entry.path))
+            except FileNotFoundError:
+                continue
+    captures.sort()
+    for _, path in captures[:max(0, len(captures) - max_files)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Rotated by another worker at the same time
+            pass
+
+
+def read_collapsed(path):
+    """Read a collapsed stack file into a counter"""
+    stacks = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack and count.isdigit():
+                stacks[stack] += int(count)
+    return stacks
+
+
+def render_svg(stacks, title, width=1200, frame_height=16):
+    """Render a counter of collapsed stacks as a flame graph SVG"""
+    root = {}
+    for stack, count in stacks.items():
+        node = root
+        for name in stack.split(';'):
+            child = node.setdefault(name, [0, {}])
+            child[0] += count
+            node = child[1]
+
+    total = sum(stacks.values()) or 1
+    rects = []
+
+    def layout(children, x, depth):
+        for name, (count, grandchildren) in sorted(children.items()):
+            w = count / total * width
+            if w >= 0.5:
+                rects.append((x, depth, w, name, count))
+                layout(grandchildren, x, depth + 1)
+            x += w
+
+    layout(root, 0.0, 0)
+    depth = max((rect[1] for rect in rects), default=0) + 1
+    height = (depth + 2) * frame_height
+
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" '
+        f'height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="4" y="{frame_height - 4}">{escape(title)} '
+        f'({total} samples)</text>',
+    ]
+    for x, level, w, name, count in rects:
+        y = height - (level + 1) * frame_height
+        hue = 20 + zlib.crc32(name.encode()) % 40
+        label = escape(name[:int(w / 7)]) if w > 21 else ''
+        parts.append(
+            f'<g><title>{escape(name)} ({count} samples, '
+            f'{count / total:.1%})</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" '
+            f'height="{frame_height - 1}" fill="hsl({hue},90%,60%)"/>'
+            f'<text x="{x + 2:.1f}" y="{y + frame_height - 4}">{label}'
+            '</text></g>'
+        )
+    parts.append('</svg>')
+    return '\n'.join(parts)
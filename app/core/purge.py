@@ -0,0 +1,105 @@
+"""Background removal of soft deleted users and recipes"""
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from core import images
+from core.models import Tag, Ingredient, Recipe, RecipeSummary, Tombstone
+from core.routers import use_primary
+
+
+def _batches(queryset, batch_size, pause):
+    """Yield the primary keys of queryset batch_size at a time, sleeping
+    pause seconds between batches. Each batch must be deleted before
+    the next is read.
+    """
+    keys = queryset.order_by('pk').values_list('pk', flat=True)
+    while True:
+        batch = list(keys[:batch_size])
+        if not batch:
+            return
+        yield batch
+        if pause:
+            time.sleep(pause)
+
+
+def _delete_recipes(using, ids):
+    """Delete recipes and their links, returning their image files and
+    the variants no longer used by any recipe
+    """
+    with transaction.atomic(using=using):
+        recipes = Recipe.objects.using(using).filter(pk__in=ids)
+        # Marked rows are skipped by the summary and tombstone signals
+        recipes.filter(deleted_at__isnull=True) \
+            .update(deleted_at=timezone.now())
+        files = []
+        digests = set()
+        for name, digest in recipes.values_list('image', 'image_digest'):
+            if name:
+                files.append(name)
+            if digest:
+                digests.add(digest)
+        Recipe.tags.through.objects.using(using) \
+            .filter(recipe_id__in=ids).delete()
+        Recipe.ingredients.through.objects.using(using) \
+            .filter(recipe_id__in=ids).delete()
+        recipes.delete()
+    # Variants are named by content so other recipes, on any shard, may
+    # still use them
+    for shard in settings.DATABASE_SHARDS if digests else ():
+        digests -= set(Recipe.objects.using(shard)
+                       .filter(image_digest__in=digests)
+                       .values_list('image_digest', flat=True))
+    for digest in digests:
+        files.extend(images.variant_names(digest))
+    return files
+
+
+def _delete_files(names):
+    """Remove files from storage once the rows using them are gone"""
+    for name in names:
+        default_storage.delete(name)
+
+
+def purge_recipes(using, batch_size=500, pause=0):
+    """Delete the soft deleted recipes on a database, returning how many"""
+    purged = 0
+    with use_primary():
+        deleted = Recipe.objects.using(using).filter(deleted_at__isnull=False)
+        for ids in _batches(deleted, batch_size, pause):
+            _delete_files(_delete_recipes(using, ids))
+            purged += len(ids)
+    return purged
+
+
+def purge_user(user, batch_size=500, pause=0):
+    """Delete a user and everything they own from every shard"""
+    with use_primary():
+        for shard in settings.DATABASE_SHARDS:
+            recipes = Recipe.objects.using(shard).filter(user=user)
+            for ids in _batches(recipes, batch_size, pause):
+                _delete_files(_delete_recipes(shard, ids))
+            for model in (Tag, Ingredient):
+                rows = model.objects.using(shard).filter(user=user)
+                for ids in _batches(rows, batch_size, pause):
+                    model.objects.using(shard).filter(pk__in=ids).delete()
+            RecipeSummary.objects.using(shard).filter(user=user).delete()
+            Tombstone.objects.using(shard).filter(user=user).delete()
+            if shard != 'default':
+                get_user_model()._base_manager.using(shard) \
+                    .filter(pk=user.pk).delete()
+        user.delete(using='default')
+
+
+def purge_users(batch_size=500, pause=0):
+    """Delete every soft deleted user, returning how many"""
+    with use_primary():
+        users = list(get_user_model()._base_manager.using('default')
+                     .filter(deleted_at__isnull=False))
+    for user in users:
+        purge_user(user, batch_size, pause)
+    return len(users)
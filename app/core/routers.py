@@ -0,0 +1,66 @@
+"""Database routing for user shards and read replicas"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from core import sharding
+
+
+_local = threading.local()
+
+
+def primary_pinned():
+    """Return True if reads on this thread must go to the primary"""
+    return getattr(_local, 'pinned', 0) > 0
+
+
+@contextmanager
+def use_primary():
+    """Route every read inside the block to the primary database"""
+    _local.pinned = getattr(_local, 'pinned', 0) + 1
+    try:
+        yield
+    finally:
+        _local.pinned -= 1
+
+
+class ShardRouter:
+    """Send recipe data to the shard of the user owning the instance"""
+
+    def _db_for_instance(self, model, hints):
+        if not sharding.is_sharded() or \
+                model not in sharding.sharded_models():
+            return None
+        user_id = getattr(hints.get('instance'), 'user_id', None)
+        if user_id is None:
+            return None
+        return sharding.shard_for_user(user_id)
+
+    def db_for_read(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._db_for_instance(model, hints)
+
+
+class PrimaryReplicaRouter:
+    """Send reads to a random replica unless the thread is pinned"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or primary_pinned():
+            return 'default'
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Primary and replicas hold the same rows"""
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Replicas receive their schema through replication"""
+        return db not in settings.DATABASE_REPLICAS
@@ -0,0 +1,173 @@
+"""Placement of each user's recipe data on a database shard"""
+import hashlib
+from bisect import bisect
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+
+from core import summary
+from core.models import Tag, Ingredient, Recipe, RecipeNeighbor, \
+                        RecipeSummary, Tombstone, OutboxEvent
+
+
+VIRTUAL_NODES = 64
+
+
+def _hash(key):
+    return int(hashlib.md5(key.encode()).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring mapping keys onto database aliases"""
+
+    def __init__(self, aliases, virtual_nodes=VIRTUAL_NODES):
+        self.aliases = tuple(aliases)
+        points = sorted(
+            (_hash(f'{alias}#{index}'), alias)
+            for alias in self.aliases
+            for index in range(virtual_nodes)
+        )
+        self._keys = [point for point, _ in points]
+        self._aliases = [alias for _, alias in points]
+
+    def get(self, key):
+        """Return the alias owning key"""
+        index = bisect(self._keys, _hash(str(key))) % len(self._keys)
+        return self._aliases[index]
+
+
+@lru_cache(maxsize=8)
+def _ring(aliases):
+    return HashRing(aliases)
+
+
+def is_sharded():
+    """Return True if recipe data is spread over more than one database"""
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def shard_for_user(user_id):
+    """Return the database alias holding a user's recipe data"""
+    if not is_sharded():
+        return settings.DATABASE_SHARDS[0]
+    return _ring(tuple(settings.DATABASE_SHARDS)).get(user_id)
+
+
+def db_for_user(user):
+    """Return the alias to pin a user's queries to, None to let routers
+    pick (so reads can still use replicas) when there is a single shard
+    """
+    if not is_sharded():
+        return None
+    return shard_for_user(user.pk)
+
+
+def for_user(queryset, user):
+    """Return queryset evaluated on the shard of user"""
+    if not is_sharded():
+        return queryset
+    return queryset.using(shard_for_user(user.pk))
+
+
+def sharded_models():
+    """Return the models stored on the owning user's shard"""
+    return (Tag, Ingredient, Recipe, RecipeNeighbor, RecipeSummary,
+            Tombstone, OutboxEvent, Recipe.tags.through,
+            Recipe.ingredients.through)
+
+
+def mirror_user(user, alias):
+    """Copy a user row onto a shard so foreign keys to it hold"""
+    if alias == 'default':
+        return
+    manager = get_user_model()._base_manager.using(alias)
+    if not manager.filter(pk=user.pk).exists():
+        manager.bulk_create([user])
+
+
+def move_user(user, source, target):
+    """Move every recipe, tag and ingredient of user from source to target
+
+    Rows get new primary keys on the target since sequences are per
+    database, so the old ids are tombstoned there for synced clients to
+    drop, along with the user's existing tombstones. Returns the number of
+    recipes moved.
+    """
+    mirror_user(user, target)
+    # The inner block commits first: should the source commit fail after
+    # the target's, the user is left with duplicates rather than nothing
+    with transaction.atomic(using=source), transaction.atomic(using=target):
+        tag_ids = {}
+        for tag in Tag.objects.using(source).filter(user=user):
+            old_id = tag.pk
+            tag.pk = None
+            tag.save(using=target)
+            tag_ids[old_id] = tag.pk
+
+        ingredient_ids = {}
+        for ingredient in Ingredient.objects.using(source).filter(user=user):
+            old_id = ingredient.pk
+            ingredient.pk = None
+            ingredient.save(using=target)
+            ingredient_ids[old_id] = ingredient.pk
+
+        recipes = Recipe.objects.using(source).filter(user=user)
+        tag_links = list(
+            Recipe.tags.through.objects.using(source)
+            .filter(recipe__in=recipes).values_list('recipe_id', 'tag_id')
+        )
+        ingredient_links = list(
+            Recipe.ingredients.through.objects.using(source)
+            .filter(recipe__in=recipes)
+            .values_list('recipe_id', 'ingredient_id')
+        )
+
+        recipe_ids = {}
+        for recipe in recipes:
+            old_id = recipe.pk
+            recipe.pk = None
+            recipe.save(using=target)
+            recipe_ids[old_id] = recipe.pk
+
+        Recipe.tags.through.objects.using(target).bulk_create(
+            Recipe.tags.through(recipe_id=recipe_ids[recipe_id],
+                                tag_id=tag_ids[tag_id])
+            for recipe_id, tag_id in tag_links
+        )
+        Recipe.ingredients.through.objects.using(target).bulk_create(
+            Recipe.ingredients.through(
+                recipe_id=recipe_ids[recipe_id],
+                ingredient_id=ingredient_ids[ingredient_id]
+            )
+            for recipe_id, ingredient_id in ingredient_links
+        )
+
+        # Read before the deletes below tombstone the old ids on source
+        moved = {
+            Tombstone.TAG: tag_ids,
+            Tombstone.INGREDIENT: ingredient_ids,
+            Tombstone.RECIPE: recipe_ids,
+        }
+        tombstones = [
+            (kind, object_id) for kind, object_id in
+            Tombstone.objects.using(source).filter(user=user)
+            .values_list('kind', 'object_id')
+        ]
+        tombstones += [(kind, old_id)
+                       for kind, ids in moved.items() for old_id in ids]
+        new_ids = {kind: set(ids.values()) for kind, ids in moved.items()}
+        Tombstone.objects.using(target).bulk_create(
+            Tombstone(user_id=user.pk, kind=kind, object_id=object_id)
+            for kind, object_id in set(tombstones)
+            if object_id not in new_ids[kind]
+        )
+
+        Recipe.objects.using(source).filter(user=user).delete()
+        Tag.objects.using(source).filter(user=user).delete()
+        Ingredient.objects.using(source).filter(user=user).delete()
+        RecipeSummary.objects.using(source).filter(user=user).delete()
+        Tombstone.objects.using(source).filter(user=user).delete()
+        summary.rebuild_user(user.pk, target)
+    return len(recipe_ids)
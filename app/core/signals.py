@@ -0,0 +1,152 @@
+from django.conf import settings
+from django.db.models.signals import m2m_changed, post_delete, post_save, \
+                                     pre_delete
+from django.dispatch import receiver
+
+from core import matching, names, sharding, summary
+from core.models import Tag, Ingredient, Recipe, RecipeSummary, Tombstone
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def prepare_user_shard(sender, instance, created, using, raw, **kwargs):
+    """Copy new users onto their shard and start their recipe summary"""
+    if not created or raw or using != 'default':
+        return
+    alias = sharding.shard_for_user(instance.pk)
+    if sharding.is_sharded():
+        sharding.mirror_user(instance, alias)
+    RecipeSummary.objects.using(alias).create(user_id=instance.pk)
+
+
+def _tombstone(instance, using):
+    Tombstone.objects.using(using).create(
+        user_id=instance.user_id,
+        kind=instance._meta.model_name,
+        object_id=instance.pk,
+    )
+
+
+def _remove_recipe(instance, using):
+    """Take a recipe out of its owner's summary and relation counts"""
+    summary.adjust_counts(Tag, using, -1, recipe=instance)
+    summary.adjust_counts(Ingredient, using, -1, recipe=instance)
+    summary.apply(instance.user_id, using, -1,
+                  -(instance.time_minutes or 0), -(instance.price_cents or 0))
+    _tombstone(instance, using)
+    matching.recipe_removed(instance.user_id, using, instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def add_recipe_to_summary(sender, instance, created, using, raw, **kwargs):
+    """Fold a created, edited or soft deleted recipe into its owner's
+    summary
+    """
+    if raw:
+        return
+    if instance.deleted_at is not None:
+        if not created and \
+                getattr(instance, '_loaded_deleted_at', None) is None:
+            _remove_recipe(instance, using)
+        instance._loaded_deleted_at = instance.deleted_at
+        return
+    time_minutes = instance.time_minutes or 0
+    price_cents = instance.price_cents or 0
+    if created:
+        summary.apply(instance.user_id, using, 1, time_minutes, price_cents)
+    else:
+        old_time, old_price = getattr(instance, '_loaded_totals',
+                                      (time_minutes, price_cents))
+        summary.apply(instance.user_id, using, 0,
+                      time_minutes - (old_time or 0),
+                      price_cents - (old_price or 0))
+    instance._loaded_totals = (time_minutes, price_cents)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_summary(sender, instance, using, **kwargs):
+    """Take a deleted recipe out of the summary unless soft deleted, in
+    which case it already was
+    """
+    if instance.deleted_at is None:
+        _remove_recipe(instance, using)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def record_tombstone(sender, instance, using, **kwargs):
+    """Remember a deleted row so sync clients can drop their copy"""
+    _tombstone(instance, using)
+
+
+@receiver(post_delete, sender=Ingredient)
+def drop_ingredient_from_index(sender, instance, using, **kwargs):
+    """Forget a deleted ingredient in the owner's matching index"""
+    matching.ingredient_deleted(instance.user_id, using, instance.pk)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_names(sender, instance, using, **kwargs):
+    """Make every process reload the owner's tag and ingredient names"""
+    names.bump(instance.user_id, using)
+
+
+def _relation_changed(model, instance, action, reverse, pk_set, using):
+    """Keep recipe_count of model in step with a change of a recipe M2M"""
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    delta = -1 if action in ('post_remove', 'pre_clear') else 1
+
+    if reverse:
+        # instance is the tag or ingredient, pk_set the recipes
+        if action == 'pre_clear':
+            model.objects.using(using).filter(pk=instance.pk) \
+                .update(recipe_count=0)
+        elif pk_set:
+            summary.adjust_counts(model, using, delta * len(pk_set),
+                                  pk=instance.pk)
+    elif action == 'pre_clear':
+        summary.adjust_counts(model, using, delta, recipe=instance)
+    elif pk_set:
+        summary.adjust_counts(model, using, delta, pk__in=pk_set)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, using,
+                        **kwargs):
+    _relation_changed(Tag, instance, action, reverse, pk_set, using)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_ingredients_changed(sender, instance, action, reverse, pk_set,
+                               using, **kwargs):
+    _relation_changed(Ingredient, instance, action, reverse, pk_set, using)
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def index_recipe_ingredients(sender, instance, action, reverse, pk_set,
+                             using, **kwargs):
+    """Keep the owner's ingredient matching index in step with a change"""
+    if action == 'pre_clear':
+        action = 'post_remove'
+        if reverse:
+            related = instance.recipe_set.using(using)
+        else:
+            related = instance.ingredients.using(using)
+        pk_set = set(related.values_list('id', flat=True))
+    if action == 'post_add':
+        update = matching.ingredients_added
+    elif action == 'post_remove':
+        update = matching.ingredients_removed
+    else:
+        return
+    if not pk_set:
+        return
+
+    if reverse:
+        for recipe_id in pk_set:
+            update(instance.user_id, using, recipe_id, [instance.pk])
+    else:
+        update(instance.user_id, using, instance.pk, pk_set)
@@ -0,0 +1,96 @@
+"""Recipe to recipe cosine similarity over shared tags and ingredients"""
+import heapq
+import math
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import CharField, Value
+
+from core.models import Recipe, RecipeNeighbor
+from core.names import RELATIONS
+
+
+TOP_K = 10
+
+
+def features(user_id, using):
+    """Return {recipe_id: set of (relation, id)} of a user's live recipes,
+    reading the through tables of every relation in a single query
+    """
+    recipes = Recipe.objects.using(using) \
+        .filter(user_id=user_id, deleted_at__isnull=True)
+    querysets = []
+    for relation in RELATIONS:
+        field = Recipe._meta.get_field(relation)
+        querysets.append(
+            field.remote_field.through.objects.using(using)
+            .filter(recipe__in=recipes)
+            .annotate(relation=Value(relation, CharField()))
+            .values_list('recipe_id',
+                         f'{field.m2m_reverse_field_name()}_id',
+                         'relation')
+        )
+    vectors = {}
+    rows = querysets[0].union(*querysets[1:], all=True)
+    for recipe_id, pk, relation in rows:
+        vectors.setdefault(recipe_id, set()).add((relation, pk))
+    return vectors
+
+
+def neighbors(vectors, k=TOP_K):
+    """Yield (recipe_id, [(neighbor_id, score)]) with the k recipes most
+    similar to each recipe, best first
+
+    Vectors are binary so the cosine of two recipes is their shared
+    feature count over the root of the product of their sizes. Only
+    recipes sharing a posting list with a recipe are scored against it.
+    """
+    postings = {}
+    for recipe_id, vector in vectors.items():
+        for feature in vector:
+            postings.setdefault(feature, []).append(recipe_id)
+
+    for recipe_id, vector in vectors.items():
+        shared = Counter()
+        for feature in vector:
+            shared.update(postings[feature])
+        del shared[recipe_id]
+        size = len(vector)
+        scored = (
+            (count / math.sqrt(size * len(vectors[other])), -other)
+            for other, count in shared.items()
+        )
+        yield recipe_id, [(-other, score)
+                          for score, other in heapq.nlargest(k, scored)]
+
+
+def refresh_user(user_id, using='default', k=TOP_K):
+    """Replace the neighbor table rows of a user's recipes, returning how
+    many were written
+    """
+    rows = [
+        RecipeNeighbor(recipe_id=recipe_id, neighbor_id=neighbor_id,
+                       rank=rank, score=score)
+        for recipe_id, ranked in neighbors(features(user_id, using), k)
+        for rank, (neighbor_id, score) in enumerate(ranked)
+    ]
+    with transaction.atomic(using=using):
+        RecipeNeighbor.objects.using(using) \
+            .filter(recipe__user_id=user_id).delete()
+        RecipeNeighbor.objects.using(using).bulk_create(rows,
+                                                        batch_size=1000)
+    return len(rows)
+
+
+def refresh(using='default', user_ids=None, k=TOP_K):
+    """Refresh the neighbors of every user with recipes on a database, or
+    of user_ids only, returning (users, rows) written
+    """
+    if user_ids is None:
+        user_ids = Recipe.objects.using(using).order_by() \
+            .values_list('user_id', flat=True).distinct()
+    users = rows = 0
+    for user_id in list(user_ids):
+        rows += refresh_user(user_id, using, k)
+        users += 1
+    return users, rows
@@ -0,0 +1,118 @@
+"""Incremental maintenance of the per-user recipe summary"""
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, \
+                             Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from core.models import Tag, Ingredient, Recipe, RecipeSummary
+
+
+def _count_subquery(through, field):
+    """Return a subquery counting the recipes linked to each row"""
+    return Coalesce(
+        Subquery(
+            through.objects.filter(**{field: OuterRef('pk')},
+                                   recipe__deleted_at__isnull=True)
+            .order_by().values(field).annotate(n=Count('*')).values('n'),
+            output_field=IntegerField()
+        ),
+        Value(0)
+    )
+
+
+def apply(user_id, using, count=0, time_minutes=0, price_cents=0):
+    """Add deltas to a user's summary, building it if it is missing"""
+    if not (count or time_minutes or price_cents):
+        return
+    updated = RecipeSummary.objects.using(using).filter(user_id=user_id) \
+        .update(
+            recipe_count=F('recipe_count') + count,
+            total_time_minutes=F('total_time_minutes') + time_minutes,
+            total_price_cents=F('total_price_cents') + price_cents,
+        )
+    if not updated:
+        rebuild_user(user_id, using)
+
+
+def adjust_counts(model, using, delta, **filters):
+    """Add delta to the recipe_count of every matching tag or ingredient"""
+    model.objects.using(using).filter(**filters).update(
+        recipe_count=Greatest(F('recipe_count') + delta, 0)
+    )
+
+
+def rebuild_user(user_id, using):
+    """Recompute one user's summary and tag/ingredient counts"""
+    totals = Recipe.objects.using(using).filter(
+        user_id=user_id,
+        deleted_at__isnull=True,
+    ).aggregate(
+        count=Count('id'),
+        time_minutes=Sum('time_minutes'),
+        price_cents=Sum('price_cents'),
+    )
+    with transaction.atomic(using=using):
+        RecipeSummary.objects.using(using).update_or_create(
+            user_id=user_id,
+            defaults={
+                'recipe_count': totals['count'],
+                'total_time_minutes': totals['time_minutes'] or 0,
+                'total_price_cents': totals['price_cents'] or 0,
+            },
+        )
+        Tag.objects.using(using).filter(user_id=user_id).update(
+            recipe_count=_count_subquery(Recipe.tags.through, 'tag_id')
+        )
+        Ingredient.objects.using(using).filter(user_id=user_id).update(
+            recipe_count=_count_subquery(Recipe.ingredients.through,
+                                         'ingredient_id')
+        )
+
+
+def rebuild(using, user_ids=None):
+    """Recompute every summary on a database in a constant number of
+    statements, or only those of user_ids. Returns the summaries written.
+    """
+    recipes = Recipe.objects.using(using).filter(deleted_at__isnull=True)
+    summaries = RecipeSummary.objects.using(using).all()
+    tags = Tag.objects.using(using).all()
+    ingredients = Ingredient.objects.using(using).all()
+    if user_ids is not None:
+        recipes = recipes.filter(user_id__in=user_ids)
+        summaries = summaries.filter(user_id__in=user_ids)
+        tags = tags.filter(user_id__in=user_ids)
+        ingredients = ingredients.filter(user_id__in=user_ids)
+
+    rows = recipes.order_by().values('user_id').annotate(
+        count=Count('id'),
+        time_minutes=Sum('time_minutes'),
+        price_cents=Sum('price_cents'),
+    )
+    with transaction.atomic(using=using):
+        summaries.delete()
+        created = RecipeSummary.objects.using(using).bulk_create(
+            RecipeSummary(
+                user_id=row['user_id'],
+                recipe_count=row['count'],
+                total_time_minutes=row['time_minutes'] or 0,
+                total_price_cents=row['price_cents'] or 0,
+            )
+            for row in rows
+        )
+        tags.update(
+            recipe_count=_count_subquery(Recipe.tags.through, 'tag_id')
+        )
+        ingredients.update(
+            recipe_count=_count_subquery(Recipe.ingredients.through,
+                                         'ingredient_id')
+        )
+    return len(created)
+
+
+def get_summary(user, using):
+    """Return a user's summary, building it on first access"""
+    summary = RecipeSummary.objects.using(using).filter(user=user).first()
+    if summary is None:
+        rebuild_user(user.pk, using)
+        summary = RecipeSummary.objects.using(using).get(user=user)
+    return summary
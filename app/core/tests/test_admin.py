@@ -1,8 +1,13 @@
+from unittest.mock import patch
+
 from django.test import TestCase, Client
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from faker import Faker, providers
 
+from core.admin import EstimatedCountPaginator
+from core.models import Recipe, Tag
+
 fake = Faker()
 fake.add_provider(providers.internet)
 fake.add_provider(providers.misc)
@@ -45,3 +50,56 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+    def test_recipe_changelist_queries(self):
+        """Test the recipe changelist query count does not grow per row"""
+        url = reverse('admin:core_recipe_changelist')
+        for index in range(3):
+            user = get_user_model().objects.create_user(
+                email=fake.email(),
+                password=fake.password()
+            )
+            Recipe.objects.create(user=user, title=f'Recipe {index}',
+                                  time_minutes=5, price=1)
+        self.client.get(url)
+
+        with self.assertNumQueries(4):
+            res = self.client.get(url)
+
+        self.assertContains(res, 'Recipe 2')
+
+    def test_recipe_change_page(self):
+        """Test the recipe edit page does not list every tag"""
+        Tag.objects.create(user=self.user, name='Not in a select')
+        recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                       time_minutes=5, price=1)
+        url = reverse('admin:core_recipe_change', args=[recipe.id])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertNotContains(res, 'Not in a select')
+
+    def test_search_by_user_email(self):
+        """Test changelists can be searched by exact owner email"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.admin_user, name='Keto')
+        url = reverse('admin:core_tag_changelist')
+
+        res = self.client.get(url, {'q': self.user.email})
+
+        self.assertContains(res, 'Vegan')
+        self.assertNotContains(res, 'Keto')
+
+    def test_paginator_estimate(self):
+        """Test large unfiltered tables are counted from the estimate"""
+        paginator = EstimatedCountPaginator(Tag.objects.all(), 100)
+
+        with patch.object(EstimatedCountPaginator, '_estimate',
+                          return_value=5000000):
+            self.assertEqual(paginator.count, 5000000)
+
+        paginator = EstimatedCountPaginator(Tag.objects.all(), 100)
+        with patch.object(EstimatedCountPaginator, '_estimate',
+                          return_value=10):
+            self.assertEqual(paginator.count, 0)
@@ -0,0 +1,81 @@
+from django.test import TestCase
+
+from core import benchmarks
+from core.models import Recipe, Tag
+
+
+class BenchmarkTests(TestCase):
+
+    def test_percentile(self):
+        """Test percentiles use the nearest rank"""
+        values = list(range(1, 101))
+
+        self.assertEqual(benchmarks.percentile(values, 50), 50)
+        self.assertEqual(benchmarks.percentile(values, 95), 95)
+        self.assertEqual(benchmarks.percentile(values, 99), 99)
+        self.assertEqual(benchmarks.percentile([], 50), 0.0)
+
+    def test_build_dataset_is_seeded(self):
+        """Test the dataset matches the requested scale"""
+        sizes = benchmarks.SCALES['small']
+        data = benchmarks.build_dataset('small', seed=1)
+
+        user = data['user']
+        self.assertEqual(Recipe.objects.filter(user=user).count(),
+                         sizes['recipes'])
+        self.assertEqual(Tag.objects.filter(user=user).count(),
+                         sizes['tags'])
+        self.assertEqual(len(data['recipes']), sizes['recipes'])
+
+    def test_run_scenario(self):
+        """Test a scenario reports latency percentiles and query counts"""
+        data = benchmarks.build_dataset('small', seed=2)
+
+        stats = benchmarks.run_scenario('tag-list', data, iterations=3,
+                                        warmup=1)
+
+        self.assertEqual(stats['iterations'], 3)
+        self.assertLessEqual(stats['p50_ms'], stats['p99_ms'])
+        self.assertGreater(stats['queries'], 0)
+
+    def test_compare_flags_regressions(self):
+        """Test slower p95 and extra queries are reported"""
+        baseline = {'scenarios': {
+            'tag-list': {'p95_ms': 10.0, 'queries': 2},
+            'user-me': {'p95_ms': 10.0, 'queries': 1},
+        }}
+        results = {'scenarios': {
+            'tag-list': {'p95_ms': 10.5, 'queries': 3},
+            'user-me': {'p95_ms': 12.0, 'queries': 1},
+            'recipe-list': {'p95_ms': 50.0, 'queries': 3},
+        }}
+
+        regressions = benchmarks.compare(results, baseline, threshold=0.1)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('tag-list: 3 queries'))
+        self.assertTrue(regressions[1].startswith('user-me: p95'))
+
+    def test_measure_startup_api_only(self):
+        """Test the API only profile boots and serves without Pillow"""
+        stats = benchmarks.measure_startup(api_only=True, requests=2)
+
+        self.assertGreater(stats['startup_ms'], 0)
+        self.assertGreater(stats['request_us'], 0)
+        self.assertFalse(stats['pillow_loaded'])
+
+    def test_middleware_overhead(self):
+        """Test the middleware microbenchmark times both paths"""
+        overhead = benchmarks.middleware_overhead(iterations=10)
+
+        self.assertGreater(overhead['session_us'], 0)
+        self.assertGreater(overhead['fast_path_us'], 0)
+
+    def test_price_formats(self):
+        """Test the price benchmark times both representations"""
+        stats = benchmarks.price_formats(count=100, repeat=1)
+
+        self.assertEqual(set(stats), {
+            'serialize_decimal_ms', 'serialize_cents_ms', 'sum_decimal_ms',
+            'sum_cents_ms',
+        })
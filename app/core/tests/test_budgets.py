@@ -0,0 +1,86 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from faker import Faker, providers
+
+from core import budgets
+from recipe.views import TagViewSet
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+@budgets.query_budget(list=1, create=2)
+class BaseView:
+    pass
+
+
+@budgets.query_budget(create=3)
+class ChildView(BaseView):
+    pass
+
+
+class QueryBudgetTests(TestCase):
+
+    def test_budgets_inherited_and_overridden(self):
+        """Test subclasses extend their parent's budgets"""
+        self.assertEqual(BaseView.query_budgets, {'list': 1, 'create': 2})
+        self.assertEqual(ChildView.query_budgets, {'list': 1, 'create': 3})
+
+    def test_fingerprint(self):
+        """Test literals and IN lists are normalized"""
+        sql = 'SELECT * FROM "core_tag" WHERE "id" IN (%s, %s, %s) ' \
+              "AND name = 'Vegan' LIMIT 21"
+
+        self.assertEqual(
+            budgets.fingerprint(sql),
+            'SELECT * FROM "core_tag" WHERE "id" IN (...) '
+            'AND name = ? LIMIT ?'
+        )
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_check_strict_raises(self):
+        """Test exceeding a budget raises in strict mode"""
+        with self.assertRaises(budgets.QueryBudgetExceeded):
+            budgets.check(BaseView, 'list', ['SELECT 1', 'SELECT 1'])
+
+    @override_settings(QUERY_BUDGET_STRICT=False)
+    def test_check_logs_fingerprints(self):
+        """Test exceeding a budget logs the grouped SQL fingerprints"""
+        with self.assertLogs('core.budgets', level='WARNING') as logs:
+            budgets.check(BaseView, 'list', ['SELECT 1', 'SELECT 2'])
+
+        self.assertIn('BaseView.list ran 2 queries, budget is 1',
+                      logs.output[0])
+        self.assertIn('2x SELECT ?', logs.output[0])
+
+    @override_settings(QUERY_BUDGET_STRICT=True)
+    def test_transaction_statements_not_counted(self):
+        """Test transaction control does not count against the budget"""
+        budgets.check(BaseView, 'list', ['BEGIN', 'SELECT 1',
+                                         'SAVEPOINT "s1"',
+                                         'RELEASE SAVEPOINT "s1"'])
+
+    def test_check_within_budget(self):
+        """Test actions within or without a budget pass silently"""
+        budgets.check(BaseView, 'list', ['SELECT 1'])
+        budgets.check(BaseView, 'destroy', ['SELECT 1'] * 10)
+
+    def test_request_over_budget_fails(self):
+        """Test an API request over its budget fails loudly in tests"""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        ))
+
+        with patch.object(TagViewSet, 'query_budgets', {'list': 0}), \
+                self.assertRaises(budgets.QueryBudgetExceeded):
+            client.get(TAGS_URL)
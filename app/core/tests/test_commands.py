@@ -1,9 +1,12 @@
+from argparse import ArgumentTypeError
 from unittest.mock import patch
 
-from django.core.management import call_command
+from django.core.management import call_command, CommandError
 from django.db.utils import OperationalError
 from django.test import TestCase
 
+from core.management.commands.loadtest import concurrency_levels
+
 
 class CommandTests(TestCase):
 
@@ -21,3 +24,14 @@ class CommandTests(TestCase):
             gi.side_effect = [OperationalError] * 5 + [True]
             call_command('wait_for_db')
             self.assertEqual(gi.call_count, 6)
+
+    def test_loadtest_requires_credentials(self):
+        """Test load test refuses to run without a way to authenticate"""
+        with self.assertRaises(CommandError):
+            call_command('loadtest', duration=0)
+
+    def test_loadtest_concurrency_sweep(self):
+        """Test the concurrency option parses a sweep of levels"""
+        self.assertEqual(concurrency_levels('1,8,32'), [1, 8, 32])
+        with self.assertRaises(ArgumentTypeError):
+            concurrency_levels('0')
@@ -0,0 +1,181 @@
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from faker import Faker, providers
+
+from core import idempotency
+from core.budgets import TRANSACTION_STATEMENTS
+from core.models import IdempotencyKey, Recipe, Tag
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+TAGS_URL = reverse('recipe:tag-list')
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_retry_replays_response(self):
+        """Test a retried POST returns the stored response unchanged"""
+        payload = {'title': 'Curry', 'time_minutes': 30, 'price': '5.00',
+                   'tags': [], 'ingredients': []}
+
+        first = self.client.post(RECIPES_URL, payload, format='json',
+                                 HTTP_IDEMPOTENCY_KEY='abc')
+        with CaptureQueriesContext(connection) as queries:
+            retry = self.client.post(RECIPES_URL, payload, format='json',
+                                     HTTP_IDEMPOTENCY_KEY='abc')
+
+        statements = [query['sql'] for query in queries
+                      if not query['sql'].upper().startswith(
+                          TRANSACTION_STATEMENTS)]
+        self.assertEqual(len(statements), 2)
+
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_keys_scoped_to_request_and_user(self):
+        """Test a key reused for another request is rejected"""
+        self.client.post(TAGS_URL, {'name': 'Vegan'},
+                         HTTP_IDEMPOTENCY_KEY='abc')
+
+        res = self.client.post(TAGS_URL, {'name': 'Keto'},
+                               HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(res.status_code,
+                         status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        other = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client.force_authenticate(other)
+        res = self.client.post(TAGS_URL, {'name': 'Keto'},
+                               HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_failed_request_not_stored(self):
+        """Test a key of a failed request can be used again"""
+        res = self.client.post(TAGS_URL, {'name': ''},
+                               HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'},
+                               HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+    def test_in_progress_conflict(self):
+        """Test a retry arriving while the first request runs gets 409"""
+        IdempotencyKey.objects.create(user=self.user, key='abc',
+                                      fingerprint='digest')
+
+        with patch.object(idempotency, 'fingerprint',
+                          return_value='digest'):
+            res = self.client.post(TAGS_URL, {'name': 'Vegan'},
+                                   HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_abandoned_key_taken_over(self):
+        """Test a key left in progress past its lease is run again"""
+        IdempotencyKey.objects.create(user=self.user, key='abc',
+                                      fingerprint='digest')
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(
+            seconds=settings.IDEMPOTENCY_KEY_LEASE + 1
+        ))
+
+        with patch.object(idempotency, 'fingerprint',
+                          return_value='digest'):
+            res = self.client.post(TAGS_URL, {'name': 'Vegan'},
+                                   HTTP_IDEMPOTENCY_KEY='abc')
+            replay = self.client.post(TAGS_URL, {'name': 'Vegan'},
+                                      HTTP_IDEMPOTENCY_KEY='abc')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(replay[idempotency.REPLAYED_HEADER], 'true')
+        self.assertEqual(Tag.objects.count(), 1)
+
+    def test_expired_keys(self):
+        """Test expired keys are run again and pruned"""
+        self.client.post(TAGS_URL, {'name': 'Vegan'},
+                         HTTP_IDEMPOTENCY_KEY='abc')
+        IdempotencyKey.objects.update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+
+        res = self.client.post(TAGS_URL, {'name': 'Vegan'},
+                               HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn(idempotency.REPLAYED_HEADER, res)
+        self.assertEqual(Tag.objects.count(), 2)
+
+        IdempotencyKey.objects.create(user=self.user, key='old',
+                                      fingerprint='digest')
+        IdempotencyKey.objects.filter(key='old').update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        call_command('prune_idempotency_keys', stdout=io.StringIO())
+        self.assertEqual(
+            list(IdempotencyKey.objects.values_list('key', flat=True)),
+            ['abc']
+        )
+
+    def test_upload_image_once(self):
+        """Test a retried upload does not write the image again"""
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, True)
+        recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                       time_minutes=5, price=1)
+        url = reverse('recipe:recipe-upload-image', args=[recipe.id])
+
+        with override_settings(MEDIA_ROOT=media_root):
+            for attempt in range(2):
+                buf = io.BytesIO()
+                Image.new('RGB', (10, 10)).save(buf, format='JPEG')
+                buf.name = 'curry.jpg'
+                buf.seek(0)
+                res = self.client.post(url, {'image': buf},
+                                       format='multipart',
+                                       HTTP_IDEMPOTENCY_KEY='abc')
+                self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(res[idempotency.REPLAYED_HEADER], 'true')
+        recipe.refresh_from_db()
+        self.assertEqual(res.data['image'].rsplit('/', 1)[-1],
+                         recipe.image.name.rsplit('/', 1)[-1])
+        self.assertEqual(len(os.listdir(os.path.join(
+            media_root, 'uploads', 'recipe'
+        ))), 2)
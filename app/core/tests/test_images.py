@@ -0,0 +1,109 @@
+import io
+import shutil
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from faker import Faker, providers
+
+from core import images
+from core.models import Recipe
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+def sample_image(width=800, height=400):
+    """Return a JPEG file of the given size"""
+    buf = io.BytesIO()
+    Image.new('RGB', (width, height), 'red').save(buf, format='JPEG')
+    buf.seek(0)
+    return buf
+
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        settings = override_settings(MEDIA_ROOT=self.media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(shutil.rmtree, self.media_root, True)
+
+    def test_generate_variants(self):
+        """Test variants are written once per content, never upscaled"""
+        digest = images.generate(sample_image())
+
+        self.assertEqual(images.generate(sample_image()), digest)
+        for width in images.WIDTHS:
+            name = images.variant_name(digest, width, 'jpeg')
+            with Image.open(default_storage.open(name)) as variant:
+                self.assertEqual(variant.size,
+                                 (min(width, 800), min(width, 800) // 2))
+
+    def test_pick(self):
+        """Test the smallest variant at least as wide is picked"""
+        self.assertEqual(images.pick(300, 'jpeg'), (320, 'jpeg'))
+        self.assertEqual(images.pick(5000, 'jpeg'), (1280, 'jpeg'))
+        self.assertEqual(images.pick(None, None, 'image/webp,*/*'),
+                         (images.THUMBNAIL_WIDTH, 'webp'))
+        self.assertEqual(images.pick(160, None, 'image/*'), (160, 'jpeg'))
+
+    def test_serve_variant(self):
+        """Test variants are streamed with immutable cache headers"""
+        digest = images.generate(sample_image())
+        url = reverse('image-variant', args=[digest, 320, 'jpeg'])
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['Cache-Control'], images.CACHE_CONTROL)
+        with Image.open(io.BytesIO(b''.join(res.streaming_content))) as img:
+            self.assertEqual(img.width, 320)
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=res['ETag'])
+        self.assertEqual(res.status_code, 304)
+        res = self.client.get(reverse('image-variant',
+                                      args=[digest, 321, 'jpeg']))
+        self.assertEqual(res.status_code, 404)
+
+    def test_serve_offloaded(self):
+        """Test the transfer is left to the front server when configured"""
+        digest = images.generate(sample_image())
+        url = reverse('image-variant', args=[digest, 160, 'jpeg'])
+        name = images.variant_name(digest, 160, 'jpeg')
+
+        with self.settings(MEDIA_ACCEL_PREFIX='/protected/'):
+            res = self.client.get(url)
+        self.assertEqual(res['X-Accel-Redirect'], f'/protected/{name}')
+        self.assertEqual(res.content, b'')
+
+        with self.settings(MEDIA_SENDFILE=True):
+            res = self.client.get(url)
+        self.assertEqual(res['X-Sendfile'], default_storage.path(name))
+
+    def test_generate_command(self):
+        """Test variants are generated for images uploaded before them"""
+        user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        recipe = Recipe.objects.create(user=user, title='Curry',
+                                       time_minutes=5, price=1)
+        recipe.image.save('curry.jpg', ContentFile(sample_image().read()))
+
+        call_command('generate_image_variants', stdout=io.StringIO())
+
+        recipe.refresh_from_db()
+        self.assertTrue(recipe.image_digest)
+        self.assertTrue(default_storage.exists(
+            images.variant_name(recipe.image_digest, 160, 'jpeg')
+        ))
@@ -0,0 +1,101 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, TransactionTestCase
+
+from faker import Faker, providers
+
+from core import matching
+from core.models import Ingredient, Recipe
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class IngredientIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = matching.IngredientIndex()
+        self.index.add(10, [1, 2])
+        self.index.add(20, [1, 2, 3, 4])
+        self.index.add(30, [5])
+
+    def test_iter_bits(self):
+        """Test set bit positions are yielded in order"""
+        self.assertEqual(list(matching.iter_bits(0b1010000000101)),
+                         [0, 2, 10, 12])
+        self.assertEqual(list(matching.iter_bits(0)), [])
+
+    def test_match_ranks_by_missing(self):
+        """Test recipes are ranked by missing ingredients then overlap"""
+        self.assertEqual(self.index.match([1, 2, 3]), [
+            (10, 2, 0, 2 / 3),
+            (20, 3, 1, 3 / 4),
+        ])
+        self.assertEqual(self.index.match([1, 2, 3], max_missing=0),
+                         [(10, 2, 0, 2 / 3)])
+        self.assertEqual(self.index.match([9]), [])
+
+    def test_updates_idempotent(self):
+        """Test replaying an update leaves the index unchanged"""
+        self.index.add(10, [3])
+        self.index.add(10, [3])
+        self.index.discard(20, [4])
+        self.index.discard(20, [4])
+
+        self.assertEqual(self.index.match([1, 2, 3]), [
+            (10, 3, 0, 1.0),
+            (20, 3, 0, 1.0),
+        ])
+
+    def test_removed_recipes_and_ingredients(self):
+        """Test deleted recipes and ingredients drop out of answers"""
+        self.index.remove(10)
+        self.index.drop_ingredient(4)
+        self.index.drop_ingredient(4)
+
+        self.assertEqual(self.index.match([1, 2, 3]), [(20, 3, 0, 1.0)])
+
+
+class IngredientIndexSyncTests(TransactionTestCase):
+
+    def setUp(self):
+        matching.clear()
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.egg = Ingredient.objects.create(user=self.user, name='Egg')
+        self.recipe = Recipe.objects.create(user=self.user, title='Fried',
+                                            time_minutes=10, price=5)
+        self.recipe.ingredients.add(self.rice)
+
+    def test_index_built_from_database(self):
+        """Test a user's index is built from their recipe ingredients"""
+        index = matching.get(self.user.id)
+
+        self.assertEqual(index.match([self.rice.id]),
+                         [(self.recipe.id, 1, 0, 1.0)])
+
+    def test_index_updated_incrementally(self):
+        """Test committed changes update the index without a rebuild"""
+        index = matching.get(self.user.id)
+
+        self.recipe.ingredients.add(self.egg)
+        other = Recipe.objects.create(user=self.user, title='Boiled',
+                                      time_minutes=5, price=1)
+        self.egg.recipe_set.add(other)
+
+        with self.assertNumQueries(0):
+            self.assertIs(matching.get(self.user.id), index)
+        self.assertEqual(index.match([self.egg.id]), [
+            (other.id, 1, 0, 1.0),
+            (self.recipe.id, 1, 1, 0.5),
+        ])
+
+        self.recipe.soft_delete()
+        self.egg.delete()
+
+        self.assertEqual(index.match([self.rice.id, self.egg.id]), [])
+        self.assertEqual(matching.build(self.user.id).match([self.rice.id]),
+                         [])
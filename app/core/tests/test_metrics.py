@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from faker import Faker, providers
+
+from core import metrics
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+TAGS_URL = reverse('recipe:tag-list')
+METRICS_URL = reverse('metrics')
+
+
+class HistogramTests(TestCase):
+
+    def test_histogram_collect(self):
+        """Test observations are exported as cumulative buckets"""
+        hist = metrics.Histogram('test_seconds', 'Test', (1, 2))
+        hist.observe(0.5, 'TagViewSet', 'list')
+        hist.observe(1.5, 'TagViewSet', 'list')
+        hist.observe(3, 'TagViewSet', 'list')
+
+        text = hist.collect()
+
+        self.assertIn('# TYPE test_seconds histogram', text)
+        self.assertIn(
+            'test_seconds_bucket{view="TagViewSet",action="list",le="1"} 1',
+            text
+        )
+        self.assertIn(
+            'test_seconds_bucket{view="TagViewSet",action="list",le="2"} 2',
+            text
+        )
+        self.assertIn(
+            'test_seconds_bucket{view="TagViewSet",action="list",le="+Inf"} 3',
+            text
+        )
+        self.assertIn(
+            'test_seconds_count{view="TagViewSet",action="list"} 3',
+            text
+        )
+
+    def test_collect_sums_worker_files(self):
+        """Test the files of other and exited workers are added in"""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        hist = metrics.REQUEST_SECONDS
+        hist.clear()
+        hist.observe(0.5, 'TagViewSet', 'list')
+        with open(os.path.join(directory, '1.json'), 'w') as f:
+            json.dump({hist.name: hist.snapshot()}, f)
+        metrics.dump(directory)
+        os.rename(os.path.join(directory, f'{os.getpid()}.json'),
+                  os.path.join(directory, '2.json'))
+        metrics.archive(directory, 2)
+
+        text = metrics.collect(directory)
+
+        self.assertIn('http_request_duration_seconds_count'
+                      '{view="TagViewSet",action="list"} 3', text)
+        self.assertEqual(sorted(os.listdir(directory)),
+                         ['1.json', metrics.ARCHIVE])
+
+    def test_duplicate_count(self):
+        """Test repeated statements are counted as duplicates"""
+        stats = metrics.RequestStats()
+        stats.statements = ['SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 1']
+
+        self.assertEqual(stats.query_count, 4)
+        self.assertEqual(stats.duplicate_count, 2)
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client.force_authenticate(self.user)
+        for histogram in metrics.HISTOGRAMS:
+            histogram.clear()
+
+    def test_server_timing_header(self):
+        """Test responses carry a Server-Timing header with query counts"""
+        res = self.client.get(TAGS_URL)
+
+        timing = res['Server-Timing']
+        self.assertIn('app;dur=', timing)
+        self.assertIn('db;dur=', timing)
+        self.assertIn('1 queries', timing)
+        self.assertIn('serializer;dur=', timing)
+
+    def test_metrics_labelled_by_view_and_action(self):
+        """Test the metrics endpoint reports the view and action"""
+        self.client.get(TAGS_URL)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            res = self.client.get(METRICS_URL,
+                                  HTTP_AUTHORIZATION='Bearer s3cret')
+
+        self.assertEqual(res.status_code, 200)
+        self.assertContains(
+            res,
+            'db_queries_per_request_count{view="TagViewSet",action="list"} 1'
+        )
+
+    def test_metrics_require_token(self):
+        """Test scrapes without the metrics token are not answered"""
+        res = self.client.get(METRICS_URL)
+        self.assertEqual(res.status_code, 404)
+
+        with override_settings(METRICS_TOKEN='s3cret'):
+            res = self.client.get(METRICS_URL,
+                                  HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(res.status_code, 404)
@@ -0,0 +1,55 @@
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory
+from django.views.decorators.csrf import csrf_exempt
+
+from core.middleware import SessionStackMiddleware
+
+
+def view(request):
+    return HttpResponse()
+
+
+class SessionStackMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.seen = []
+        self.middleware = SessionStackMiddleware(self.get_response)
+
+    def get_response(self, request):
+        self.seen.append(request)
+        return HttpResponse()
+
+    def test_api_paths_skip_sessions(self):
+        """Test token API requests do not get a session or user"""
+        request = self.factory.get('/api/recipe/recipe/')
+
+        self.middleware(request)
+
+        self.assertFalse(hasattr(self.seen[0], 'session'))
+        self.assertFalse(hasattr(self.seen[0], 'user'))
+
+    def test_other_paths_use_sessions(self):
+        """Test the admin and other paths keep the session middleware"""
+        request = self.factory.get('/admin/')
+
+        self.middleware(request)
+
+        self.assertTrue(hasattr(self.seen[0], 'session'))
+        self.assertTrue(hasattr(self.seen[0], 'user'))
+
+    def test_csrf_checked_outside_api(self):
+        """Test CSRF is still enforced on session authenticated paths"""
+        admin = self.factory.post('/admin/')
+        admin._dont_enforce_csrf_checks = False
+        api = self.factory.post('/api/recipe/recipe/')
+
+        self.middleware(admin)
+        self.assertEqual(
+            self.middleware.process_view(admin, view, (), {}).status_code,
+            403
+        )
+        self.assertIsNone(self.middleware.process_view(api, view, (), {}))
+        self.assertIsNone(self.middleware.process_view(
+            admin, csrf_exempt(view), (), {}
+        ))
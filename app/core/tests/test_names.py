@@ -0,0 +1,114 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from faker import Faker, providers
+
+from core import names
+from core.models import Tag, Ingredient, Recipe
+from recipe.serializers import RecipeDetailSerializer, RecipeSerializer
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class NameDictionaryTests(TestCase):
+
+    def setUp(self):
+        names.clear()
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Tofu')
+        self.recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                            time_minutes=10, price=5)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+    def test_dictionary_cached_in_process(self):
+        """Test a user's names are loaded once until they change"""
+        with self.assertNumQueries(1):
+            first = names.get(self.user.id)
+            second = names.get(self.user.id)
+
+        self.assertIs(first, second)
+        self.assertEqual(first, {'tags': {self.tag.id: 'Vegan'},
+                                 'ingredients': {self.ingredient.id: 'Tofu'}})
+
+    def test_write_bumps_version(self):
+        """Test renaming a tag invalidates the cached dictionary"""
+        names.get(self.user.id)
+
+        self.tag.name = 'Plant Based'
+        self.tag.save()
+
+        self.assertEqual(names.get(self.user.id)['tags'][self.tag.id],
+                         'Plant Based')
+
+    def test_least_recently_used_evicted(self):
+        """Test the process keeps at most MAX_USERS dictionaries"""
+        other = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        with patch.object(names, 'MAX_USERS', 1):
+            names.get(self.user.id)
+            names.get(other.id)
+
+            with self.assertNumQueries(1):
+                names.get(self.user.id)
+
+    def test_detail_names_without_join(self):
+        """Test nested names are read without joining tags or ingredients"""
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        names.get(self.user.id)
+
+        with CaptureQueriesContext(connection) as ctx:
+            data = RecipeDetailSerializer(recipe).data
+
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertNotIn('"core_tag"', ctx.captured_queries[0]['sql'])
+        self.assertEqual(data['tags'], [{'id': self.tag.id,
+                                         'name': 'Vegan'}])
+        self.assertEqual(data['ingredients'], [{'id': self.ingredient.id,
+                                                'name': 'Tofu'}])
+
+    def test_list_reads_relations_once(self):
+        """Test a list of recipes reads all relation ids in one query"""
+        for index in range(5):
+            recipe = Recipe.objects.create(user=self.user, title=str(index),
+                                           time_minutes=10, price=5)
+            recipe.tags.add(self.tag)
+
+        with self.assertNumQueries(2):
+            data = RecipeSerializer(Recipe.objects.all(), many=True).data
+
+        self.assertEqual([item['tags'] for item in data],
+                         [[self.tag.id]] * 6)
+        self.assertEqual(data[0]['ingredients'], [self.ingredient.id])
+
+    def test_list_checks_version_once_per_user(self):
+        """Test serializing many recipes reads the version stamp of their
+        owner from the cache once
+        """
+        for index in range(5):
+            recipe = Recipe.objects.create(user=self.user, title=str(index),
+                                           time_minutes=10, price=5)
+            recipe.tags.add(self.tag)
+        names.get(self.user.id)
+
+        with patch('core.names.cache', wraps=cache) as shared:
+            data = RecipeDetailSerializer(Recipe.objects.all(),
+                                          many=True).data
+
+        self.assertEqual(shared.get.call_count, 1)
+        self.assertEqual([item['tags'] for item in data],
+                         [[{'id': self.tag.id, 'name': 'Vegan'}]] * 6)
@@ -0,0 +1,133 @@
+import os
+import shutil
+import sys
+import tempfile
+from collections import Counter
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+from faker import Faker, providers
+
+from core import profiling
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+TAGS_URL = reverse('recipe:tag-list')
+
+
+class FakeSampler:
+    """Sampler that reports a fixed stack for every watched request"""
+
+    def watch(self, thread_id):
+        return Counter({'main;dispatch;list': 3})
+
+    def unwatch(self, thread_id):
+        pass
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_collapse_is_root_first(self):
+        """Test the collapsed stack starts at the outermost frame"""
+        stack = profiling.collapse(sys._getframe())
+
+        frames = stack.split(';')
+        self.assertTrue(frames[-1].startswith('test_collapse_is_root_first'))
+        self.assertGreater(len(frames), 1)
+
+    def test_collapsed_round_trip(self):
+        """Test collapsed stacks survive a write and read"""
+        path = os.path.join(self.directory, 'test.collapsed')
+        stacks = Counter({'a;b': 2, 'a;c d (x.py:1)': 5})
+
+        profiling.write_collapsed(path, stacks)
+
+        self.assertEqual(profiling.read_collapsed(path), stacks)
+
+    def test_render_svg(self):
+        """Test every frame of a stack is rendered in the flame graph"""
+        svg = profiling.render_svg(Counter({'main;list': 4}), 'Tag.list')
+
+        self.assertTrue(svg.startswith('<svg'))
+        self.assertIn('main (4 samples', svg)
+        self.assertIn('list (4 samples', svg)
+
+    def test_sampler_restarted_after_fork(self):
+        """Test each process, and a dead sampler, gets a running sampler"""
+        sampler = profiling.get_sampler(0.01)
+        self.assertTrue(sampler.is_alive())
+        self.assertIs(profiling.get_sampler(0.01), sampler)
+
+        with patch('core.profiling.os.getpid', return_value=-1):
+            forked = profiling.get_sampler(0.01)
+
+        self.assertIsNot(forked, sampler)
+        self.assertTrue(forked.is_alive())
+
+    def test_rotate_keeps_newest_captures(self):
+        """Test captures beyond the limit are deleted oldest first"""
+        for index in range(5):
+            path = os.path.join(self.directory, f'V.list.{index}.collapsed')
+            profiling.write_collapsed(path, Counter({'a': 1}))
+            os.utime(path, (index, index))
+        os.mkdir(os.path.join(self.directory, 'flamegraphs'))
+
+        profiling.rotate(self.directory, 2)
+
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['V.list.3.collapsed', 'V.list.4.collapsed',
+                          'flamegraphs'])
+
+    def test_slow_request_captured(self):
+        """Test a request over the threshold writes a capture file"""
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        ))
+
+        with override_settings(PROFILER_ENABLED=True,
+                               PROFILER_DIR=self.directory,
+                               PROFILER_THRESHOLD_MS=0,
+                               PROFILER_SAMPLE_EVERY=1), \
+                patch('core.profiling.get_sampler',
+                      return_value=FakeSampler()):
+            client.get(TAGS_URL)
+
+        captures = os.listdir(self.directory)
+        self.assertEqual(len(captures), 1)
+        self.assertTrue(captures[0].startswith('TagViewSet.list.'))
+
+    def test_flamegraph_merges_by_view(self):
+        """Test captures of the same view and action are merged"""
+        for name in ('TagViewSet.list.1', 'TagViewSet.list.2'):
+            profiling.write_collapsed(
+                os.path.join(self.directory, f'{name}.collapsed'),
+                Counter({'main;list': 2})
+            )
+        output = os.path.join(self.directory, 'out')
+
+        call_command('flamegraph', input=self.directory, output=output,
+                     stdout=StringIO())
+
+        merged = profiling.read_collapsed(
+            os.path.join(output, 'TagViewSet.list.collapsed')
+        )
+        self.assertEqual(merged, Counter({'main;list': 4}))
+        self.assertTrue(
+            os.path.exists(os.path.join(output, 'TagViewSet.list.svg'))
+        )
@@ -0,0 +1,94 @@
+import os
+import tempfile
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.core.management import call_command
+from django.test import TestCase
+
+from faker import Faker, providers
+
+from core import purge
+from core.models import Tag, Ingredient, Recipe, RecipeSummary, Tombstone
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class PurgeTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+
+    def create_recipe(self, image=False):
+        recipe = Recipe.objects.create(user=self.user, title=fake.word(),
+                                       time_minutes=10, price=5)
+        recipe.tags.add(self.tag)
+        if image:
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+                Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+                ntf.seek(0)
+                recipe.image.save('photo.jpg', File(ntf))
+        return recipe
+
+    def test_soft_delete_updates_summary(self):
+        """Test soft deleting a recipe takes it out of the counts once"""
+        recipe = self.create_recipe()
+
+        recipe.soft_delete()
+        purge.purge_recipes('default')
+
+        stats = RecipeSummary.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 0)
+        self.assertEqual(stats.total_time_minutes, 0)
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+        self.assertEqual(
+            Tombstone.objects.filter(kind=Tombstone.RECIPE).count(), 1
+        )
+
+    def test_purge_recipes_in_batches(self):
+        """Test purging removes soft deleted recipes and their images"""
+        kept = self.create_recipe()
+        deleted = [self.create_recipe(image=True) for _ in range(3)]
+        paths = [recipe.image.path for recipe in deleted]
+        for recipe in deleted:
+            recipe.soft_delete()
+
+        purged = purge.purge_recipes('default', batch_size=2)
+
+        self.assertEqual(purged, 3)
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertEqual(Recipe.tags.through.objects.count(), 1)
+        for path in paths:
+            self.assertFalse(os.path.exists(path))
+
+    def test_purge_deleted_user(self):
+        """Test purging a deleted user removes everything they own"""
+        recipe = self.create_recipe(image=True)
+        Ingredient.objects.create(user=self.user, name='Tofu')
+        other = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        Tag.objects.create(user=other, name='Keto')
+        self.user.soft_delete()
+
+        call_command('purge_deleted', batch_size=1, pause=0)
+
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertFalse(os.path.exists(recipe.image.path))
+        for model in (Tag, Ingredient, Recipe, RecipeSummary, Tombstone):
+            self.assertFalse(
+                model.objects.filter(user_id=self.user.pk).exists()
+            )
+        self.assertTrue(Tag.objects.filter(user=other).exists())
@@ -0,0 +1,80 @@
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import TestCase, RequestFactory, override_settings
+
+from core.middleware import ReplicaRoutingMiddleware
+from core.models import Recipe
+from core.routers import PrimaryReplicaRouter, use_primary
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+
+    def setUp(self):
+        self.router = PrimaryReplicaRouter()
+        self.factory = RequestFactory()
+        self.routed = []
+        self.status = 200
+        cache.clear()
+
+    def get_response(self, request):
+        """Record where a read issued by the view would be routed"""
+        self.routed.append(self.router.db_for_read(Recipe))
+        return HttpResponse(status=self.status)
+
+    def request(self, method, token='Token abc'):
+        middleware = ReplicaRoutingMiddleware(self.get_response)
+        request = getattr(self.factory, method)(
+            '/api/recipe/recipe/', HTTP_AUTHORIZATION=token
+        )
+        return middleware(request)
+
+    def test_reads_go_to_replica(self):
+        """Test safe reads are routed to a replica"""
+        self.assertEqual(self.router.db_for_read(Recipe), 'replica')
+        self.assertEqual(self.router.db_for_write(Recipe), 'default')
+
+    def test_use_primary_pins_reads(self):
+        """Test reads inside use_primary go to the primary"""
+        with use_primary():
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Recipe), 'default')
+            self.assertEqual(self.router.db_for_read(Recipe), 'default')
+        self.assertEqual(self.router.db_for_read(Recipe), 'replica')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_uses_primary(self):
+        """Test reads use the primary when no replica is configured"""
+        self.assertEqual(self.router.db_for_read(Recipe), 'default')
+
+    def test_write_request_reads_from_primary(self):
+        """Test reads made while handling a write use the primary"""
+        self.request('post')
+
+        self.assertEqual(self.routed, ['default'])
+
+    def test_client_pinned_after_write(self):
+        """Test a client reads from the primary right after writing"""
+        self.request('get')
+        self.request('post')
+        self.request('get')
+        self.request('get', token='Token other')
+
+        self.assertEqual(self.routed,
+                         ['replica', 'default', 'default', 'replica'])
+
+    def test_failed_write_does_not_pin(self):
+        """Test a rejected write does not pin the client"""
+        self.status = 400
+        self.request('post')
+        self.request('get')
+
+        self.assertEqual(self.routed, ['default', 'replica'])
+
+    @override_settings(REPLICA_PIN_SECONDS=0)
+    def test_pin_expires(self):
+        """Test the pin window expires"""
+        self.request('patch')
+        self.request('get')
+
+        self.assertEqual(self.routed, ['default', 'replica'])
@@ -0,0 +1,79 @@
+from collections import Counter
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import sharding
+from core.models import Recipe
+from core.routers import ShardRouter
+
+
+class ShardingTests(TestCase):
+
+    def test_ring_is_stable(self):
+        """Test the same key always maps to the same alias"""
+        ring = sharding.HashRing(['default', 'shard_1', 'shard_2'])
+
+        self.assertEqual(
+            [ring.get(user_id) for user_id in range(100)],
+            [ring.get(user_id) for user_id in range(100)]
+        )
+
+    def test_ring_spreads_keys(self):
+        """Test keys are spread over every alias"""
+        ring = sharding.HashRing(['default', 'shard_1', 'shard_2'])
+
+        counts = Counter(ring.get(user_id) for user_id in range(3000))
+
+        self.assertEqual(set(counts), {'default', 'shard_1', 'shard_2'})
+        for count in counts.values():
+            self.assertGreater(count, 600)
+
+    def test_adding_shard_moves_few_keys(self):
+        """Test adding a shard only moves keys onto the new shard"""
+        old = sharding.HashRing(['default', 'shard_1'])
+        new = sharding.HashRing(['default', 'shard_1', 'shard_2'])
+
+        moved = [user_id for user_id in range(3000)
+                 if old.get(user_id) != new.get(user_id)]
+
+        self.assertLess(len(moved), 1500)
+        for user_id in moved:
+            self.assertEqual(new.get(user_id), 'shard_2')
+
+    def test_single_shard_is_default(self):
+        """Test every user lives on default without extra shards"""
+        self.assertFalse(sharding.is_sharded())
+        self.assertEqual(sharding.shard_for_user(42), 'default')
+
+    @override_settings(DATABASE_SHARDS=['default', 'shard_1'])
+    def test_router_uses_instance_user(self):
+        """Test sharded models route by the owning user's shard"""
+        recipe = Recipe(user_id=7, title='Soup', time_minutes=5, price=1)
+        router = ShardRouter()
+        expected = sharding.shard_for_user(7)
+
+        self.assertEqual(router.db_for_write(Recipe, instance=recipe),
+                         expected)
+        self.assertEqual(
+            router.db_for_read(Recipe.tags.through, instance=recipe),
+            expected
+        )
+        self.assertIsNone(router.db_for_read(Recipe))
+        self.assertIsNone(
+            router.db_for_read(get_user_model(), instance=recipe)
+        )
+
+    def test_reshard_noop_on_single_shard(self):
+        """Test resharding moves nothing when all data is in place"""
+        user = get_user_model().objects.create_user('a@example.com', 'pass')
+        Recipe.objects.create(user=user, title='Soup', time_minutes=5,
+                              price=1)
+        out = StringIO()
+
+        call_command('reshard', stdout=out)
+
+        self.assertIn('Moved 0 users', out.getvalue())
+        self.assertEqual(Recipe.objects.filter(user=user).count(), 1)
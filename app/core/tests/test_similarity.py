@@ -0,0 +1,74 @@
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from faker import Faker, providers
+
+from core import similarity
+from core.models import Ingredient, Recipe, RecipeNeighbor, Tag
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class NeighborsTests(TestCase):
+
+    def test_ranked_by_cosine(self):
+        """Test neighbors are ranked by cosine, ties by lowest id"""
+        vectors = {
+            1: {'a', 'b'},
+            2: {'a', 'b', 'c', 'd'},
+            3: {'a'},
+            4: {'a', 'x'},
+            5: {'z'},
+        }
+
+        ranked = dict(similarity.neighbors(vectors, k=2))
+
+        self.assertEqual(ranked[1], [(2, 2 / 8 ** 0.5), (3, 1 / 2 ** 0.5)])
+        self.assertEqual(ranked[3], [(1, 1 / 2 ** 0.5), (4, 1 / 2 ** 0.5)])
+        self.assertEqual(ranked[5], [])
+
+
+class RefreshTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.recipes = []
+        for title in ('Curry', 'Pilaf', 'Risotto'):
+            recipe = Recipe.objects.create(user=self.user, title=title,
+                                           time_minutes=10, price=5)
+            recipe.ingredients.add(rice)
+            self.recipes.append(recipe)
+        self.recipes[0].tags.add(tag)
+        self.recipes[1].tags.add(tag)
+
+    def test_refresh_user(self):
+        """Test a user's neighbor rows are replaced from their recipes"""
+        curry, pilaf, risotto = self.recipes
+        risotto.soft_delete()
+
+        self.assertEqual(similarity.refresh_user(self.user.id), 2)
+        self.assertEqual(similarity.refresh_user(self.user.id), 2)
+
+        self.assertEqual(
+            list(RecipeNeighbor.objects.order_by('recipe_id')
+                 .values_list('recipe_id', 'neighbor_id', 'rank')),
+            [(curry.id, pilaf.id, 0), (pilaf.id, curry.id, 0)]
+        )
+
+    def test_refresh_command(self):
+        """Test the command refreshes the neighbors of every user"""
+        call_command('refresh_recipe_neighbors', '--top', '1', stdout=None)
+
+        self.assertEqual(RecipeNeighbor.objects.count(), 3)
+        self.assertEqual(
+            RecipeNeighbor.objects.get(recipe=self.recipes[0]).neighbor,
+            self.recipes[1]
+        )
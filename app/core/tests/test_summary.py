@@ -0,0 +1,127 @@
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from faker import Faker, providers
+
+from core import summary
+from core.models import Tag, Ingredient, Recipe, RecipeSummary
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class RecipeSummaryTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.ingredient = Ingredient.objects.create(user=self.user,
+                                                    name='Tofu')
+
+    def create_recipe(self, time_minutes=10, price='5.00'):
+        return Recipe.objects.create(
+            user=self.user,
+            title=fake.word(),
+            time_minutes=time_minutes,
+            price=Decimal(price)
+        )
+
+    def get_summary(self):
+        return RecipeSummary.objects.get(user=self.user)
+
+    def test_summary_created_with_user(self):
+        """Test a new user starts with an empty summary"""
+        stats = self.get_summary()
+
+        self.assertEqual(stats.recipe_count, 0)
+        self.assertIsNone(stats.average_time_minutes)
+        self.assertIsNone(stats.average_price_cents)
+
+    def test_summary_tracks_create_update_delete(self):
+        """Test the totals follow recipe creates, edits and deletes"""
+        recipe = self.create_recipe(10, '4.00')
+        self.create_recipe(30, '8.00')
+
+        stats = self.get_summary()
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertEqual(stats.average_time_minutes, 20)
+        self.assertEqual(stats.average_price_cents, 600)
+
+        recipe = Recipe.objects.get(pk=recipe.pk)
+        recipe.time_minutes = 50
+        recipe.price = Decimal('10.00')
+        recipe.save()
+
+        stats = self.get_summary()
+        self.assertEqual(stats.total_time_minutes, 80)
+        self.assertEqual(stats.total_price_cents, 1800)
+
+        recipe.delete()
+
+        stats = self.get_summary()
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.total_time_minutes, 30)
+        self.assertEqual(stats.total_price_cents, 800)
+
+    def test_relation_counts(self):
+        """Test tag and ingredient counts follow M2M changes"""
+        recipe1 = self.create_recipe()
+        recipe2 = self.create_recipe()
+        recipe1.tags.add(self.tag)
+        recipe2.tags.add(self.tag)
+        recipe1.ingredients.add(self.ingredient)
+
+        self.tag.refresh_from_db()
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 2)
+        self.assertEqual(self.ingredient.recipe_count, 1)
+
+        recipe1.tags.remove(self.tag)
+        recipe2.delete()
+        recipe1.ingredients.clear()
+
+        self.tag.refresh_from_db()
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+        self.assertEqual(self.ingredient.recipe_count, 0)
+
+    def test_reverse_relation_counts(self):
+        """Test adding recipes from the tag side updates its count"""
+        self.tag.recipe_set.add(self.create_recipe(), self.create_recipe())
+
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 2)
+
+    def test_rebuild_matches_incremental(self):
+        """Test a bulk rebuild gives the same numbers as the signals"""
+        recipe = self.create_recipe(15, '3.50')
+        recipe.tags.add(self.tag)
+        self.create_recipe(45, '6.50')
+        RecipeSummary.objects.filter(user=self.user).update(recipe_count=99)
+        Tag.objects.filter(pk=self.tag.pk).update(recipe_count=0)
+
+        written = summary.rebuild('default')
+
+        self.assertEqual(written, 1)
+        stats = self.get_summary()
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertEqual(stats.total_time_minutes, 60)
+        self.assertEqual(stats.total_price_cents, 1000)
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 1)
+
+    def test_missing_summary_is_rebuilt(self):
+        """Test a user without a summary row gets one on first change"""
+        RecipeSummary.objects.filter(user=self.user).delete()
+
+        self.create_recipe(20, '2.00')
+
+        stats = self.get_summary()
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.total_time_minutes, 20)
@@ -0,0 +1,267 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from faker import Faker, providers
+
+from core import webhooks
+from core.models import OutboxEvent, Recipe, WebhookCursor, \
+                        WebhookSubscription
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Record posted bodies and answer with the next queued status"""
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((dict(self.headers), body))
+        status, headers = self.server.responses.pop(0) \
+            if self.server.responses else (204, {})
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class WebhookStub:
+    """Local HTTP server standing in for a webhook subscriber"""
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.requests = []
+        self.server.responses = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        host, port = self.server.server_address
+        self.server.url = f'http://{host}:{port}/hook'
+        return self.server
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+
+
+class WebhookTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, title='Tofu Curry'):
+        res = self.client.post(
+            reverse('recipe:recipe-list'),
+            {'title': title, 'time_minutes': 10, 'price': '5.00',
+             'tags': [], 'ingredients': []},
+            format='json'
+        )
+        return res.data['id']
+
+    def test_mutations_write_outbox_events(self):
+        """Test recipe changes made through the API record events"""
+        recipe_id = self.create_recipe()
+        url = reverse('recipe:recipe-detail', args=[recipe_id])
+        self.client.patch(url, {'title': 'Green Curry'})
+        self.client.delete(url)
+        self.client.post(reverse('recipe:tag-list'), {'name': 'Vegan'})
+
+        events = OutboxEvent.objects.order_by('id')
+        self.assertEqual(
+            [event.topic for event in events],
+            ['recipe.created', 'recipe.updated', 'recipe.deleted',
+             'tag.created']
+        )
+        self.assertEqual(json.loads(events[1].payload)['title'],
+                         'Green Curry')
+        self.assertFalse(
+            Recipe.objects.filter(deleted_at__isnull=True).exists()
+        )
+
+    def test_dispatch_delivers_batches(self):
+        """Test events are posted in batches and the cursor advances"""
+        for index in range(5):
+            self.create_recipe(f'Recipe {index}')
+
+        with WebhookStub() as stub:
+            subscription = WebhookSubscription.objects.create(
+                url=stub.url,
+                secret='s3cret'
+            )
+            delivered = webhooks.dispatch('default', batch_size=2)
+
+        self.assertEqual(delivered, 5)
+        self.assertEqual(len(stub.requests), 3)
+        headers, body = stub.requests[0]
+        self.assertEqual(headers['X-Webhook-Signature'],
+                         webhooks.sign('s3cret', body))
+        titles = [event['payload']['title']
+                  for _, body in stub.requests
+                  for event in json.loads(body)['events']]
+        self.assertEqual(titles, [f'Recipe {i}' for i in range(5)])
+        cursor = WebhookCursor.objects.get(subscription=subscription)
+        self.assertEqual(cursor.last_event_id,
+                         OutboxEvent.objects.latest('id').id)
+
+    def test_dispatch_limits_batches(self):
+        """Test a pass sends at most max_batches requests per subscriber"""
+        for index in range(5):
+            self.create_recipe(f'Recipe {index}')
+
+        with WebhookStub() as stub:
+            WebhookSubscription.objects.create(url=stub.url)
+            first = webhooks.dispatch('default', batch_size=2, max_batches=1)
+            second = webhooks.dispatch('default', batch_size=2)
+
+        self.assertEqual((first, second), (2, 3))
+
+    def test_failed_delivery_backs_off(self):
+        """Test a failing subscriber is retried later from the same event"""
+        self.create_recipe()
+
+        with WebhookStub() as stub:
+            stub.responses = [(503, {'Retry-After': '120'})]
+            subscription = WebhookSubscription.objects.create(url=stub.url)
+            self.assertEqual(webhooks.dispatch('default'), 0)
+            self.assertEqual(webhooks.dispatch('default'), 0)
+
+            cursor = WebhookCursor.objects.get(subscription=subscription)
+            self.assertEqual(cursor.last_event_id, 0)
+            self.assertEqual(cursor.failures, 1)
+            self.assertGreater(cursor.retry_at, timezone.now())
+            self.assertEqual(len(stub.requests), 1)
+
+            cursor.retry_at = timezone.now()
+            cursor.save()
+            self.assertEqual(webhooks.dispatch('default'), 1)
+
+    def test_backoff_grows(self):
+        """Test the delay doubles with each failure up to a maximum"""
+        self.assertEqual(webhooks.backoff(1), webhooks.BACKOFF_SECONDS)
+        self.assertEqual(webhooks.backoff(2), 2 * webhooks.BACKOFF_SECONDS)
+        self.assertEqual(webhooks.backoff(100),
+                         webhooks.BACKOFF_MAX_SECONDS)
+
+    def test_prune_keeps_undelivered_events(self):
+        """Test pruning deletes only events every subscriber received"""
+        self.create_recipe()
+        with WebhookStub() as stub:
+            WebhookSubscription.objects.create(url=stub.url)
+            webhooks.dispatch('default')
+        self.create_recipe()
+
+        self.assertEqual(webhooks.prune('default'), 1)
+        self.assertEqual(OutboxEvent.objects.count(), 1)
+
+    def test_dispatch_delivers_events_committed_out_of_order(self):
+        """Test an event committing after one with a higher id is still
+        delivered and kept until then
+        """
+        for index in range(3):
+            self.create_recipe(f'Recipe {index}')
+        first, late, last = OutboxEvent.objects.order_by('id')
+        # The lower id is still in an open transaction at the first pass
+        late_id = late.id
+        late.delete()
+
+        with WebhookStub() as stub:
+            subscription = WebhookSubscription.objects.create(url=stub.url)
+            self.assertEqual(webhooks.dispatch('default'), 2)
+            late.id = late_id
+            late.save(force_insert=True)
+            self.assertEqual(webhooks.prune('default'), 2)
+            self.assertEqual(webhooks.dispatch('default'), 1)
+
+        ids = [[event['id'] for event in json.loads(body)['events']]
+               for _, body in stub.requests]
+        self.assertEqual(ids, [[first.id, last.id], [late.id]])
+        cursor = WebhookCursor.objects.get(subscription=subscription)
+        self.assertEqual(json.loads(cursor.gaps), {})
+        self.assertEqual(webhooks.prune('default'), 1)
+
+    def test_first_dispatch_watches_lower_ids(self):
+        """Test a new cursor delivers an event committing after its first
+        pass with a lower id than any it saw
+        """
+        for index in range(3):
+            self.create_recipe(f'Recipe {index}')
+        late, *visible = OutboxEvent.objects.order_by('id')
+        late_id = late.id
+        late.delete()
+
+        with WebhookStub() as stub:
+            WebhookSubscription.objects.create(url=stub.url)
+            self.assertEqual(webhooks.dispatch('default'), 2)
+            late.id = late_id
+            late.save(force_insert=True)
+            self.assertEqual(webhooks.dispatch('default'), 1)
+
+        ids = [[event['id'] for event in json.loads(body)['events']]
+               for _, body in stub.requests]
+        self.assertEqual(ids, [[event.id for event in visible], [late_id]])
+
+    def test_first_dispatch_skips_settled_ids(self):
+        """Test a new cursor does not watch ids below events inserted
+        longer ago than any transaction lasts
+        """
+        for index in range(3):
+            self.create_recipe(f'Recipe {index}')
+        rolled_back, settled, last = OutboxEvent.objects.order_by('id')
+        rolled_back.delete()
+        OutboxEvent.objects.filter(pk=settled.pk).update(
+            created_at=timezone.now() - timedelta(
+                seconds=webhooks.GAP_SECONDS + 1
+            )
+        )
+
+        with WebhookStub() as stub:
+            subscription = WebhookSubscription.objects.create(url=stub.url)
+            self.assertEqual(webhooks.dispatch('default'), 2)
+
+        cursor = WebhookCursor.objects.get(subscription=subscription)
+        self.assertEqual(json.loads(cursor.gaps), {})
+
+    def test_dispatch_forgets_old_gaps(self):
+        """Test ids skipped for longer than any transaction are dropped"""
+        self.create_recipe()
+        with WebhookStub() as stub:
+            subscription = WebhookSubscription.objects.create(url=stub.url)
+            webhooks.dispatch('default')
+            cursor = WebhookCursor.objects.get(subscription=subscription)
+            cursor.gaps = json.dumps({cursor.last_event_id - 1: 0})
+            cursor.save()
+            webhooks.dispatch('default')
+
+        cursor.refresh_from_db()
+        self.assertEqual(json.loads(cursor.gaps), {})
+        self.assertEqual(len(stub.requests), 1)
+
+    def test_dispatch_command(self):
+        """Test the command delivers the events of every shard"""
+        self.create_recipe()
+
+        with WebhookStub() as stub:
+            WebhookSubscription.objects.create(url=stub.url)
+            call_command('dispatch_webhooks')
+
+        self.assertEqual(len(stub.requests), 1)
+        self.assertFalse(OutboxEvent.objects.exists())
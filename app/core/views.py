@@ -0,0 +1,26 @@
+import hmac
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from core import images, metrics
+
+
+def metrics_view(request):
+    """Expose the request metrics of every worker in Prometheus text
+    format to scrapers sending the METRICS_TOKEN bearer token
+    """
+    token = settings.METRICS_TOKEN
+    credential = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(credential.encode(),
+                                            f'Bearer {token}'.encode()):
+        raise Http404
+    return HttpResponse(
+        metrics.collect(settings.METRICS_DIR),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def image_variant_view(request, image_digest, width, fmt):
+    """Send a recipe image variant, cacheable for good by its name"""
+    return images.serve(request, image_digest, width, fmt)
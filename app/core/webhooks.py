@@ -0,0 +1,175 @@
+"""Batched delivery of outbox events to webhook subscriptions"""
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from urllib import error, request
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min, Q
+from django.utils import timezone
+
+from core.models import OutboxEvent, WebhookCursor, WebhookSubscription
+from core.routers import use_primary
+
+
+BACKOFF_SECONDS = 5
+BACKOFF_MAX_SECONDS = 3600
+# Ids come from a sequence on insert, so an event can commit after one
+# with a higher id. Ids skipped by a delivery are looked for again until
+# no transaction could still be writing them.
+GAP_SECONDS = 120
+
+
+def sign(secret, body):
+    """Return the hex HMAC-SHA256 of body keyed with secret"""
+    return hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def post(subscription, body, timeout):
+    """POST body to a subscription, returning (ok, retry_after)"""
+    headers = {'Content-Type': 'application/json'}
+    if subscription.secret:
+        headers['X-Webhook-Signature'] = sign(subscription.secret, body)
+    req = request.Request(subscription.url, body, headers)
+    try:
+        with request.urlopen(req, timeout=timeout) as res:
+            return 200 <= res.status < 300, None
+    except error.HTTPError as exc:
+        retry_after = exc.headers.get('Retry-After', '')
+        return False, int(retry_after) if retry_after.isdigit() else None
+    except (error.URLError, OSError):
+        return False, None
+
+
+def serialize(shard, events):
+    """Return the request body delivering events"""
+    return json.dumps({
+        'shard': shard,
+        'events': [{
+            'id': event.id,
+            'topic': event.topic,
+            'object_id': event.object_id,
+            'user': event.user_id,
+            'created_at': event.created_at,
+            'payload': json.loads(event.payload),
+        } for event in events],
+    }, cls=DjangoJSONEncoder).encode()
+
+
+def backoff(failures):
+    """Return the seconds to wait after a number of failed deliveries"""
+    return min(BACKOFF_SECONDS * 2 ** (failures - 1), BACKOFF_MAX_SECONDS)
+
+
+def _settle(gaps, batch, batch_size, now):
+    """Drop the skipped ids older than GAP_SECONDS that a scan returning
+    batch would have found, had they been committed
+    """
+    scanned = batch[-1].id if len(batch) == batch_size else None
+    found = {event.id for event in batch}
+    for pk, seen in list(gaps.items()):
+        if seen <= now - GAP_SECONDS and pk not in found \
+                and (scanned is None or pk < scanned):
+            del gaps[pk]
+
+
+def _settled(events):
+    """Return the highest id inserted over GAP_SECONDS ago, below which
+    no event can still be committed, so a new cursor need only watch
+    for the lower ids above it
+    """
+    inserted = timezone.now() - timedelta(seconds=GAP_SECONDS)
+    return events.filter(created_at__lte=inserted) \
+        .aggregate(last=Max('id'))['last'] or 0
+
+
+def deliver(cursor, batch_size, max_batches, timeout):
+    """Send up to max_batches batches of events past cursor, and of the
+    ids it skipped, returning the number of events delivered. Stops at the
+    first failure and backs the cursor off, or for as long as the
+    subscriber asks.
+    """
+    delivered = 0
+    events = OutboxEvent.objects.using(cursor.shard).order_by('id')
+    gaps = {int(pk): seen for pk, seen in json.loads(cursor.gaps).items()}
+    for _ in range(max_batches):
+        now = time.time()
+        pending = Q(id__gt=cursor.last_event_id)
+        if gaps:
+            pending |= Q(id__in=list(gaps))
+        batch = list(events.filter(pending)[:batch_size])
+        _settle(gaps, batch, batch_size, now)
+        if not batch:
+            if json.dumps(gaps) != cursor.gaps:
+                cursor.gaps = json.dumps(gaps)
+                cursor.save()
+            break
+        ok, retry_after = post(cursor.subscription,
+                               serialize(cursor.shard, batch), timeout)
+        if not ok:
+            cursor.failures += 1
+            delay = retry_after or backoff(cursor.failures)
+            cursor.retry_at = timezone.now() + timedelta(seconds=delay)
+            cursor.gaps = json.dumps(gaps)
+            cursor.save()
+            break
+        found = {event.id for event in batch}
+        for pk in found:
+            gaps.pop(pk, None)
+        fresh = [pk for pk in sorted(found) if pk > cursor.last_event_id]
+        if fresh:
+            start = cursor.last_event_id + 1 if cursor.last_event_id \
+                else _settled(events) + 1
+            gaps.update((pk, now) for pk in range(start, fresh[-1])
+                        if pk not in found)
+            cursor.last_event_id = fresh[-1]
+        cursor.gaps = json.dumps(gaps)
+        cursor.failures = 0
+        cursor.retry_at = None
+        cursor.save()
+        delivered += len(batch)
+        if len(batch) < batch_size:
+            break
+    return delivered
+
+
+def dispatch(shard, batch_size=100, max_batches=10, timeout=5):
+    """Deliver the pending events of shard to every active subscription"""
+    delivered = 0
+    with use_primary():
+        for subscription in WebhookSubscription.objects.filter(
+                is_active=True):
+            cursor, _ = WebhookCursor.objects.get_or_create(
+                subscription=subscription,
+                shard=shard,
+            )
+            if cursor.retry_at and cursor.retry_at > timezone.now():
+                continue
+            delivered += deliver(cursor, batch_size, max_batches, timeout)
+    return delivered
+
+
+def prune(shard):
+    """Delete the events of shard every active subscription has received,
+    keeping the ids a cursor skipped, returning the number deleted
+    """
+    with use_primary():
+        subscriptions = WebhookSubscription.objects.filter(is_active=True)
+        events = OutboxEvent.objects.using(shard).all()
+        if subscriptions.exists():
+            missing = subscriptions.exclude(cursors__shard=shard).exists()
+            if missing:
+                return 0
+            cursors = WebhookCursor.objects.filter(
+                subscription__in=subscriptions,
+                shard=shard,
+            )
+            done = cursors.aggregate(last=Min('last_event_id'))['last']
+            skipped = {int(pk) for gaps in cursors.values_list('gaps',
+                                                               flat=True)
+                       for pk in json.loads(gaps)}
+            events = events.filter(id__lte=done).exclude(id__in=skipped)
+        deleted, _ = events.delete()
+    return deleted
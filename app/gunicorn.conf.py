@@ -0,0 +1,41 @@
+import os
+
+from app.server import sizing
+from core import metrics
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+
+workers, threads = sizing()
+worker_class = 'gthread'
+
+# Recycle workers periodically so slow leaks never reach the memory budget
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
+
+
+# Workers write their request metrics under METRICS_DIR for /metrics/ to
+# sum; those of exited workers are folded into one archive file.
+metrics_dir = os.environ.get('METRICS_DIR', '')
+
+
+def on_starting(server):
+    if metrics_dir:
+        metrics.reset(metrics_dir)
+
+
+def worker_exit(server, worker):
+    if metrics_dir:
+        metrics.dump(metrics_dir)
+
+
+def child_exit(server, worker):
+    if metrics_dir:
+        metrics.archive(metrics_dir, worker.pid)
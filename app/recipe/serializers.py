@@ -1,9 +1,230 @@
+from datetime import datetime, timedelta
+from decimal import Context, Decimal, DecimalException
+
+from django.db.models import F
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, PKOnlyObject
+
+from core import images, names, sharding
+from core.metrics import SerializerTimingMixin
+from core.models import Tag, Ingredient, Recipe, RecipeSummary
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Many related field resolving every primary key in one query"""
+
+    def get_attribute(self, instance):
+        ids = getattr(instance, '_relation_ids', {}).get(self.field_name)
+        if ids is None:
+            return super().get_attribute(instance)
+        return [PKOnlyObject(pk) for pk in ids]
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        pks = []
+        for item in data:
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+
+        queryset = child.get_queryset()
+        request = self.context.get('request')
+        if request is not None:
+            queryset = sharding.for_user(queryset, request.user)
+
+        objects = queryset.in_bulk(pks)
+        for pk in pks:
+            if pk not in objects:
+                child.fail('does_not_exist', pk_value=pk)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key related field validated in bulk when many=True"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+def sync_relation(instance, name, objects, created=False):
+    """Make the M2M relation name of instance hold exactly objects
+
+    The current ids are read in one query and the difference applied
+    with one bulk delete and one bulk insert on the through table,
+    sending the same m2m_changed signals as the related manager.
+    """
+    field = instance._meta.get_field(name)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = f'{field.m2m_reverse_field_name()}_id'
+    using = instance._state.db
+    links = through.objects.using(using)
+
+    wanted = {obj.pk for obj in objects}
+    current = set() if created else set(
+        links.filter(**{source: instance}).values_list(target, flat=True)
+    )
+    signal = {'sender': through, 'instance': instance, 'reverse': False,
+              'model': field.related_model, 'using': using}
+
+    removed = current - wanted
+    if removed:
+        m2m_changed.send(action='pre_remove', pk_set=removed, **signal)
+        links.filter(**{source: instance, f'{target}__in': removed}) \
+            .delete()
+        m2m_changed.send(action='post_remove', pk_set=removed, **signal)
+
+    added = wanted - current
+    if added:
+        m2m_changed.send(action='pre_add', pk_set=added, **signal)
+        links.bulk_create(
+            through(**{source: instance, target: pk}) for pk in added
+        )
+        m2m_changed.send(action='post_add', pk_set=added, **signal)
+
+    getattr(instance, '_prefetched_objects_cache', {}).pop(name, None)
+    getattr(instance, '_relation_ids', {}).pop(name, None)
+
 
-from core.models import Tag, Ingredient, Recipe
+class RelationNamesField(serializers.Field):
+    """Ids and names of a recipe relation, named from the owner's cached
+    dictionary instead of joining the related table
+    """
 
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
 
-class TagSerializer(serializers.ModelSerializer):
+    def dictionary(self, recipe, refresh=False):
+        """Return the names of a recipe's owner, checking the shared
+        version stamp once per user per serialization
+        """
+        dictionaries = self.context.setdefault('relation_names', {})
+        key = (recipe._state.db, recipe.user_id)
+        if refresh or key not in dictionaries:
+            dictionaries[key] = names.get(recipe.user_id, recipe._state.db,
+                                          refresh=refresh)
+        return dictionaries[key]
+
+    def to_representation(self, recipe):
+        ids = recipe._relation_ids[self.field_name]
+        dictionary = self.dictionary(recipe)
+        if any(pk not in dictionary[self.field_name] for pk in ids):
+            dictionary = self.dictionary(recipe, refresh=True)
+        return [{'id': pk, 'name': dictionary[self.field_name].get(pk)}
+                for pk in ids]
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    """Serialize many recipes, reading all their relation ids at once"""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        names.attach_relation_ids(recipes)
+        return super().to_representation(recipes)
+
+
+class IdListField(serializers.Field):
+    """Comma separated list of primary keys in a query parameter"""
+    default_error_messages = {
+        'invalid': 'Expected a comma separated list of ids.',
+    }
+
+    def to_internal_value(self, data):
+        try:
+            ids = [int(str_id) for str_id in str(data).split(',')]
+        except ValueError:
+            self.fail('invalid')
+        if min(ids) < 1:
+            self.fail('invalid')
+        return ids
+
+
+class CentsField(serializers.Field):
+    """Amount of money held in integer cents, read and written as a
+    decimal string with two places
+    """
+    MAX_CENTS = 2 ** 31 - 1
+    MAX_STRING_LENGTH = 32
+    MAX_WHOLE_DIGITS = 10
+    # Precise enough to scale any accepted string without rounding
+    CONTEXT = Context(prec=MAX_STRING_LENGTH + 2)
+    default_error_messages = {
+        'invalid': 'A valid number is required.',
+        'max_whole_digits': 'Ensure that there are no more than '
+                            '{max_whole_digits} digits before the decimal '
+                            'point.',
+        'max_decimal_places': 'Ensure that there are no more than 2 '
+                              'decimal places.',
+        'min_value': 'Ensure this value is greater than or equal to '
+                     '{min_value}.',
+        'max_value': 'Ensure this value is less than or equal to '
+                     '{max_value}.',
+    }
+
+    def __init__(self, min_value=None, max_value=MAX_CENTS, **kwargs):
+        self.min_value = min_value
+        self.max_value = max_value
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        data = str(data).strip()
+        if len(data) > self.MAX_STRING_LENGTH:
+            self.fail('invalid')
+        try:
+            value = Decimal(data)
+        except DecimalException:
+            self.fail('invalid')
+        if not value.is_finite():
+            self.fail('invalid')
+        # Bound the exponent first, as scaling or converting huge or tiny
+        # exponents overflows, underflows to zero or takes seconds
+        if not value:
+            cents = 0
+        elif value.adjusted() >= self.MAX_WHOLE_DIGITS:
+            self.fail('max_whole_digits',
+                      max_whole_digits=self.MAX_WHOLE_DIGITS)
+        elif value.adjusted() < -2:
+            self.fail('max_decimal_places')
+        else:
+            try:
+                cents = value.scaleb(2, context=self.CONTEXT)
+            except DecimalException:
+                self.fail('invalid')
+            if cents != cents.to_integral_value():
+                self.fail('max_decimal_places')
+            cents = int(cents)
+        if self.min_value is not None and cents < self.min_value:
+            self.fail('min_value', min_value=self.to_representation(
+                self.min_value))
+        if self.max_value is not None and cents > self.max_value:
+            self.fail('max_value', max_value=self.to_representation(
+                self.max_value))
+        return cents
+
+    def to_representation(self, cents):
+        sign = '-' if cents < 0 else ''
+        units, cents = divmod(abs(cents), 100)
+        return f'{sign}{units}.{cents:02d}'
+
+
+class TagSerializer(SerializerTimingMixin,
+                    serializers.ModelSerializer):
     """Serializer for tags objects"""
 
     class Meta:
@@ -12,7 +233,8 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(SerializerTimingMixin,
+                           serializers.ModelSerializer):
     """Serializer for ingredient objects"""
 
     class Meta:
@@ -21,34 +243,224 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(SerializerTimingMixin,
+                       serializers.ModelSerializer):
     """Serializer for recipe objects"""
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
 
+    price = CentsField(source='price_cents')
+    thumbnail = serializers.SerializerMethodField()
+    version = serializers.IntegerField(required=False, min_value=1)
+
     class Meta:
         model = Recipe
         fields = ('id', 'title', 'ingredients', 'tags',
-                  'time_minutes', 'price', 'link')
+                  'time_minutes', 'price', 'link', 'thumbnail', 'version')
         read_only_fields = ('id',)
+        list_serializer_class = RecipeListSerializer
+
+    relations = ('tags', 'ingredients')
+
+    def to_representation(self, instance):
+        if not hasattr(instance, '_relation_ids'):
+            names.attach_relation_ids([instance])
+        return super().to_representation(instance)
+
+    def get_thumbnail(self, obj):
+        """Return the URL of the small JPEG variant of the image"""
+        return images.variant_url(obj.image_digest, images.THUMBNAIL_WIDTH)
+
+    def _pop_relations(self, validated_data):
+        return {name: validated_data.pop(name)
+                for name in self.relations if name in validated_data}
+
+    def create(self, validated_data):
+        """Create a recipe, inserting its relations in bulk"""
+        validated_data.pop('version', None)
+        relations = self._pop_relations(validated_data)
+        recipe = super().create(validated_data)
+        for name, objects in relations.items():
+            sync_relation(recipe, name, objects, created=True)
+        return recipe
+
+    def update(self, instance, validated_data):
+        """Update a recipe, applying relation changes as a bulk diff"""
+        relations = self._pop_relations(validated_data)
+        recipe = super().update(instance, validated_data)
+        for name, objects in relations.items():
+            sync_relation(recipe, name, objects)
+        return recipe
 
 
 class RecipeDetailSerializer(RecipeSerializer):
     """Serializer for recipe detail"""
-    ingredients = IngredientSerializer(many=True, read_only=True)
-    tags = TagSerializer(many=True, read_only=True)
+    ingredients = RelationNamesField()
+    tags = RelationNamesField()
 
 
-class RecipeImageSerializer(serializers.ModelSerializer):
+class RecipeImageSerializer(SerializerTimingMixin,
+                            serializers.ModelSerializer):
     """Serializer for uploading images to recipes"""
 
+    variants = serializers.SerializerMethodField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
+        fields = ('id', 'image', 'variants')
         read_only_fields = ('id',)
+
+    def get_variants(self, obj):
+        """Return {width: URL} of the JPEG variants of the image"""
+        if not obj.image_digest:
+            return {}
+        return {str(width): images.variant_url(obj.image_digest, width)
+                for width in images.WIDTHS}
+
+    def update(self, instance, validated_data):
+        """Store an image along with its resized variants
+
+        Only the image columns are written, moving the version on in the
+        same UPDATE, so edits saved since the recipe was read are kept.
+        """
+        if 'image' not in validated_data:
+            return instance
+        image = validated_data['image']
+        instance.image_digest = images.generate(image) if image else ''
+        instance.image = image
+        instance.version = F('version') + 1
+        instance.save(update_fields=['image', 'image_digest', 'version',
+                                     'updated_at'])
+        instance.refresh_from_db(fields=['version'])
+        return instance
+
+
+class RecipeImageVariantSerializer(serializers.Serializer):
+    """Serializer validating the size and format of an image request"""
+    width = serializers.IntegerField(required=False, min_value=1)
+    format = serializers.ChoiceField(choices=list(images.FORMATS),
+                                     required=False)
+
+
+class RecipeFilterSerializer(serializers.Serializer):
+    """Serializer validating the filter parameters of the recipe list"""
+    ORDERING = ('id', 'title', 'time_minutes', 'price')
+
+    tags = IdListField(required=False)
+    ingredients = IdListField(required=False)
+    time_minutes_min = serializers.IntegerField(required=False, min_value=0)
+    time_minutes_max = serializers.IntegerField(required=False, min_value=0)
+    price_min = CentsField(required=False, min_value=0)
+    price_max = CentsField(required=False, min_value=0)
+    ordering = serializers.ChoiceField(
+        choices=ORDERING + tuple(f'-{field}' for field in ORDERING),
+        default='-id'
+    )
+
+    def validate(self, attrs):
+        for field in ('time_minutes', 'price'):
+            low = attrs.get(f'{field}_min')
+            high = attrs.get(f'{field}_max')
+            if low is not None and high is not None and low > high:
+                raise serializers.ValidationError(
+                    {f'{field}_min': f'Must not exceed {field}_max.'}
+                )
+        return attrs
+
+
+class RecipeMatchParamsSerializer(serializers.Serializer):
+    """Serializer validating the parameters of an ingredient match"""
+    ingredients = IdListField()
+    max_missing = serializers.IntegerField(required=False, min_value=0)
+    limit = serializers.IntegerField(default=20, min_value=1, max_value=100)
+
+
+class RecipeBatchParamsSerializer(serializers.Serializer):
+    """Serializer validating the ids of a batch retrieve"""
+    MAX_IDS = 50
+
+    ids = IdListField()
+
+    def validate_ids(self, ids):
+        ids = list(dict.fromkeys(ids))
+        if len(ids) > self.MAX_IDS:
+            raise serializers.ValidationError(
+                f'Ensure there are no more than {self.MAX_IDS} ids.'
+            )
+        return ids
+
+
+class SyncTokenField(serializers.IntegerField):
+    """Sync token, the microseconds since the epoch of a point in time"""
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+    def to_internal_value(self, data):
+        microseconds = super().to_internal_value(data)
+        if microseconds < 0:
+            self.fail('min_value', min_value=0)
+        try:
+            return self.epoch + timedelta(microseconds=microseconds)
+        except OverflowError:
+            self.fail('invalid')
+
+    def to_representation(self, value):
+        return str((value - self.epoch) // timedelta(microseconds=1))
+
+
+class SyncParamsSerializer(serializers.Serializer):
+    """Serializer validating the parameters of a sync request"""
+    since = SyncTokenField(required=False)
+
+
+class SyncSerializer(serializers.Serializer):
+    """Serializer for the changes returned to a syncing client"""
+    token = SyncTokenField(read_only=True)
+    recipes = RecipeSerializer(many=True, read_only=True)
+    tags = TagSerializer(many=True, read_only=True)
+    ingredients = IngredientSerializer(many=True, read_only=True)
+    deleted = serializers.DictField(
+        child=serializers.ListField(child=serializers.IntegerField()),
+        read_only=True
+    )
+
+
+class TagCountSerializer(SerializerTimingMixin,
+                         serializers.ModelSerializer):
+    """Serializer for a tag with the number of recipes using it"""
+
+    class Meta:
+        model = Tag
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = fields
+
+
+class IngredientCountSerializer(SerializerTimingMixin,
+                                serializers.ModelSerializer):
+    """Serializer for an ingredient with the number of recipes using it"""
+
+    class Meta:
+        model = Ingredient
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = fields
+
+
+class RecipeStatsSerializer(SerializerTimingMixin,
+                            serializers.ModelSerializer):
+    """Serializer for the recipe dashboard statistics of a user"""
+    average_time_minutes = serializers.FloatField(read_only=True)
+    average_price = CentsField(source='average_price_cents',
+                               read_only=True)
+    top_tags = TagCountSerializer(many=True, read_only=True)
+    top_ingredients = IngredientCountSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = RecipeSummary
+        fields = ('recipe_count', 'average_time_minutes', 'average_price',
+                  'top_tags', 'top_ingredients')
+        read_only_fields = fields
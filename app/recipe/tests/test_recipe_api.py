@@ -1,15 +1,20 @@
 import tempfile
 import os
+from unittest.mock import patch
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.urls import reverse
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
+from core import images, matching, names, similarity
 from core.models import Recipe, Tag, Ingredient
 
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
@@ -21,6 +26,9 @@ fake.add_provider(providers.internet)
 fake.add_provider(providers.misc)
 
 RECIPE_URL = reverse('recipe:recipe-list')
+STATS_URL = reverse('recipe:recipe-stats')
+MATCH_URL = reverse('recipe:recipe-match')
+BATCH_URL = reverse('recipe:recipe-batch')
 
 
 def image_upload_url(recipe_id):
@@ -28,11 +36,21 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def image_url(recipe_id):
+    """Return url redirecting to a recipe image variant"""
+    return reverse('recipe:recipe-image', args=[recipe_id])
+
+
 def detail_url(recipe_id):
     """Return recipe detail url"""
     return reverse('recipe:recipe-detail', args=[recipe_id])
 
 
+def similar_url(recipe_id):
+    """Return url of the similar recipes of a recipe"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
 def sample_tag(user, name='Main Course'):
     """Create and return a sample tag"""
     return Tag.objects.create(user=user, name=name)
@@ -140,6 +158,24 @@ class RecipePrivateAPITests(TestCase):
         for key in payload.keys():
             self.assertEqual(payload[key], getattr(recipe, key))
 
+    def test_price_stored_in_cents(self):
+        """Test prices keep their string format and are held in cents"""
+        payload = {'title': 'Feast', 'time_minutes': 300, 'price': '1234.5',
+                   'tags': [], 'ingredients': []}
+
+        res = self.client.post(RECIPE_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['price'], '1234.50')
+        self.assertEqual(Recipe.objects.get(id=res.data['id']).price_cents,
+                         123450)
+        for price in ('1.234', 'abc', 'NaN', '1e999', '1e999999',
+                      '9e99999999', '1E+500000', '1e-99999999',
+                      '1.0000000000000000000000000001'):
+            payload['price'] = price
+            res = self.client.post(RECIPE_URL, payload, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_create_recipe_with_tags(self):
         """test creating recipe with tags"""
         tag1 = sample_tag(user=self.user, name='Keto')
@@ -182,6 +218,22 @@ class RecipePrivateAPITests(TestCase):
         self.assertIn(ingr1, ingrs)
         self.assertIn(ingr2, ingrs)
 
+    def test_create_recipe_with_missing_tag(self):
+        """Test creating a recipe with an unknown tag id fails"""
+        tag = sample_tag(user=self.user)
+
+        payload = {
+            'title': 'Mystery Stew',
+            'tags': [tag.id, tag.id + 1000],
+            'time_minutes': 45,
+            'price': 8.00
+        }
+        res = self.client.post(RECIPE_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', res.data)
+        self.assertFalse(Recipe.objects.filter(title='Mystery Stew').exists())
+
     def test_update_partial_recipe(self):
         """Test updating a recipe with patch"""
         recipe = sample_recipe(user=self.user)
@@ -231,6 +283,52 @@ class RecipePrivateAPITests(TestCase):
         tags = recipe.tags.all()
         self.assertEqual(len(tags), 0)
 
+    def test_update_relations_in_bulk(self):
+        """Test relation edits run one delete and one insert per table"""
+        recipe = sample_recipe(user=self.user)
+        ingredients = [sample_ingredient(user=self.user, name=f'Item {i}')
+                       for i in range(10)]
+        recipe.ingredients.add(*ingredients[:5])
+        through = Recipe.ingredients.through._meta.db_table
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.patch(
+                detail_url(recipe.id),
+                {'ingredients': [item.id for item in ingredients[3:]]},
+                format='json'
+            )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertCountEqual(
+            recipe.ingredients.values_list('id', flat=True),
+            [item.id for item in ingredients[3:]]
+        )
+        writes = [query['sql'].split()[0] for query in ctx.captured_queries
+                  if through in query['sql']
+                  and not query['sql'].startswith('SELECT')]
+        self.assertEqual(sorted(writes), ['DELETE', 'INSERT'])
+        ingredients[0].refresh_from_db()
+        ingredients[9].refresh_from_db()
+        self.assertEqual(ingredients[0].recipe_count, 0)
+        self.assertEqual(ingredients[9].recipe_count, 1)
+
+    def test_delete_recipe_hides_it(self):
+        """Test a deleted recipe disappears from the API before purging"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        recipe.tags.add(tag)
+
+        res = self.client.delete(detail_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(RECIPE_URL).data, [])
+        res = self.client.get(detail_url(recipe.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.get(reverse('recipe:tag-list'),
+                              {'assigned_only': 1})
+        self.assertEqual(res.data, [])
+        self.assertEqual(self.client.get(STATS_URL).data['recipe_count'], 0)
+
     def test_filter_recipes_by_tags(self):
         """Test returning recipes with specific tags"""
         recipe1 = sample_recipe(user=self.user, title='Thai Vegetable Curry')
@@ -277,6 +375,183 @@ class RecipePrivateAPITests(TestCase):
         self.assertIn(serializer2.data, res.data)
         self.assertNotIn(serializer3.data, res.data)
 
+    def test_filter_recipes_by_time_and_price(self):
+        """Test returning recipes within time and price ranges"""
+        quick = sample_recipe(user=self.user, time_minutes=20, price=8.00)
+        sample_recipe(user=self.user, time_minutes=45, price=8.00)
+        sample_recipe(user=self.user, time_minutes=20, price=15.00)
+
+        res = self.client.get(
+            RECIPE_URL,
+            {'time_minutes_max': 30, 'price_max': '10.00'}
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['id'] for recipe in res.data], [quick.id])
+
+    def test_order_recipes(self):
+        """Test ordering recipes by a requested field"""
+        recipe1 = sample_recipe(user=self.user, price=9.00)
+        recipe2 = sample_recipe(user=self.user, price=3.00)
+        recipe3 = sample_recipe(user=self.user, price=6.00)
+
+        res = self.client.get(RECIPE_URL, {'ordering': 'price'})
+
+        self.assertEqual([recipe['id'] for recipe in res.data],
+                         [recipe2.id, recipe3.id, recipe1.id])
+
+    def test_invalid_filters_rejected(self):
+        """Test malformed filter parameters return a bad request"""
+        invalid = (
+            {'tags': '1,abc'},
+            {'ingredients': '-1'},
+            {'time_minutes_min': 'soon'},
+            {'price_max': '1e999'},
+            {'price_max': '9e99999999'},
+            {'price_min': '1E+500000'},
+            {'price_min': '1e-99999999'},
+            {'price_min': '10', 'price_max': '5'},
+            {'ordering': 'password'},
+        )
+        for params in invalid:
+            res = self.client.get(RECIPE_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST,
+                             params)
+
+    def test_range_filter_uses_index(self):
+        """Test the range filters are served by the composite indexes"""
+        queryset = Recipe.objects.filter(user=self.user, time_minutes__lte=30)
+        index = Recipe._meta.indexes[0]
+        if connection.vendor == 'postgresql':
+            # A near empty table is cheaper to scan than to index
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+
+        plan = queryset.explain()
+
+        self.assertIn(index.name, plan)
+
+    def test_batch_retrieve(self):
+        """Test retrieving the details of several recipes at once"""
+        recipe1 = sample_recipe(user=self.user, title='Curry')
+        recipe1.tags.add(sample_tag(user=self.user))
+        recipe2 = sample_recipe(user=self.user, title='Soup')
+        recipe2.ingredients.add(sample_ingredient(user=self.user))
+        user2 = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        other = sample_recipe(user=user2)
+        ids = [recipe2.id, other.id, recipe1.id, recipe2.id, 999999]
+        names.get(self.user.id)
+
+        with CaptureQueriesContext(connection) as queries, \
+                patch('core.names.cache', wraps=cache) as shared:
+            res = self.client.get(BATCH_URL,
+                                  {'ids': ','.join(map(str, ids))})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(queries), 4)
+        # One version stamp read for the names of every recipe
+        self.assertEqual(shared.get.call_count, 1)
+        self.assertEqual(
+            [(item['id'], item['status']) for item in res.data],
+            [(recipe2.id, 200), (other.id, 404), (recipe1.id, 200),
+             (999999, 404)]
+        )
+        self.assertEqual(res.data[0]['recipe'],
+                         RecipeDetailSerializer(recipe2).data)
+        self.assertEqual(res.data[2]['recipe'],
+                         RecipeDetailSerializer(recipe1).data)
+
+    def test_batch_retrieve_invalid(self):
+        """Test batch retrieve rejects bad or too many ids"""
+        too_many = ','.join(str(pk) for pk in range(1, 52))
+        for ids in ('', 'a,b', too_many):
+            res = self.client.get(BATCH_URL, {'ids': ids})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_match_recipes(self):
+        """Test ranking recipes by the ingredients the user has"""
+        matching.clear()
+        rice = sample_ingredient(user=self.user, name='Rice')
+        egg = sample_ingredient(user=self.user, name='Egg')
+        ham = sample_ingredient(user=self.user, name='Ham')
+        omelette = sample_recipe(user=self.user, title='Omelette')
+        omelette.ingredients.add(egg)
+        fried_rice = sample_recipe(user=self.user, title='Fried Rice')
+        fried_rice.ingredients.add(rice, egg, ham)
+        sample_recipe(user=self.user, title='Toast')
+
+        res = self.client.get(MATCH_URL,
+                              {'ingredients': f'{rice.id},{egg.id}'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['recipe']['title'], row['matched'], row['missing'])
+             for row in res.data],
+            [('Omelette', 1, 0), ('Fried Rice', 2, 1)]
+        )
+        res = self.client.get(MATCH_URL, {'ingredients': 'rice'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_similar_recipes(self):
+        """Test listing the precomputed similar recipes of a recipe"""
+        rice = sample_ingredient(user=self.user, name='Rice')
+        curry = sample_recipe(user=self.user, title='Curry')
+        pilaf = sample_recipe(user=self.user, title='Pilaf')
+        risotto = sample_recipe(user=self.user, title='Risotto')
+        for recipe in (curry, pilaf, risotto):
+            recipe.ingredients.add(rice)
+        similarity.refresh_user(self.user.id)
+        risotto.soft_delete()
+
+        res = self.client.get(similar_url(curry.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{
+            'recipe': RecipeSerializer(pilaf).data,
+            'score': 1.0,
+        }])
+        user2 = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        other = sample_recipe(user=user2, title='Other')
+        res = self.client.get(similar_url(other.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_recipe_stats(self):
+        """Test the stats endpoint summarizes the user's recipes"""
+        vegan = sample_tag(user=self.user, name='Vegan')
+        quick = sample_tag(user=self.user, name='Quick')
+        tofu = sample_ingredient(user=self.user, name='Tofu')
+        recipe1 = sample_recipe(user=self.user, time_minutes=10, price=4.00)
+        recipe2 = sample_recipe(user=self.user, time_minutes=30, price=8.00)
+        recipe1.tags.add(vegan, quick)
+        recipe2.tags.add(vegan)
+        recipe2.ingredients.add(tofu)
+        other = get_user_model().objects.create_user(
+            email=fake.email(domain="yahoo.com"),
+            password=fake.password()
+        )
+        sample_recipe(user=other, time_minutes=500, price=99.00)
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['average_time_minutes'], 20)
+        self.assertEqual(res.data['average_price'], '6.00')
+        self.assertEqual(
+            [(tag['name'], tag['recipe_count'])
+             for tag in res.data['top_tags']],
+            [('Vegan', 2), ('Quick', 1)]
+        )
+        self.assertEqual(res.data['top_ingredients'][0]['name'], 'Tofu')
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -307,6 +582,51 @@ class RecipeImageUploadTests(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertTrue(self.recipe.image_digest)
+        self.assertEqual(
+            res.data['variants']['160'],
+            images.variant_url(self.recipe.image_digest, 160)
+        )
+
+        res = self.client.get(image_url(self.recipe.id),
+                              {'width': 200}, HTTP_ACCEPT='image/webp')
+
+        self.assertEqual(res.status_code, status.HTTP_302_FOUND)
+        self.assertEqual(
+            res['Location'],
+            images.variant_url(self.recipe.image_digest, 320, 'webp')
+        )
+
+    def test_upload_image_keeps_concurrent_edit(self):
+        """Test an upload writes only the image and bumps the version,
+        keeping changes saved while the image was processed
+        """
+        url = image_upload_url(self.recipe.id)
+        generate = images.generate
+
+        def edit_then_generate(file):
+            Recipe.objects.filter(pk=self.recipe.pk).update(title='Soup',
+                                                            version=2)
+            return generate(file)
+
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            with patch('core.images.generate', edit_then_generate):
+                res = self.client.post(url, {'image': ntf},
+                                       format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Soup')
+        self.assertEqual(self.recipe.version, 3)
+        self.assertTrue(self.recipe.image_digest)
+
+    def test_image_without_upload(self):
+        """Test requesting the image of a recipe without one"""
+        res = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
 
     def test_upload_image_bad_requrest(self):
         """Test uploading a bad image"""
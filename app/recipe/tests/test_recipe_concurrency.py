@@ -0,0 +1,139 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.test import TestCase, TransactionTestCase, \
+                        skipUnlessDBFeature
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from faker import Faker, providers
+
+from core.models import Recipe, RecipeSummary, Tag
+
+from recipe.views import RecipeViewSet
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+
+def detail_url(recipe_id):
+    """Return recipe detail url"""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+class RecipeVersionTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                            time_minutes=10, price=5)
+
+    def test_update_increments_version(self):
+        """Test each update moves the recipe to the next version"""
+        url = detail_url(self.recipe.id)
+
+        res = self.client.patch(url, {'title': 'Hot Curry', 'version': 1})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['version'], 2)
+
+        res = self.client.patch(url, {'title': 'Mild Curry'})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['version'], 3)
+
+    def test_stale_version_conflict(self):
+        """Test an update from a stale version gets 409 and the current
+        recipe
+        """
+        Recipe.objects.filter(pk=self.recipe.pk).update(version=2,
+                                                        title='Soup')
+
+        res = self.client.patch(detail_url(self.recipe.id),
+                                {'title': 'Hot Curry', 'version': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(res.data['recipe']['title'], 'Soup')
+        self.assertEqual(res.data['recipe']['version'], 2)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Soup')
+
+    def test_delete_bumps_version(self):
+        """Test deleting a recipe moves its version on"""
+        res = self.client.delete(detail_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_update_after_concurrent_delete(self):
+        """Test an update of a recipe deleted after it was loaded fails
+        instead of bringing it back
+        """
+        perform_update = RecipeViewSet.perform_update
+
+        def delete_then_update(view, serializer):
+            Recipe.objects.get(pk=self.recipe.pk).soft_delete()
+            perform_update(view, serializer)
+
+        with patch.object(RecipeViewSet, 'perform_update',
+                          delete_then_update):
+            res = self.client.patch(detail_url(self.recipe.id),
+                                    {'title': 'Hot Curry'})
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.recipe.refresh_from_db()
+        self.assertIsNotNone(self.recipe.deleted_at)
+        self.assertEqual(self.recipe.title, 'Curry')
+        self.assertEqual(
+            RecipeSummary.objects.get(user=self.user).recipe_count, 0
+        )
+
+
+# SQLite locks whole tables and fails concurrent writers outright
+@skipUnlessDBFeature('has_select_for_update')
+class RecipeConcurrencyTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.recipe = Recipe.objects.create(user=self.user, title='Curry',
+                                            time_minutes=10, price=5)
+        self.tags = [Tag.objects.create(user=self.user, name=f'Tag {index}')
+                     for index in range(8)]
+
+    def _patch(self, tag):
+        """PATCH the recipe from version 1 on a thread of its own"""
+        client = APIClient()
+        client.force_authenticate(self.user)
+        try:
+            return client.patch(detail_url(self.recipe.id),
+                                {'tags': [tag.id], 'version': 1},
+                                format='json')
+        finally:
+            connections.close_all()
+
+    def test_concurrent_updates(self):
+        """Test only one of many concurrent updates of a version wins"""
+        with ThreadPoolExecutor(max_workers=len(self.tags)) as pool:
+            responses = list(pool.map(self._patch, self.tags))
+
+        codes = sorted(res.status_code for res in responses)
+        self.assertEqual(codes, [status.HTTP_200_OK] +
+                         [status.HTTP_409_CONFLICT] * (len(self.tags) - 1))
+        winner = next(res for res in responses
+                      if res.status_code == status.HTTP_200_OK)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+        self.assertEqual(list(self.recipe.tags.values_list('id', flat=True)),
+                         winner.data['tags'])
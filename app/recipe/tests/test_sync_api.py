@@ -0,0 +1,113 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+from faker import Faker, providers
+
+fake = Faker()
+fake.add_provider(providers.internet)
+fake.add_provider(providers.misc)
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def sample_recipe(user, **params):
+    """Create and return a sample recipe"""
+    defaults = {
+        'title': 'Sample recipe',
+        'time_minutes': 10,
+        'price': 5.00
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class SyncPublicAPITests(TestCase):
+    """Test the publicly available sync API"""
+
+    def test_login_required(self):
+        """Test that login is required to sync"""
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class SyncPrivateAPITests(TestCase):
+    """Test the authorized user sync API"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def age(self, *objects):
+        """Move the last change of objects an hour into the past"""
+        past = timezone.now() - timedelta(hours=1)
+        for obj in objects:
+            type(obj).objects.filter(pk=obj.pk).update(updated_at=past)
+
+    def test_full_sync(self):
+        """Test a sync without a token returns every row of the user"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        ingredient = Ingredient.objects.create(user=self.user, name='Tofu')
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(tag)
+        other = get_user_model().objects.create_user(
+            email=fake.email(),
+            password=fake.password()
+        )
+        Tag.objects.create(user=other, name='Private')
+
+        res = self.client.get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data['recipes']], [recipe.id])
+        self.assertEqual(res.data['recipes'][0]['tags'], [tag.id])
+        self.assertEqual([t['id'] for t in res.data['tags']], [tag.id])
+        self.assertEqual([i['id'] for i in res.data['ingredients']],
+                         [ingredient.id])
+        self.assertEqual(res.data['deleted'],
+                         {'recipes': [], 'tags': [], 'ingredients': []})
+        self.assertTrue(res.data['token'].isdigit())
+
+    def test_delta_sync(self):
+        """Test a sync with a token returns only the changes since it"""
+        unchanged = Tag.objects.create(user=self.user, name='Vegan')
+        changed = sample_recipe(user=self.user)
+        removed = Ingredient.objects.create(user=self.user, name='Tofu')
+        self.age(unchanged, changed, removed)
+        token = self.client.get(SYNC_URL).data['token']
+
+        changed.title = 'Tofu Curry'
+        changed.save()
+        removed_id = removed.id
+        removed.delete()
+        added = Tag.objects.create(user=self.user, name='Quick')
+
+        res = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['title'] for r in res.data['recipes']],
+                         ['Tofu Curry'])
+        self.assertEqual([t['id'] for t in res.data['tags']], [added.id])
+        self.assertEqual(res.data['ingredients'], [])
+        self.assertEqual(res.data['deleted']['ingredients'], [removed_id])
+
+    def test_invalid_token(self):
+        """Test malformed sync tokens return a bad request"""
+        for since in ('yesterday', '-1', '9' * 30):
+            res = self.client.get(SYNC_URL, {'since': since})
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,10 +1,12 @@
+from django.conf import settings
 from django.urls import path, include
-from rest_framework.routers import DefaultRouter
+from rest_framework.routers import DefaultRouter, SimpleRouter
 
 from recipe import views
 
 
-router = DefaultRouter()
+# The browsable API root and format suffixes only serve humans
+router = SimpleRouter() if settings.API_ONLY else DefaultRouter()
 router.register('tags', views.TagViewSet)
 router.register('ingredient', views.IngredientViewSet)
 router.register('recipe', views.RecipeViewSet)
@@ -12,5 +14,6 @@ router.register('recipe', views.RecipeViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('sync/', views.SyncView.as_view(), name='sync'),
     path('', include(router.urls))
 ]
@@ -1,14 +1,43 @@
+from datetime import timedelta
+
+from django.db.models import F
+from django.http import Http404
+from django.utils import timezone
+
 from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.negotiation import BaseContentNegotiation
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 
-from core.models import Tag, Ingredient, Recipe
+from core import images, matching, outbox, sharding, summary
+from core.idempotency import idempotent
+from core.budgets import query_budget
+from core.models import Tag, Ingredient, Recipe, RecipeNeighbor, \
+                        Tombstone
 from recipe import serializers
 
 
+class VersionConflict(Exception):
+    """Raised when a recipe changed since the version being updated"""
+
+
+class FirstRendererNegotiation(BaseContentNegotiation):
+    """Skip negotiation for responses without a body, such as redirects
+    requested with an image Accept header
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+@query_budget(list=2, create=6)
 class BaseRecipeAttrViewset(viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
@@ -19,14 +48,22 @@ class BaseRecipeAttrViewset(viewsets.GenericViewSet,
     def get_queryset(self):
         """Return objects for the authenticated current user only"""
         assigned_only = bool(self.request.query_params.get('assigned_only'))
-        queryset = self.queryset
+        queryset = sharding.for_user(self.queryset, self.request.user)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(recipe__isnull=False,
+                                       recipe__deleted_at__isnull=True)
         return queryset.filter(user=self.request.user).order_by('-name')
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a new object, once per Idempotency-Key"""
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """Create a new object"""
-        serializer.save(user=self.request.user)
+        with outbox.atomic(self.request.user):
+            obj = serializer.save(user=self.request.user)
+            outbox.record(obj, 'created', serializer.data)
 
 
 class TagViewSet(BaseRecipeAttrViewset):
@@ -43,43 +80,226 @@ class IngredientViewSet(BaseRecipeAttrViewset):
     serializer_class = serializers.IngredientSerializer
 
 
+@query_budget(list=3, retrieve=4, create=15, update=19, partial_update=19,
+              destroy=8, upload_image=8, stats=4, match=4, similar=5,
+              image=2, batch=4)
 class RecipeViewSet(viewsets.ModelViewSet):
     """Manage recipes in the database"""
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
     authentication_classes = (TokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    stats_top = 5
+    # Range filter and ordering parameter to the column it applies to
+    range_columns = {'time_minutes': 'time_minutes', 'price': 'price_cents'}
 
-    def _params_to_ints(self, qs):
-        """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+    def _filter_params(self):
+        """Return the validated filter query parameters, 400 if invalid"""
+        params = {key: value
+                  for key, value in self.request.query_params.items()
+                  if value != ''}
+        serializer = serializers.RecipeFilterSerializer(data=params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
 
     def get_queryset(self):
         """Return objects for the authenticated current user only"""
-        tags = self.request.query_params.get('tags')
-        ingredients = self.request.query_params.get('ingredients')
-        queryset = self.queryset
-        if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
-        if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
-        return queryset.filter(user=self.request.user)
+        params = self._filter_params()
+        queryset = sharding.for_user(self.queryset, self.request.user)
+        if 'tags' in params:
+            queryset = queryset.filter(tags__id__in=params['tags'])
+        if 'ingredients' in params:
+            queryset = queryset.filter(
+                ingredients__id__in=params['ingredients']
+            )
+        for field, column in self.range_columns.items():
+            if f'{field}_min' in params:
+                queryset = queryset.filter(
+                    **{f'{column}__gte': params[f'{field}_min']}
+                )
+            if f'{field}_max' in params:
+                queryset = queryset.filter(
+                    **{f'{column}__lte': params[f'{field}_max']}
+                )
+        field = params['ordering'].lstrip('-')
+        prefix = params['ordering'][:-len(field)]
+        ordering = [prefix + self.range_columns.get(field, field)]
+        if field != 'id':
+            ordering.append('-id')
+        return queryset.filter(user=self.request.user,
+                               deleted_at__isnull=True).order_by(*ordering)
 
     def get_serializer_class(self):
         """Return appropriate serializer class"""
-        if self.action == 'retrieve':
+        if self.action in ('retrieve', 'batch'):
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'stats':
+            return serializers.RecipeStatsSerializer
         return serializers.RecipeSerializer
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a new recipe, once per Idempotency-Key"""
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         """Create a new recipe"""
-        serializer.save(user=self.request.user)
+        with outbox.atomic(self.request.user):
+            recipe = serializer.save(user=self.request.user)
+            outbox.record(recipe, 'created', serializer.data)
+
+    def update(self, request, *args, **kwargs):
+        """Update a recipe, answering 409 with its current state if it
+        changed since the version the client sent or last read
+        """
+        try:
+            return super().update(request, *args, **kwargs)
+        except VersionConflict:
+            recipe = self.get_object()
+            return Response(
+                {'detail': 'The recipe was changed by another request.',
+                 'recipe': serializers.RecipeDetailSerializer(recipe).data},
+                status=status.HTTP_409_CONFLICT
+            )
+
+    def perform_update(self, serializer):
+        """Update a recipe if it is still at the expected version and
+        has not been deleted since it was loaded
+
+        The compare and swap keeps the row locked until commit, so
+        concurrent updates of its tags and ingredients cannot interleave.
+        """
+        user = self.request.user
+        recipe = serializer.instance
+        expected = serializer.validated_data.pop('version', recipe.version)
+        with outbox.atomic(user):
+            claimed = Recipe.objects.using(sharding.shard_for_user(user.pk)) \
+                .filter(pk=recipe.pk, version=expected,
+                        deleted_at__isnull=True) \
+                .update(version=F('version') + 1)
+            if not claimed:
+                raise VersionConflict
+            recipe.version = expected + 1
+            recipe = serializer.save()
+            outbox.record(recipe, 'updated', serializer.data)
+
+    def perform_destroy(self, instance):
+        """Delete a recipe"""
+        with outbox.atomic(self.request.user):
+            outbox.record(instance, 'deleted', {'id': instance.pk})
+            instance.soft_delete()
+
+    @action(methods=['GET'], detail=False)
+    def stats(self, request):
+        """Return dashboard statistics of the user's recipes"""
+        user = request.user
+        using = sharding.db_for_user(user)
+        stats = summary.get_summary(user, using)
+        stats.top_tags = Tag.objects.using(using) \
+            .filter(user=user, recipe_count__gt=0) \
+            .order_by('-recipe_count', 'name')[:self.stats_top]
+        stats.top_ingredients = Ingredient.objects.using(using) \
+            .filter(user=user, recipe_count__gt=0) \
+            .order_by('-recipe_count', 'name')[:self.stats_top]
+        serializer = self.get_serializer(stats)
+        return Response(serializer.data)
+
+    @action(methods=['GET'], detail=False)
+    def batch(self, request):
+        """Return the details of several recipes in one request, reporting
+        ids that do not exist or belong to another user per item
+        """
+        params = serializers.RecipeBatchParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        ids = params.validated_data['ids']
+
+        recipes = self.get_queryset().in_bulk(ids)
+        data = iter(self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        ).data)
+        return Response([
+            {'id': pk, 'status': status.HTTP_200_OK, 'recipe': next(data)}
+            if pk in recipes else
+            {'id': pk, 'status': status.HTTP_404_NOT_FOUND,
+             'detail': 'Not found.'}
+            for pk in ids
+        ])
+
+    @action(methods=['GET'], detail=False)
+    def match(self, request):
+        """Rank the user's recipes by how well the given ingredients
+        cover them, fewest missing ingredients first
+        """
+        params = serializers.RecipeMatchParamsSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        params = params.validated_data
+        user = request.user
+
+        index = matching.get(user.pk, sharding.db_for_user(user))
+        ranked = index.match(params['ingredients'], params['limit'],
+                             params.get('max_missing'))
+        recipes = sharding.for_user(Recipe.objects.all(), user) \
+            .filter(user=user, deleted_at__isnull=True) \
+            .in_bulk([recipe_id for recipe_id, *_ in ranked])
+        ranked = [row for row in ranked if row[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, *_ in ranked], many=True
+        ).data
+        return Response([
+            {'recipe': recipe, 'matched': matched, 'missing': missing,
+             'coverage': round(coverage, 4)}
+            for recipe, (_, matched, missing, coverage) in zip(data, ranked)
+        ])
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes sharing the most tags and ingredients with a
+        recipe, as last computed by refresh_recipe_neighbors
+        """
+        recipe = self.get_object()
+        neighbors = RecipeNeighbor.objects.using(recipe._state.db) \
+            .filter(recipe=recipe, neighbor__deleted_at__isnull=True) \
+            .select_related('neighbor').order_by('rank')
+        neighbors = list(neighbors)
+        data = self.get_serializer(
+            [neighbor.neighbor for neighbor in neighbors], many=True
+        ).data
+        return Response([
+            {'recipe': recipe, 'score': round(neighbor.score, 4)}
+            for recipe, neighbor in zip(data, neighbors)
+        ])
+
+    @action(methods=['GET'], detail=True,
+            content_negotiation_class=FirstRendererNegotiation)
+    def image(self, request, pk=None):
+        """Redirect to the image variant closest to a requested width,
+        in WebP if the client accepts it unless a format is given
+        """
+        params = serializers.RecipeImageVariantSerializer(
+            data=request.query_params
+        )
+        params.is_valid(raise_exception=True)
+        recipe = self.get_object()
+        if not recipe.image_digest:
+            raise Http404
+        width, fmt = images.pick(params.validated_data.get('width'),
+                                 params.validated_data.get('format'),
+                                 request.META.get('HTTP_ACCEPT', ''))
+        response = Response(status=status.HTTP_302_FOUND)
+        response['Location'] = images.variant_url(recipe.image_digest,
+                                                  width, fmt)
+        response['Cache-Control'] = 'private, max-age=3600'
+        response['Vary'] = 'Accept'
+        return response
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
+    @idempotent
     def upload_image(self, request, pk=None):
         """Upload an image to a recipe"""
         recipe = self.get_object()
@@ -88,7 +308,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
             data=request.data
         )
         if serializer.is_valid():
-            serializer.save()
+            with outbox.atomic(request.user):
+                recipe = serializer.save()
+                outbox.record(recipe, 'image_uploaded', serializer.data)
             return Response(
                 serializer.data,
                 status=status.HTTP_200_OK
@@ -98,3 +320,47 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 serializer.errors,
                 status=status.HTTP_400_BAD_REQUEST
             )
+
+
+@query_budget(get=6)
+class SyncView(APIView):
+    """Return the recipe data of the user changed since a sync token"""
+    authentication_classes = (TokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+    # Rows saved in transactions still open when a token was issued get
+    # an updated_at before it, so every sync looks back this much further.
+    overlap = timedelta(seconds=5)
+
+    def get(self, request):
+        """Return every row without since, otherwise only the changes"""
+        params = serializers.SyncParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        since = params.validated_data.get('since')
+        token = timezone.now()
+        user = request.user
+
+        recipes = Recipe.objects.filter(user=user, deleted_at__isnull=True)
+        tags = Tag.objects.filter(user=user)
+        ingredients = Ingredient.objects.filter(user=user)
+        deleted = {Tombstone.RECIPE: [], Tombstone.TAG: [],
+                   Tombstone.INGREDIENT: []}
+        if since is not None:
+            since -= self.overlap
+            recipes = recipes.filter(updated_at__gte=since)
+            tags = tags.filter(updated_at__gte=since)
+            ingredients = ingredients.filter(updated_at__gte=since)
+            tombstones = Tombstone.objects.filter(user=user,
+                                                  deleted_at__gte=since)
+            for kind, object_id in sharding.for_user(tombstones, user) \
+                    .values_list('kind', 'object_id'):
+                deleted[kind].append(object_id)
+
+        changes = {
+            'token': token,
+            'recipes': sharding.for_user(recipes, user).order_by('id'),
+            'tags': sharding.for_user(tags, user).order_by('id'),
+            'ingredients': sharding.for_user(ingredients, user)
+            .order_by('id'),
+            'deleted': {f'{kind}s': ids for kind, ids in deleted.items()},
+        }
+        return Response(serializers.SyncSerializer(changes).data)
@@ -155,3 +155,12 @@ class PrivateUserAPITests(TestCase):
         self.assertEqual(self.user.name, payload["name"])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_delete_user_deactivates(self):
+        """Test deleting the profile deactivates the user until purged"""
+        res = self.client.delete(ME_URL)
+
+        self.user.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(self.user.is_active)
+        self.assertIsNotNone(self.user.deleted_at)
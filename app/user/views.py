@@ -3,21 +3,25 @@ from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 
 
+from core.budgets import query_budget
 from user.serializers import UserSerializer, AuthTokenSerializer
 
 
+@query_budget(post=3)
 class CreateUserView(generics.CreateAPIView):
     """Create a new user in the DB"""
     serializer_class = UserSerializer
 
 
+@query_budget(post=3)
 class CreateTokenView(ObtainAuthToken):
     """Create a new auth token for user"""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
 
 
-class ManageUserView(generics.RetrieveUpdateAPIView):
+@query_budget(get=1, put=4, patch=4, delete=2)
+class ManageUserView(generics.RetrieveUpdateDestroyAPIView):
     """Manage the authenticated user"""
     serializer_class = UserSerializer
     authentication_classes = (authentication.TokenAuthentication,)
@@ -26,3 +30,7 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     def get_object(self):
         """Retreive and return authenticated user"""
         return self.request.user
+
+    def perform_destroy(self, instance):
+        """Deactivate the user now and purge their data in the background"""
+        instance.soft_delete()